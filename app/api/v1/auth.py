@@ -7,16 +7,15 @@ from datetime import datetime
 from app.external.spotify_client import spotify_client
 from app.auth.jwt_handler import jwt_handler
 from app.auth.middleware import get_current_user, get_current_active_user
+from app.auth.token_manager import token_manager, TokenNotFoundError, TokenRefreshError
+from app.auth.token_store import token_store
 from app.models.user import SpotifyAuthCallback, SpotifyTokens, User
+from app.services.spotify_service import spotify_ingestion_service
 
 logger = logging.getLogger(__name__)
 
 router = APIRouter()
 
-# In-memory storage per demo - in produzione usare Redis o database
-auth_states = {}
-user_tokens = {}  # spotify_user_id -> tokens
-
 @router.get("/spotify/login")
 async def spotify_login():
     """Inizia il flusso OAuth2 con Spotify"""
@@ -24,11 +23,10 @@ async def spotify_login():
         # Genera state token per sicurezza
         state = jwt_handler.create_state_token()
         
-        # Salva state (in produzione usare Redis con TTL)
-        auth_states[state] = {
-            "created_at": datetime.utcnow(),
-            "used": False
-        }
+        # Salva state con scadenza (OAUTH_STATE_TTL_SECONDS)
+        await token_store.save_state(state, {
+            "created_at": datetime.utcnow().isoformat()
+        })
         
         # Ottieni URL di autorizzazione
         auth_url = spotify_client.get_authorization_url(state=state)
@@ -49,18 +47,15 @@ async def spotify_login():
 async def spotify_callback(code: str, state: str = None):
     """Gestisce il callback OAuth2 da Spotify"""
     try:
-        # Verifica state token
-        if state and state in auth_states:
-            state_data = auth_states[state]
-            if state_data["used"]:
+        # Verifica state token (consumo atomico: utilizzabile una sola volta)
+        if state:
+            if await token_store.consume_state(state) is None:
                 raise HTTPException(
                     status_code=status.HTTP_400_BAD_REQUEST,
-                    detail="State token already used"
+                    detail="State token invalid, expired or already used"
                 )
-            # Marca come usato
-            auth_states[state]["used"] = True
         else:
-            logger.warning("Invalid or missing state token in callback")
+            logger.warning("Missing state token in callback")
         
         # Scambia codice con token
         tokens = await spotify_client.exchange_code_for_token(code)
@@ -71,12 +66,13 @@ async def spotify_callback(code: str, state: str = None):
         spotify_user_id = user_profile["id"]
         
         # Salva tokens (in produzione salvare in database criptati)
-        user_tokens[spotify_user_id] = {
-            "access_token": tokens["access_token"],
-            "refresh_token": tokens["refresh_token"],
-            "expires_at": datetime.utcnow().timestamp() + tokens["expires_in"],
-            "user_profile": user_profile
-        }
+        await token_manager.save_tokens(spotify_user_id, tokens, user_profile)
+        
+        # Registra l'accesso: gli utenti attivi vengono ri-sincronizzati più spesso
+        try:
+            await spotify_ingestion_service.record_user_access(spotify_user_id)
+        except Exception as e:
+            logger.warning(f"Failed to record access for {spotify_user_id}: {str(e)}")
         
         # Crea JWT token per l'applicazione
         jwt_payload = {
@@ -108,32 +104,22 @@ async def get_current_user_info(current_user: dict = Depends(get_current_active_
     try:
         spotify_user_id = current_user["spotify_user_id"]
         
-        # Ottieni tokens salvati
-        if spotify_user_id not in user_tokens:
+        # Ottiene un token valido (rinnovo coalescente se scaduto)
+        try:
+            await token_manager.get_access_token(spotify_user_id)
+        except TokenNotFoundError:
             raise HTTPException(
                 status_code=status.HTTP_401_UNAUTHORIZED,
                 detail="Spotify tokens not found. Please re-authenticate."
             )
+        except TokenRefreshError as e:
+            logger.error(f"Failed to refresh token for user {spotify_user_id}: {str(e)}")
+            raise HTTPException(
+                status_code=status.HTTP_401_UNAUTHORIZED,
+                detail="Token expired and refresh failed. Please re-authenticate."
+            )
         
-        user_data = user_tokens[spotify_user_id]
-        
-        # Controlla se il token è ancora valido
-        if datetime.utcnow().timestamp() > user_data["expires_at"]:
-            # Token scaduto, prova a rinnovarlo
-            try:
-                new_tokens = await spotify_client.refresh_access_token(user_data["refresh_token"])
-                user_data["access_token"] = new_tokens["access_token"]
-                user_data["expires_at"] = datetime.utcnow().timestamp() + new_tokens["expires_in"]
-                
-                if "refresh_token" in new_tokens:
-                    user_data["refresh_token"] = new_tokens["refresh_token"]
-                    
-            except Exception as e:
-                logger.error(f"Failed to refresh token for user {spotify_user_id}: {str(e)}")
-                raise HTTPException(
-                    status_code=status.HTTP_401_UNAUTHORIZED,
-                    detail="Token expired and refresh failed. Please re-authenticate."
-                )
+        user_data = await token_manager.get_user_data(spotify_user_id)
         
         return {
             "spotify_user_id": spotify_user_id,
@@ -157,24 +143,15 @@ async def refresh_token(current_user: dict = Depends(get_current_active_user)):
     try:
         spotify_user_id = current_user["spotify_user_id"]
         
-        if spotify_user_id not in user_tokens:
+        try:
+            # Rinnova token (coalescente con eventuali refresh già in corso)
+            user_data = await token_manager.refresh(spotify_user_id, force=True)
+        except TokenNotFoundError:
             raise HTTPException(
                 status_code=status.HTTP_401_UNAUTHORIZED,
                 detail="User tokens not found"
             )
         
-        user_data = user_tokens[spotify_user_id]
-        
-        # Rinnova token
-        new_tokens = await spotify_client.refresh_access_token(user_data["refresh_token"])
-        
-        # Aggiorna tokens salvati
-        user_data["access_token"] = new_tokens["access_token"]
-        user_data["expires_at"] = datetime.utcnow().timestamp() + new_tokens["expires_in"]
-        
-        if "refresh_token" in new_tokens:
-            user_data["refresh_token"] = new_tokens["refresh_token"]
-        
         return {
             "message": "Token refreshed successfully",
             "expires_at": user_data["expires_at"]
@@ -194,8 +171,7 @@ async def logout(current_user: dict = Depends(get_current_active_user)):
         spotify_user_id = current_user["spotify_user_id"]
         
         # Rimuovi tokens (in produzione cancellare dal database)
-        if spotify_user_id in user_tokens:
-            del user_tokens[spotify_user_id]
+        await token_manager.remove(spotify_user_id)
         
         return {"message": "Logged out successfully"}
         
@@ -211,30 +187,16 @@ async def get_valid_spotify_token(current_user: dict = Depends(get_current_activ
     """Dependency per ottenere un token Spotify valido"""
     spotify_user_id = current_user["spotify_user_id"]
     
-    if spotify_user_id not in user_tokens:
+    try:
+        return await token_manager.get_access_token(spotify_user_id)
+    except TokenNotFoundError:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Spotify tokens not found. Please re-authenticate."
         )
-    
-    user_data = user_tokens[spotify_user_id]
-    
-    # Controlla se il token è scaduto
-    if datetime.utcnow().timestamp() > user_data["expires_at"]:
-        # Token scaduto, prova a rinnovarlo
-        try:
-            new_tokens = await spotify_client.refresh_access_token(user_data["refresh_token"])
-            user_data["access_token"] = new_tokens["access_token"]
-            user_data["expires_at"] = datetime.utcnow().timestamp() + new_tokens["expires_in"]
-            
-            if "refresh_token" in new_tokens:
-                user_data["refresh_token"] = new_tokens["refresh_token"]
-                
-        except Exception as e:
-            logger.error(f"Failed to refresh token: {str(e)}")
-            raise HTTPException(
-                status_code=status.HTTP_401_UNAUTHORIZED,
-                detail="Token expired and refresh failed. Please re-authenticate."
-            )
-    
-    return user_data["access_token"]
+    except TokenRefreshError as e:
+        logger.error(f"Failed to refresh token: {str(e)}")
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Token expired and refresh failed. Please re-authenticate."
+        )
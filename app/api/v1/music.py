@@ -1,11 +1,17 @@
-from fastapi import APIRouter, HTTPException, Depends, status, BackgroundTasks
-from typing import Dict, Any
+from fastapi import APIRouter, HTTPException, Depends, status
+from fastapi.responses import StreamingResponse
+from typing import AsyncIterator, Dict, Any, Optional
+import json
 import logging
 
 from app.auth.middleware import get_current_active_user
 from app.api.v1.auth import get_valid_spotify_token
+from app.services.import_jobs import ACTIVE_STATUSES, import_job_manager
 from app.services.spotify_service import spotify_ingestion_service
+from app.services.graph_export import EXPORT_FORMATS, export_user_graph
 from app.external.spotify_client import spotify_client
+from app.database.connection import async_neo4j_db
+from app.core.response_cache import response_cache
 
 logger = logging.getLogger(__name__)
 
@@ -13,25 +19,34 @@ router = APIRouter()
 
 @router.post("/import")
 async def import_user_data(
-    background_tasks: BackgroundTasks,
+    include_library: bool = False,
+    include_playlists: bool = False,
+    include_recent: bool = False,
     current_user: dict = Depends(get_current_active_user),
     spotify_token: str = Depends(get_valid_spotify_token)
 ):
-    """Importa i dati dell'utente da Spotify nel knowledge graph"""
+    """Importa i dati dell'utente da Spotify nel knowledge graph
+    
+    Con include_library importa anche brani e album salvati nella libreria,
+    con include_playlists le playlist modificate dall'ultimo sync e con
+    include_recent gli ascolti recenti successivi all'ultimo import.
+    """
     try:
         spotify_user_id = current_user["spotify_user_id"]
         
-        # Avvia import in background
-        background_tasks.add_task(
-            _background_import_task,
-            spotify_user_id,
-            spotify_token
+        # Accoda l'import; le richieste duplicate ricevono il job già attivo
+        job, created = await import_job_manager.submit(
+            spotify_user_id, spotify_token,
+            include_library=include_library,
+            include_playlists=include_playlists,
+            include_recent=include_recent
         )
         
         return {
-            "message": "Import started in background",
+            "message": "Import started in background" if created else "Import already in progress",
             "spotify_user_id": spotify_user_id,
-            "status": "processing"
+            "job_id": job["job_id"],
+            "status": job["status"]
         }
         
     except Exception as e:
@@ -41,6 +56,41 @@ async def import_user_data(
             detail=f"Failed to start import: {str(e)}"
         )
 
+@router.post("/recently-played/sync")
+async def sync_recently_played(
+    current_user: dict = Depends(get_current_active_user),
+    spotify_token: str = Depends(get_valid_spotify_token)
+):
+    """Importa solo gli ascolti recenti successivi al cursore salvato
+    
+    Pensato per un polling frequente: costa una o due chiamate Spotify e una
+    transazione. Se è in corso un import completo dell'utente risponde 409,
+    perché l'import aggiorna lo stesso cursore.
+    """
+    spotify_user_id = current_user["spotify_user_id"]
+    
+    job = await import_job_manager.get_status(spotify_user_id)
+    if job is not None and job["status"] in ACTIVE_STATUSES:
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail="Import in progress, retry when it has finished"
+        )
+    
+    try:
+        stats = await spotify_ingestion_service.sync_recently_played(spotify_user_id, spotify_token)
+        return {
+            "spotify_user_id": spotify_user_id,
+            "plays_imported": stats["plays"],
+            "daily_buckets_updated": stats["buckets"]
+        }
+        
+    except Exception as e:
+        logger.error(f"Error syncing recently played: {str(e)}")
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Failed to sync recently played: {str(e)}"
+        )
+
 @router.get("/top-artists")
 async def get_user_top_artists(
     time_range: str = "medium_term",
@@ -61,61 +111,12 @@ async def get_user_top_artists(
         
         spotify_user_id = current_user["spotify_user_id"]
         
-        # Prima prova a leggere dal database Neo4j
-        from app.database.connection import neo4j_db
-        
-        query = """
-        MATCH (u:Utente {spotify_user_id: $spotify_user_id})
-        -[r:ASCOLTA {time_range: $time_range}]->
-        (:Brano)<-[:ESEGUE]-(a:Artista)
-        RETURN DISTINCT a.nome as name, a.spotify_id as id, a.popolarita as popularity,
-               a.followers as followers, a.immagini as images, a.external_urls as external_urls
-        ORDER BY a.popolarita DESC
-        LIMIT $limit
-        """
-        
-        db_artists = neo4j_db.execute_query(query, {
-            "spotify_user_id": spotify_user_id,
-            "time_range": time_range,
-            "limit": limit
-        })
-        
-        if db_artists:
-            # Formatta i dati dal database nel formato Spotify API
-            artists_items = []
-            for record in db_artists:
-                artists_items.append({
-                    "id": record["id"],
-                    "name": record["name"],
-                    "popularity": record["popularity"],
-                    "followers": {"total": record["followers"]} if record["followers"] else {"total": 0},
-                    "images": [{"url": url} for url in (record["images"] or [])],
-                    "external_urls": record["external_urls"] or {}
-                })
-            
-            return {
-                "time_range": time_range,
-                "total": len(artists_items),
-                "limit": limit,
-                "artists": artists_items,
-                "source": "database"
-            }
-        
-        # Se non ci sono dati nel database, usa Spotify API
-        top_artists = await spotify_client.get_user_top_artists(
-            spotify_token, 
-            time_range=time_range, 
-            limit=limit
+        # Risposta in cache finché un nuovo import dell'utente non la invalida
+        return await response_cache.get_or_compute(
+            spotify_user_id, "top-artists", {"time_range": time_range, "limit": limit},
+            lambda: _load_top_artists(spotify_user_id, spotify_token, time_range, limit)
         )
         
-        return {
-            "time_range": time_range,
-            "total": top_artists.get("total", 0),
-            "limit": limit,
-            "artists": top_artists.get("items", []),
-            "source": "spotify_api"
-        }
-        
     except Exception as e:
         logger.error(f"Error getting top artists: {str(e)}")
         raise HTTPException(
@@ -143,86 +144,12 @@ async def get_user_top_tracks(
             
         spotify_user_id = current_user["spotify_user_id"]
         
-        # Prima prova a leggere dal database Neo4j
-        from app.database.connection import neo4j_db
-        
-        query = """
-        MATCH (u:Utente {spotify_user_id: $spotify_user_id})
-        -[r:ASCOLTA {time_range: $time_range}]->(t:Brano)
-        OPTIONAL MATCH (t)<-[:CONTIENE]-(al:Album)
-        OPTIONAL MATCH (t)<-[:ESEGUE]-(ar:Artista)
-        RETURN t.nome as name, t.spotify_id as id, t.popolarita as popularity,
-               t.durata_ms as duration_ms, t.preview_url as preview_url,
-               t.external_urls as external_urls,
-               al.nome as album_name, al.spotify_id as album_id, al.immagini as album_images,
-               collect(DISTINCT ar.nome) as artist_names, collect(DISTINCT ar.spotify_id) as artist_ids
-        ORDER BY t.popolarita DESC
-        LIMIT $limit
-        """
-        
-        db_tracks = neo4j_db.execute_query(query, {
-            "spotify_user_id": spotify_user_id,
-            "time_range": time_range,
-            "limit": limit
-        })
-        
-        if db_tracks:
-            # Formatta i dati dal database nel formato Spotify API
-            tracks_items = []
-            for record in db_tracks:
-                # Costruisci l'oggetto artisti
-                artists = []
-                if record["artist_names"] and record["artist_ids"]:
-                    for i, name in enumerate(record["artist_names"]):
-                        if i < len(record["artist_ids"]):
-                            artists.append({
-                                "id": record["artist_ids"][i],
-                                "name": name
-                            })
-                
-                # Costruisci l'oggetto album
-                album = None
-                if record["album_name"]:
-                    album = {
-                        "id": record["album_id"],
-                        "name": record["album_name"],
-                        "images": [{"url": url} for url in (record["album_images"] or [])]
-                    }
-                
-                tracks_items.append({
-                    "id": record["id"],
-                    "name": record["name"],
-                    "popularity": record["popularity"],
-                    "duration_ms": record["duration_ms"],
-                    "preview_url": record["preview_url"],
-                    "external_urls": record["external_urls"] or {},
-                    "artists": artists,
-                    "album": album
-                })
-            
-            return {
-                "time_range": time_range,
-                "total": len(tracks_items),
-                "limit": limit,
-                "tracks": tracks_items,
-                "source": "database"
-            }
-        
-        # Se non ci sono dati nel database, usa Spotify API
-        top_tracks = await spotify_client.get_user_top_tracks(
-            spotify_token,
-            time_range=time_range,
-            limit=limit
+        # Risposta in cache finché un nuovo import dell'utente non la invalida
+        return await response_cache.get_or_compute(
+            spotify_user_id, "top-tracks", {"time_range": time_range, "limit": limit},
+            lambda: _load_top_tracks(spotify_user_id, spotify_token, time_range, limit)
         )
         
-        return {
-            "time_range": time_range,
-            "total": top_tracks.get("total", 0),
-            "limit": limit,
-            "tracks": top_tracks.get("items", []),
-            "source": "spotify_api"
-        }
-        
     except Exception as e:
         logger.error(f"Error getting top tracks: {str(e)}")
         raise HTTPException(
@@ -254,46 +181,40 @@ async def get_spotify_profile(
 async def get_import_status(
     current_user: dict = Depends(get_current_active_user)
 ):
-    """Ottiene lo stato dell'import dell'utente dal knowledge graph"""
+    """Ottiene lo stato dell'import dell'utente
+    
+    Mentre un job di import è in coda o in corso ritorna il suo progresso
+    per stadio senza interrogare il grafo; altrimenti legge le statistiche
+    materializzate sul nodo Utente, con l'esito dell'ultimo job in
+    "last_import".
+    """
     try:
         spotify_user_id = current_user["spotify_user_id"]
         
-        # Query per ottenere statistiche utente dal grafo
-        query = """
-        MATCH (u:Utente {spotify_user_id: $spotify_user_id})
-        OPTIONAL MATCH (u)-[:ASCOLTA]->(t:Brano)
-        OPTIONAL MATCH (u)-[:ASCOLTA]->(:Brano)<-[:CONTIENE]-(al:Album)
-        OPTIONAL MATCH (u)-[:ASCOLTA]->(:Brano)<-[:ESEGUE]-(a:Artista)
-        
-        RETURN u.ultima_sincronizzazione as last_sync,
-               u.nome_utente as username,
-               u.email as email,
-               count(DISTINCT t) as tracks_count,
-               count(DISTINCT al) as albums_count,
-               count(DISTINCT a) as artists_count
-        """
-        
-        from app.database.connection import neo4j_db
-        result = neo4j_db.execute_query(query, {"spotify_user_id": spotify_user_id})
-        
-        if not result:
+        job = await import_job_manager.get_status(spotify_user_id)
+        if job is not None and job["status"] in ACTIVE_STATUSES:
             return {
-                "user_exists": False,
-                "message": "User not found in knowledge graph. Run import first."
+                # Il nodo Utente esiste dopo lo stadio "profile"
+                "user_exists": job["stage"] not in (None, "profile"),
+                "spotify_user_id": spotify_user_id,
+                "import_job": job
             }
         
-        data = result[0]
+        # Statistiche dal grafo, in cache finché un nuovo import non le invalida
+        graph_status = await response_cache.get_or_compute(
+            spotify_user_id, "import-status", {},
+            lambda: _load_graph_status(spotify_user_id)
+        )
+        if job is None:
+            return graph_status
         
         return {
-            "user_exists": True,
-            "spotify_user_id": spotify_user_id,
-            "username": data["username"],
-            "email": data["email"],
-            "last_sync": data["last_sync"],
-            "statistics": {
-                "tracks_in_graph": data["tracks_count"],
-                "albums_in_graph": data["albums_count"],
-                "artists_in_graph": data["artists_count"]
+            **graph_status,
+            "last_import": {
+                "job_id": job["job_id"],
+                "status": job["status"],
+                "error": job["error"],
+                "finished_at": job.get("finished_at")
             }
         }
         
@@ -304,23 +225,266 @@ async def get_import_status(
             detail=f"Failed to get import status: {str(e)}"
         )
 
-async def _background_import_task(spotify_user_id: str, spotify_token: str):
-    """Task in background per l'import dei dati"""
-    try:
-        logger.info(f"🚀 Starting background import for user {spotify_user_id}")
-        
-        result = await spotify_ingestion_service.import_user_data(
-            spotify_user_id, 
-            spotify_token
+@router.get("/library")
+async def stream_user_library(
+    after: Optional[str] = None,
+    limit: Optional[int] = None,
+    current_user: dict = Depends(get_current_active_user)
+):
+    """Brani salvati dell'utente in streaming NDJSON (un brano per riga)
+    
+    I brani sono ordinati per spotify_id: per paginare il client passa come
+    `after` l'ultimo id ricevuto (keyset pagination). Senza `limit` viene
+    trasmessa l'intera libreria, direttamente dal cursore del database.
+    """
+    if limit is not None and limit <= 0:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="limit must be a positive integer"
         )
+    
+    query = """
+    MATCH (u:Utente {spotify_user_id: $spotify_user_id})-[s:HA_SALVATO]->(t:Brano)
+    WHERE $after IS NULL OR t.spotify_id > $after
+    RETURN t.spotify_id as id, t.titolo as name, t.popolarita as popularity,
+           t.durata_ms as duration_ms, s.aggiunto_il as added_at,
+           COLLECT { MATCH (t)<-[:ESEGUE]-(a:Artista) RETURN a.spotify_id } as artist_ids,
+           COLLECT { MATCH (t)<-[:CONTIENE]-(al:Album) RETURN al.spotify_id } as album_ids
+    ORDER BY t.spotify_id
+    """ + ("LIMIT $limit" if limit is not None else "")
+    
+    parameters = {
+        "spotify_user_id": current_user["spotify_user_id"],
+        "after": after,
+        "limit": limit
+    }
+    return StreamingResponse(
+        _ndjson(async_neo4j_db.stream_query(query, parameters)),
+        media_type="application/x-ndjson"
+    )
+
+@router.get("/export")
+async def export_user_atlas(
+    format: str = "ndjson",
+    gzip: bool = False,
+    current_user: dict = Depends(get_current_active_user)
+):
+    """Esporta in streaming il sottografo musicale dell'utente
+    
+    Formati: "ndjson" (un nodo o una relazione per riga, prima i nodi) o
+    "graphml". Con gzip=true l'output è compresso al volo.
+    """
+    if format not in EXPORT_FORMATS:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"format must be one of: {', '.join(EXPORT_FORMATS)}"
+        )
+    
+    spotify_user_id = current_user["spotify_user_id"]
+    filename = f"music_atlas_{spotify_user_id}.{format}"
+    media_type = "application/graphml+xml" if format == "graphml" else "application/x-ndjson"
+    if gzip:
+        filename += ".gz"
+        media_type = "application/gzip"
+    
+    return StreamingResponse(
+        export_user_graph(spotify_user_id, format, compress=gzip),
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'}
+    )
+
+async def _ndjson(records: AsyncIterator[Dict[str, Any]]) -> AsyncIterator[bytes]:
+    """Serializza i record come NDJSON, una riga per record"""
+    async for record in records:
+        yield (json.dumps(record, default=str) + "\n").encode()
+
+async def _load_top_artists(spotify_user_id: str, spotify_token: str, time_range: str, limit: int) -> Dict[str, Any]:
+    """Top artists dal database Neo4j o da Spotify se non disponibili"""
+    # Prima prova a leggere dal database Neo4j
+    # Classifica precalcolata all'import: seek sul vincolo di Utente ed
+    # espansione delle sue al più 150 relazioni PREFERISCE (50 per range)
+    query = """
+    MATCH (u:Utente {spotify_user_id: $spotify_user_id})
+    -[r:PREFERISCE {time_range: $time_range}]->(a:Artista)
+    WHERE r.rank <= $limit
+    RETURN a.nome as name, a.spotify_id as id, a.popolarita as popularity,
+           a.followers as followers, a.immagini as images, a.external_urls as external_urls
+    ORDER BY r.rank
+    """
+    
+    db_artists = await async_neo4j_db.execute_query(query, {
+        "spotify_user_id": spotify_user_id,
+        "time_range": time_range,
+        "limit": limit
+    })
+    
+    if db_artists:
+        # Formatta i dati dal database nel formato Spotify API
+        artists_items = []
+        for record in db_artists:
+            artists_items.append({
+                "id": record["id"],
+                "name": record["name"],
+                "popularity": record["popularity"],
+                "followers": {"total": record["followers"]} if record["followers"] else {"total": 0},
+                "images": [{"url": url} for url in (record["images"] or [])],
+                "external_urls": record["external_urls"] or {}
+            })
         
-        logger.info(f"✅ Background import completed for user {spotify_user_id}")
-        logger.info(f"📊 Import results: {result}")
-        
-        # Stampa anche sulla console per debug
-        print(f"✅ Import completed for {spotify_user_id}: {result}")
+        return {
+            "time_range": time_range,
+            "total": len(artists_items),
+            "limit": limit,
+            "artists": artists_items,
+            "source": "database"
+        }
+    
+    # Se non ci sono dati nel database, usa Spotify API
+    top_artists = await spotify_client.get_user_top_artists(
+        spotify_token, 
+        time_range=time_range, 
+        limit=limit
+    )
+    
+    return {
+        "time_range": time_range,
+        "total": top_artists.get("total", 0),
+        "limit": limit,
+        "artists": top_artists.get("items", []),
+        "source": "spotify_api"
+    }
+
+async def _load_top_tracks(spotify_user_id: str, spotify_token: str, time_range: str, limit: int) -> Dict[str, Any]:
+    """Top tracks dal database Neo4j o da Spotify se non disponibili"""
+    # Prima prova a leggere dal database Neo4j
+    # Solo le prime $limit posizioni del range, nell'ordine della classifica Spotify:
+    # come per gli artisti si espande dal nodo Utente e l'ordinamento è su al più 50 righe
+    query = """
+    MATCH (u:Utente {spotify_user_id: $spotify_user_id})
+    -[r:ASCOLTA {time_range: $time_range}]->(t:Brano)
+    WHERE r.rank <= $limit
+    OPTIONAL MATCH (t)<-[:CONTIENE]-(al:Album)
+    OPTIONAL MATCH (t)<-[:ESEGUE]-(ar:Artista)
+    RETURN r.rank as rank, t.titolo as name, t.spotify_id as id, t.popolarita as popularity,
+           t.durata_ms as duration_ms, t.preview_url as preview_url,
+           t.external_urls as external_urls,
+           al.titolo as album_name, al.spotify_id as album_id, al.immagini as album_images,
+           collect(DISTINCT ar.nome) as artist_names, collect(DISTINCT ar.spotify_id) as artist_ids
+    ORDER BY rank
+    """
+    
+    db_tracks = await async_neo4j_db.execute_query(query, {
+        "spotify_user_id": spotify_user_id,
+        "time_range": time_range,
+        "limit": limit
+    })
+    
+    if db_tracks:
+        # Formatta i dati dal database nel formato Spotify API
+        tracks_items = []
+        for record in db_tracks:
+            # Costruisci l'oggetto artisti
+            artists = []
+            if record["artist_names"] and record["artist_ids"]:
+                for i, name in enumerate(record["artist_names"]):
+                    if i < len(record["artist_ids"]):
+                        artists.append({
+                            "id": record["artist_ids"][i],
+                            "name": name
+                        })
+            
+            # Costruisci l'oggetto album
+            album = None
+            if record["album_name"]:
+                album = {
+                    "id": record["album_id"],
+                    "name": record["album_name"],
+                    "images": [{"url": url} for url in (record["album_images"] or [])]
+                }
+            
+            tracks_items.append({
+                "id": record["id"],
+                "name": record["name"],
+                "popularity": record["popularity"],
+                "duration_ms": record["duration_ms"],
+                "preview_url": record["preview_url"],
+                "external_urls": record["external_urls"] or {},
+                "artists": artists,
+                "album": album
+            })
         
-    except Exception as e:
-        logger.error(f"❌ Background import failed for user {spotify_user_id}: {str(e)}")
-        print(f"❌ Import failed for {spotify_user_id}: {str(e)}")
-        raise
+        return {
+            "time_range": time_range,
+            "total": len(tracks_items),
+            "limit": limit,
+            "tracks": tracks_items,
+            "source": "database"
+        }
+    
+    # Se non ci sono dati nel database, usa Spotify API
+    top_tracks = await spotify_client.get_user_top_tracks(
+        spotify_token,
+        time_range=time_range,
+        limit=limit
+    )
+    
+    return {
+        "time_range": time_range,
+        "total": top_tracks.get("total", 0),
+        "limit": limit,
+        "tracks": top_tracks.get("items", []),
+        "source": "spotify_api"
+    }
+
+async def _load_graph_status(spotify_user_id: str) -> Dict[str, Any]:
+    """Statistiche di import dell'utente lette dal nodo Utente"""
+    # I conteggi sono materializzati sul nodo Utente a fine import
+    query = """
+    MATCH (u:Utente {spotify_user_id: $spotify_user_id})
+    RETURN u.ultima_sincronizzazione as last_sync,
+           u.nome_utente as username,
+           u.email as email,
+           u.conteggio_brani as tracks_count,
+           u.conteggio_album as albums_count,
+           u.conteggio_artisti as artists_count,
+           u.conteggio_generi as genres_count,
+           u.ascolti_short_term as short_term_count,
+           u.ascolti_medium_term as medium_term_count,
+           u.ascolti_long_term as long_term_count,
+           u.statistiche_aggiornate_il as statistics_updated_at
+    """
+    
+    result = await async_neo4j_db.execute_query(query, {"spotify_user_id": spotify_user_id})
+    
+    if not result:
+        return {
+            "user_exists": False,
+            "message": "User not found in knowledge graph. Run import first."
+        }
+    
+    data = result[0]
+    
+    # Utenti importati prima della materializzazione: calcolo una tantum
+    if data["statistics_updated_at"] is None:
+        await spotify_ingestion_service.update_user_stats(spotify_user_id)
+        data = (await async_neo4j_db.execute_query(query, {"spotify_user_id": spotify_user_id}))[0]
+    
+    return {
+        "user_exists": True,
+        "spotify_user_id": spotify_user_id,
+        "username": data["username"],
+        "email": data["email"],
+        "last_sync": data["last_sync"],
+        "statistics": {
+            "tracks_in_graph": data["tracks_count"],
+            "albums_in_graph": data["albums_count"],
+            "artists_in_graph": data["artists_count"],
+            "genres_in_graph": data["genres_count"],
+            "listens_by_time_range": {
+                "short_term": data["short_term_count"],
+                "medium_term": data["medium_term_count"],
+                "long_term": data["long_term_count"]
+            },
+            "updated_at": data["statistics_updated_at"]
+        }
+    }
@@ -0,0 +1,212 @@
+"""Gestione dei token Spotify degli utenti
+
+Il rinnovo è coalescente per utente: richieste concorrenti con token scaduto
+attendono un'unica chiamata di refresh. I token vicini alla scadenza
+(SPOTIFY_TOKEN_REFRESH_MARGIN_SECONDS) vengono rinnovati in background mentre
+si continua a usare quello ancora valido, e un loop periodico rinnova in
+anticipo i token usati di recente, così gli import lunghi non si fermano mai
+sulla scadenza. I token sono salvati nello store di autenticazione
+(in memoria o su Redis), quindi sono condivisi tra worker.
+"""
+from typing import Any, Awaitable, Callable, Dict, Optional, Set
+import asyncio
+import logging
+import time
+
+from app.auth.token_store import token_store
+from app.core.config import settings
+from app.core.singleflight import SingleFlight
+from app.external.spotify_client import spotify_client
+
+logger = logging.getLogger(__name__)
+
+TokenProvider = Callable[[], Awaitable[str]]
+
+
+class TokenNotFoundError(Exception):
+    """Nessun token salvato per l'utente"""
+
+
+class TokenRefreshError(Exception):
+    """Il rinnovo del token presso Spotify è fallito"""
+
+
+class SpotifyTokenManager:
+    """Token Spotify per utente con rinnovo single-flight e anticipato"""
+
+    def __init__(self,
+                 store=token_store,
+                 client=spotify_client,
+                 clock: Callable[[], float] = time.time,
+                 sleep: Callable[[float], Any] = asyncio.sleep):
+        self.store = store
+        self.client = client
+        self.refresh_margin = settings.SPOTIFY_TOKEN_REFRESH_MARGIN_SECONDS
+        self._clock = clock
+        self._sleep = sleep
+        # Ultimo uso per utente, locale al processo: guida il rinnovo in background
+        self._last_used: Dict[str, float] = {}
+        self._single_flight = SingleFlight()
+        self._background: Set[asyncio.Task] = set()
+        self._task: Optional[asyncio.Task] = None
+
+        # Statistiche
+        self.refreshes = 0
+        self.background_refreshes = 0
+        self.refresh_failures = 0
+
+    async def save_tokens(self,
+                          spotify_user_id: str,
+                          tokens: Dict[str, Any],
+                          user_profile: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        """Salva i token ottenuti dal flusso OAuth"""
+        user_data = {
+            "access_token": tokens["access_token"],
+            "refresh_token": tokens["refresh_token"],
+            "expires_at": self._clock() + tokens["expires_in"],
+            "user_profile": user_profile,
+        }
+        await self.store.save_tokens(spotify_user_id, user_data)
+        self._last_used[spotify_user_id] = self._clock()
+        return user_data
+
+    async def get_user_data(self, spotify_user_id: str) -> Optional[Dict[str, Any]]:
+        """Token e profilo salvati per l'utente, None se assenti"""
+        return await self.store.get_tokens(spotify_user_id)
+
+    async def remove(self, spotify_user_id: str):
+        """Rimuove i token dell'utente (logout)"""
+        self._last_used.pop(spotify_user_id, None)
+        await self.store.delete_tokens(spotify_user_id)
+
+    async def _get_or_raise(self, spotify_user_id: str) -> Dict[str, Any]:
+        user_data = await self.store.get_tokens(spotify_user_id)
+        if user_data is None:
+            raise TokenNotFoundError(f"No Spotify tokens for {spotify_user_id}")
+        return user_data
+
+    async def get_access_token(self, spotify_user_id: str) -> str:
+        """Ritorna un access token valido, rinnovandolo se necessario
+
+        Un token scaduto viene rinnovato in attesa; uno in scadenza viene
+        restituito subito e rinnovato in background.
+        """
+        user_data = await self._get_or_raise(spotify_user_id)
+        now = self._clock()
+        self._last_used[spotify_user_id] = now
+
+        if now >= user_data["expires_at"]:
+            user_data = await self.refresh(spotify_user_id)
+        elif now >= user_data["expires_at"] - self.refresh_margin:
+            self._refresh_in_background(spotify_user_id)
+        return user_data["access_token"]
+
+    async def refresh(self, spotify_user_id: str, force: bool = False) -> Dict[str, Any]:
+        """Rinnova il token; le chiamate concorrenti per lo stesso utente condividono il refresh
+
+        Senza force un token già rinnovato (ad es. da un altro worker) non
+        viene rinnovato di nuovo.
+        """
+        return await self._single_flight.do(spotify_user_id, lambda: self._do_refresh(spotify_user_id, force))
+
+    async def _do_refresh(self, spotify_user_id: str, force: bool) -> Dict[str, Any]:
+        user_data = await self._get_or_raise(spotify_user_id)
+        # Un altro worker potrebbe aver già rinnovato il token nello store condiviso
+        if not force and self._clock() < user_data["expires_at"] - self.refresh_margin:
+            return user_data
+        try:
+            new_tokens = await self.client.refresh_access_token(user_data["refresh_token"])
+        except Exception as e:
+            self.refresh_failures += 1
+            raise TokenRefreshError(f"Failed to refresh token for {spotify_user_id}: {str(e)}") from e
+
+        self.refreshes += 1
+        user_data["access_token"] = new_tokens["access_token"]
+        user_data["expires_at"] = self._clock() + new_tokens["expires_in"]
+        # Spotify può restituire un nuovo refresh token
+        if "refresh_token" in new_tokens:
+            user_data["refresh_token"] = new_tokens["refresh_token"]
+        await self.store.save_tokens(spotify_user_id, user_data)
+        return user_data
+
+    def _refresh_in_background(self, spotify_user_id: str):
+        if self._single_flight.in_flight(spotify_user_id):
+            return
+        task = asyncio.create_task(self._background_refresh(spotify_user_id))
+        self._background.add(task)
+        task.add_done_callback(self._background.discard)
+
+    async def _background_refresh(self, spotify_user_id: str):
+        try:
+            await self.refresh(spotify_user_id)
+            self.background_refreshes += 1
+        except (TokenNotFoundError, TokenRefreshError) as e:
+            # Il token attuale resta valido fino alla scadenza: si riproverà
+            logger.warning(f"Background token refresh failed: {str(e)}")
+
+    def provider_for(self, spotify_user_id: str, fallback_token: Optional[str] = None) -> TokenProvider:
+        """Provider di token per operazioni lunghe (ad es. import)
+
+        Se il manager non ha token per l'utente (ad es. in un worker separato)
+        il provider ritorna fallback_token.
+        """
+        async def provider() -> str:
+            try:
+                return await self.get_access_token(spotify_user_id)
+            except TokenNotFoundError:
+                if fallback_token is None:
+                    raise
+                return fallback_token
+        return provider
+
+    def start(self):
+        """Avvia il rinnovo periodico in background"""
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Ferma il loop e i rinnovi in corso"""
+        tasks = list(self._background)
+        if self._task is not None:
+            tasks.append(self._task)
+            self._task = None
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def refresh_due(self):
+        """Avvia il rinnovo dei token usati di recente (in questo processo) e in scadenza"""
+        now = self._clock()
+        active_since = now - settings.SPOTIFY_TOKEN_ACTIVE_WINDOW_SECONDS
+        for spotify_user_id, last_used in list(self._last_used.items()):
+            if last_used < active_since:
+                del self._last_used[spotify_user_id]
+                continue
+            user_data = await self.store.get_tokens(spotify_user_id)
+            if user_data is None:
+                del self._last_used[spotify_user_id]
+            elif now >= user_data["expires_at"] - self.refresh_margin:
+                self._refresh_in_background(spotify_user_id)
+
+    async def _run(self):
+        while True:
+            try:
+                await self.refresh_due()
+            except Exception as e:
+                # Store non raggiungibile: si riprova al giro successivo
+                logger.error(f"Token refresh check failed: {str(e)}")
+            await self._sleep(settings.SPOTIFY_TOKEN_REFRESH_CHECK_SECONDS)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Statistiche dei rinnovi"""
+        return {
+            "active_users": len(self._last_used),
+            "refreshes": self.refreshes,
+            "background_refreshes": self.background_refreshes,
+            "refresh_failures": self.refresh_failures,
+            "coalescing": self._single_flight.get_stats(),
+        }
+
+
+# Istanza globale del gestore dei token
+token_manager = SpotifyTokenManager()
@@ -0,0 +1,96 @@
+"""Store dei token Spotify e degli state OAuth
+
+Due implementazioni con la stessa interfaccia async:
+- MemoryTokenStore: in-process, con TTL ed eviction LRU (un solo worker);
+- RedisTokenStore: condiviso tra worker e macchine, con scadenza su Redis.
+
+Gli state OAuth scadono dopo OAUTH_STATE_TTL_SECONDS e vengono consumati in
+modo atomico: uno state può essere usato una sola volta.
+"""
+from typing import Any, Dict, Optional
+import json
+
+from app.core.cache import TTLCache
+from app.core.config import settings
+from app.core.redis import get_redis
+
+
+class MemoryTokenStore:
+    """Token e state in memoria del processo, con TTL ed eviction LRU"""
+
+    def __init__(self):
+        self._tokens = TTLCache(settings.AUTH_STORE_MAX_ENTRIES, settings.SPOTIFY_TOKEN_STORE_TTL_SECONDS)
+        self._states = TTLCache(settings.AUTH_STORE_MAX_ENTRIES, settings.OAUTH_STATE_TTL_SECONDS)
+
+    async def get_tokens(self, spotify_user_id: str) -> Optional[Dict[str, Any]]:
+        return self._tokens.get(spotify_user_id)
+
+    async def save_tokens(self, spotify_user_id: str, user_data: Dict[str, Any]):
+        self._tokens.set(spotify_user_id, user_data)
+
+    async def delete_tokens(self, spotify_user_id: str):
+        self._tokens.delete(spotify_user_id)
+
+    async def save_state(self, state: str, state_data: Dict[str, Any]):
+        self._states.set(state, state_data)
+
+    async def consume_state(self, state: str) -> Optional[Dict[str, Any]]:
+        """Ritorna e rimuove lo state; None se sconosciuto, scaduto o già usato"""
+        # Nessun await tra lettura e cancellazione: atomico nel loop
+        state_data = self._states.get(state)
+        if state_data is not None:
+            self._states.delete(state)
+        return state_data
+
+
+class RedisTokenStore:
+    """Token e state su Redis, condivisi tra worker"""
+
+    @staticmethod
+    def _tokens_key(spotify_user_id: str) -> str:
+        return f"auth:tokens:{spotify_user_id}"
+
+    @staticmethod
+    def _state_key(state: str) -> str:
+        return f"auth:state:{state}"
+
+    def _redis(self):
+        redis = get_redis()
+        if redis is None:
+            raise RuntimeError("Redis is required for the redis auth store backend")
+        return redis
+
+    async def get_tokens(self, spotify_user_id: str) -> Optional[Dict[str, Any]]:
+        raw = await self._redis().get(self._tokens_key(spotify_user_id))
+        return json.loads(raw) if raw else None
+
+    async def save_tokens(self, spotify_user_id: str, user_data: Dict[str, Any]):
+        await self._redis().set(
+            self._tokens_key(spotify_user_id),
+            json.dumps(user_data, default=str),
+            ex=settings.SPOTIFY_TOKEN_STORE_TTL_SECONDS
+        )
+
+    async def delete_tokens(self, spotify_user_id: str):
+        await self._redis().delete(self._tokens_key(spotify_user_id))
+
+    async def save_state(self, state: str, state_data: Dict[str, Any]):
+        await self._redis().set(
+            self._state_key(state), json.dumps(state_data, default=str), ex=settings.OAUTH_STATE_TTL_SECONDS
+        )
+
+    async def consume_state(self, state: str) -> Optional[Dict[str, Any]]:
+        """Ritorna e rimuove lo state con GETDEL; None se sconosciuto, scaduto o già usato"""
+        raw = await self._redis().getdel(self._state_key(state))
+        return json.loads(raw) if raw else None
+
+
+def get_token_store():
+    """Store di autenticazione configurato (AUTH_STORE_BACKEND)"""
+    if settings.AUTH_STORE_BACKEND == "redis":
+        return RedisTokenStore()
+    return MemoryTokenStore()
+
+
+# Istanza globale dello store
+token_store = get_token_store()
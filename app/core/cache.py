@@ -0,0 +1,59 @@
+from collections import OrderedDict
+from typing import Any, Callable, Hashable, Optional
+import time
+
+
+class TTLCache:
+    """Cache in-process LRU con scadenza per voce
+
+    Le voci oltre max_entries vengono espulse in ordine LRU; quelle scadute
+    vengono rimosse alla lettura.
+    """
+
+    def __init__(self,
+                 max_entries: int,
+                 ttl_seconds: float,
+                 clock: Callable[[], float] = time.monotonic):
+        self.max_entries = max(1, max_entries)
+        self.ttl_seconds = ttl_seconds
+        self._clock = clock
+        self._data: "OrderedDict[Hashable, tuple]" = OrderedDict()
+
+        # Statistiche
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        """Ritorna il valore se presente e non scaduto"""
+        item = self._data.get(key)
+        if item is None:
+            self.misses += 1
+            return None
+
+        value, expires_at = item
+        if expires_at <= self._clock():
+            del self._data[key]
+            self.misses += 1
+            return None
+
+        self._data.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def set(self, key: Hashable, value: Any, ttl_seconds: Optional[float] = None):
+        """Salva un valore con TTL (quello di default se non specificato)"""
+        ttl = self.ttl_seconds if ttl_seconds is None else ttl_seconds
+        self._data[key] = (value, self._clock() + ttl)
+        self._data.move_to_end(key)
+        while len(self._data) > self.max_entries:
+            self._data.popitem(last=False)
+
+    def delete(self, key: Hashable) -> bool:
+        """Rimuove una voce, ritorna True se era presente"""
+        return self._data.pop(key, None) is not None
+
+    def clear(self):
+        self._data.clear()
@@ -15,6 +15,10 @@ class Settings(BaseSettings):
     JWT_SECRET_KEY: str = "your-secret-key-change-in-production"
     JWT_ALGORITHM: str = "HS256"
     JWT_EXPIRATION_HOURS: int = 24
+    AUTH_STORE_BACKEND: str = "memory"  # "memory" (un solo worker) oppure "redis"
+    AUTH_STORE_MAX_ENTRIES: int = 10000
+    OAUTH_STATE_TTL_SECONDS: int = 600  # Scadenza degli state OAuth non usati
+    SPOTIFY_TOKEN_STORE_TTL_SECONDS: int = 2592000  # Token di utenti inattivi scartati dopo 30 giorni
     
     # CORS
     CORS_ORIGINS: List[str] = [
@@ -31,12 +35,27 @@ class Settings(BaseSettings):
     NEO4J_DATABASE: str = "neo4j"
     NEO4J_MAX_CONNECTION_POOL_SIZE: int = 100
     NEO4J_CONNECTION_ACQUISITION_TIMEOUT: int = 60
+    NEO4J_WRITE_BATCH_SIZE: int = 500
+    NEO4J_STREAM_FETCH_SIZE: int = 1000  # Record scaricati per blocco nelle letture in streaming
+    NEO4J_APPLY_MIGRATIONS_ON_STARTUP: bool = True
     
     # Spotify API
     SPOTIFY_CLIENT_ID: str = ""
     SPOTIFY_CLIENT_SECRET: str = ""
     SPOTIFY_REDIRECT_URI: str = "http://localhost:3000/callback"
     SPOTIFY_API_TIMEOUT: int = 10
+    SPOTIFY_HTTP2: bool = True
+    SPOTIFY_HTTP_MAX_CONNECTIONS: int = 20
+    SPOTIFY_HTTP_MAX_KEEPALIVE_CONNECTIONS: int = 10
+    SPOTIFY_HTTP_KEEPALIVE_EXPIRY: float = 30.0
+    SPOTIFY_RATE_LIMIT_PER_SECOND: float = 10.0
+    SPOTIFY_RATE_LIMIT_BURST: int = 10
+    SPOTIFY_MAX_RETRIES: int = 4
+    SPOTIFY_BACKOFF_BASE_SECONDS: float = 0.5
+    SPOTIFY_BACKOFF_MAX_SECONDS: float = 30.0
+    SPOTIFY_TOKEN_REFRESH_MARGIN_SECONDS: int = 300  # Rinnovo anticipato prima della scadenza
+    SPOTIFY_TOKEN_REFRESH_CHECK_SECONDS: int = 60  # Intervallo del controllo in background
+    SPOTIFY_TOKEN_ACTIVE_WINDOW_SECONDS: int = 3600  # Rinnovo in background solo per token usati di recente
     
     # External APIs
     WIKIPEDIA_USER_AGENT: str = "MusicAtlas/1.0"
@@ -54,9 +73,42 @@ class Settings(BaseSettings):
     BANDSINTOWN_API_KEY: str = ""
     BANDSINTOWN_BASE_URL: str = "https://rest.bandsintown.com"
     
+    # Import pipeline
+    IMPORT_CONCURRENCY: int = 4  # Richieste Spotify in parallelo per import
+    IMPORT_WRITE_QUEUE_SIZE: int = 8  # Batch di scrittura in attesa prima del backpressure
+    HYDRATION_FRESHNESS_TTL_SECONDS: int = 604800  # Artisti più recenti non vengono riscaricati (0 = sempre)
+    
+    # Import jobs
+    IMPORT_JOB_BACKEND: str = "inprocess"  # "inprocess" oppure "celery"
+    IMPORT_MAX_CONCURRENT_JOBS: int = 2
+    IMPORT_JOB_TTL_SECONDS: int = 86400  # Conservazione dello stato dei job
+    IMPORT_JOB_LOCK_TTL_SECONDS: int = 3600  # Scadenza del lock per utente
+    IMPORT_CHECKPOINT_BACKEND: str = "graph"  # "graph" oppure "redis"
+    IMPORT_CHECKPOINT_TTL_SECONDS: int = 86400  # Checkpoint più vecchi vengono ignorati
+    CELERY_BROKER_URL: str = "redis://localhost:6379/0"
+    CELERY_RESULT_BACKEND: str = "redis://localhost:6379/0"
+    
+    # Resync scheduler
+    RESYNC_SCHEDULER_ENABLED: bool = False
+    RESYNC_CYCLE_SECONDS: int = 900  # Intervallo tra due cicli di re-sync
+    RESYNC_MAX_CONCURRENCY: int = 2  # Utenti sincronizzati in parallelo
+    RESYNC_REQUEST_BUDGET_PER_CYCLE: int = 2000  # Richieste Spotify massime per ciclo
+    RESYNC_BATCH_SIZE: int = 100  # Utenti candidati considerati per ciclo
+    RESYNC_ACTIVE_INTERVAL_SECONDS: int = 21600  # Freschezza target per utenti attivi
+    RESYNC_INACTIVE_INTERVAL_SECONDS: int = 604800  # Freschezza target per utenti inattivi
+    RESYNC_ACTIVE_WINDOW_SECONDS: int = 1209600  # Attivo se ha fatto accesso entro questa finestra
+    
     # Caching
     REDIS_URL: str = "redis://localhost:6379"
     CACHE_TTL_SECONDS: int = 3600
+    CATALOG_CACHE_TTL_SECONDS: int = 21600
+    CATALOG_CACHE_STALE_TTL_SECONDS: int = 604800  # Voci scadute conservate per la rivalidazione ETag
+    CATALOG_CACHE_MAX_ENTRIES: int = 50000
+    CATALOG_CACHE_REDIS_ENABLED: bool = False
+    RESPONSE_CACHE_TTL_SECONDS: int = 3600  # Invalidata comunque a ogni import dell'utente
+    RESPONSE_CACHE_MAX_ENTRIES: int = 10000
+    RESPONSE_CACHE_REDIS_ENABLED: bool = False
+    WEB_CONCURRENCY: int = 1  # Processi uvicorn (default di --workers)
     
     # Performance
     API_TIMEOUT_SECONDS: int = 30
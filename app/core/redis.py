@@ -0,0 +1,33 @@
+from typing import Optional, Any
+import logging
+
+from app.core.config import settings
+
+try:
+    import redis.asyncio as redis_asyncio
+except ImportError:  # redis è opzionale
+    redis_asyncio = None
+
+logger = logging.getLogger(__name__)
+
+_redis_client: Optional[Any] = None
+
+
+def get_redis() -> Optional[Any]:
+    """Ritorna il client Redis asincrono condiviso, o None se non disponibile"""
+    global _redis_client
+    if redis_asyncio is None:
+        logger.warning("redis package not installed, Redis tier disabled")
+        return None
+    if _redis_client is None:
+        _redis_client = redis_asyncio.from_url(settings.REDIS_URL, decode_responses=True)
+    return _redis_client
+
+
+async def close_redis():
+    """Chiude il client Redis condiviso"""
+    global _redis_client
+    if _redis_client is not None:
+        await _redis_client.close()
+        _redis_client = None
+        logger.info("Redis connection closed")
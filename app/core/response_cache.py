@@ -0,0 +1,140 @@
+from typing import Any, Awaitable, Callable, Dict, Optional
+import json
+import logging
+
+from app.core.cache import TTLCache
+from app.core.config import settings
+from app.core.redis import get_redis
+from app.core.singleflight import SingleFlight
+
+logger = logging.getLogger(__name__)
+
+
+class ResponseCache:
+    """Cache read-through delle risposte API derivate dal grafo di un utente
+
+    Le chiavi includono utente, endpoint, parametri e una versione per
+    utente: invalidate_user() incrementa la versione, così tutte le risposte
+    precedenti diventano irraggiungibili senza doverle cercare. Con Redis
+    (RESPONSE_CACHE_REDIS_ENABLED) versione e risposte sono condivise tra
+    worker; il livello LRU in-process resta davanti a Redis. Senza Redis
+    l'invalidazione raggiunge solo il processo che ha eseguito l'import,
+    quindi con import su Celery o più processi API la versione su Redis è
+    obbligatoria.
+    """
+
+    def __init__(self):
+        shared = settings.IMPORT_JOB_BACKEND == "celery" or settings.WEB_CONCURRENCY > 1
+        if shared and not settings.RESPONSE_CACHE_REDIS_ENABLED:
+            raise RuntimeError(
+                "RESPONSE_CACHE_REDIS_ENABLED=true is required with IMPORT_JOB_BACKEND=celery "
+                "or WEB_CONCURRENCY > 1: invalidations must reach every process"
+            )
+        self.ttl_seconds = settings.RESPONSE_CACHE_TTL_SECONDS
+        self._local = TTLCache(settings.RESPONSE_CACHE_MAX_ENTRIES, self.ttl_seconds)
+        self._versions: Dict[str, int] = {}
+        self.redis_enabled = settings.RESPONSE_CACHE_REDIS_ENABLED
+        self.single_flight = SingleFlight()
+
+        # Statistiche
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    @staticmethod
+    def _version_key(spotify_user_id: str) -> str:
+        return f"response:version:{spotify_user_id}"
+
+    async def _get_version(self, spotify_user_id: str) -> int:
+        if self.redis_enabled:
+            redis = get_redis()
+            if redis is not None:
+                try:
+                    return int(await redis.get(self._version_key(spotify_user_id)) or 0)
+                except Exception as e:
+                    logger.warning(f"Response cache Redis read failed: {str(e)}")
+        return self._versions.get(spotify_user_id, 0)
+
+    async def get_or_compute(self,
+                             spotify_user_id: str,
+                             endpoint: str,
+                             params: Dict[str, Any],
+                             compute: Callable[[], Awaitable[Any]]) -> Any:
+        """Ritorna la risposta in cache o la calcola e la salva
+
+        Richieste concorrenti per la stessa chiave condividono un solo calcolo.
+        """
+        version = await self._get_version(spotify_user_id)
+        encoded_params = ",".join(f"{k}={v}" for k, v in sorted(params.items()))
+        key = f"response:{spotify_user_id}:v{version}:{endpoint}:{encoded_params}"
+
+        response = self._local.get(key)
+        if response is None and self.redis_enabled:
+            response = await self._redis_get(key)
+            if response is not None:
+                self._local.set(key, response)
+        if response is not None:
+            self.hits += 1
+            return response
+
+        self.misses += 1
+
+        async def compute_and_store():
+            value = await compute()
+            self._local.set(key, value)
+            await self._redis_set(key, value)
+            return value
+
+        return await self.single_flight.do(key, compute_and_store)
+
+    async def invalidate_user(self, spotify_user_id: str):
+        """Invalida tutte le risposte in cache dell'utente"""
+        self.invalidations += 1
+        self._versions[spotify_user_id] = self._versions.get(spotify_user_id, 0) + 1
+        if self.redis_enabled:
+            redis = get_redis()
+            if redis is None:
+                return
+            try:
+                key = self._version_key(spotify_user_id)
+                await redis.incr(key)
+                # La versione deve sopravvivere alle risposte che invalida
+                await redis.expire(key, int(self.ttl_seconds) * 2)
+            except Exception as e:
+                logger.warning(f"Response cache Redis invalidation failed: {str(e)}")
+
+    async def _redis_get(self, key: str) -> Optional[Any]:
+        redis = get_redis()
+        if redis is None:
+            return None
+        try:
+            raw = await redis.get(key)
+        except Exception as e:
+            logger.warning(f"Response cache Redis read failed: {str(e)}")
+            return None
+        return json.loads(raw) if raw else None
+
+    async def _redis_set(self, key: str, value: Any):
+        if not self.redis_enabled:
+            return
+        redis = get_redis()
+        if redis is None:
+            return
+        try:
+            await redis.set(key, json.dumps(value, default=str), ex=int(self.ttl_seconds))
+        except Exception as e:
+            logger.warning(f"Response cache Redis write failed: {str(e)}")
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Statistiche della cache"""
+        return {
+            "entries": len(self._local),
+            "hits": self.hits,
+            "misses": self.misses,
+            "invalidations": self.invalidations,
+            "redis_enabled": self.redis_enabled,
+        }
+
+
+# Istanza globale della cache delle risposte
+response_cache = ResponseCache()
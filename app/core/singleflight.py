@@ -0,0 +1,84 @@
+from typing import Any, Awaitable, Callable, Dict, Hashable, Tuple, Type
+import asyncio
+
+
+class _Call:
+    """Calcolo condiviso in volo e numero di chiamanti che lo attendono"""
+
+    __slots__ = ("task", "waiters")
+
+    def __init__(self, task: asyncio.Task):
+        self.task = task
+        self.waiters = 0
+
+
+class SingleFlight:
+    """Coalescing di chiamate concorrenti identiche
+
+    La prima coroutine che chiede una chiave avvia la funzione in un task
+    proprio; quelle che arrivano mentre è in volo attendono lo stesso task e
+    ricevono lo stesso risultato (o la stessa eccezione) senza una seconda
+    esecuzione. La cancellazione di un chiamante non interrompe il calcolo
+    finché qualcun altro lo attende; se il calcolo viene cancellato, i
+    chiamanti in attesa lo rieseguono con la propria funzione. Le eccezioni
+    in retry_on sono legate al chiamante che ha avviato il calcolo (ad es.
+    un token scaduto): gli altri riprovano con la propria funzione invece
+    di ereditarle.
+    """
+
+    def __init__(self, retry_on: Tuple[Type[BaseException], ...] = ()):
+        self._in_flight: Dict[Hashable, _Call] = {}
+        self.retry_on = retry_on
+
+        # Statistiche
+        self.calls = 0
+        self.shared = 0
+        self.retried = 0
+
+    def in_flight(self, key: Hashable) -> bool:
+        return key in self._in_flight
+
+    def _forget(self, key: Hashable, call: _Call):
+        if self._in_flight.get(key) is call:
+            del self._in_flight[key]
+
+    async def do(self, key: Hashable, fn: Callable[[], Awaitable[Any]]) -> Any:
+        """Esegue fn una sola volta per tutte le richieste concorrenti sulla chiave"""
+        while True:
+            call = self._in_flight.get(key)
+            leader = call is None
+            if leader:
+                call = _Call(asyncio.ensure_future(fn()))
+                self._in_flight[key] = call
+                call.task.add_done_callback(lambda _, call=call: self._forget(key, call))
+                self.calls += 1
+            else:
+                self.shared += 1
+
+            call.waiters += 1
+            try:
+                return await asyncio.shield(call.task)
+            except asyncio.CancelledError:
+                # Cancellato il chiamante, non il calcolo condiviso
+                if not call.task.cancelled():
+                    raise
+            except self.retry_on:
+                if leader:
+                    raise
+            finally:
+                call.waiters -= 1
+                # Nessuno attende più il risultato: il calcolo si interrompe
+                if call.waiters == 0 and not call.task.done():
+                    call.task.cancel()
+
+            self._forget(key, call)
+            self.retried += 1
+
+    def get_stats(self) -> Dict[str, int]:
+        """Chiamate eseguite, chiamate risparmiate grazie al coalescing e riprove"""
+        return {
+            "calls": self.calls,
+            "saved": self.shared,
+            "retried": self.retried,
+            "in_flight": len(self._in_flight),
+        }
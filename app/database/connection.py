@@ -1,6 +1,7 @@
-from neo4j import GraphDatabase
-from typing import Dict, List, Any, Optional
+from neo4j import GraphDatabase, AsyncGraphDatabase
+from typing import AsyncIterator, Dict, List, Any, Optional
 from app.core.config import settings
+import asyncio
 import logging
 
 logger = logging.getLogger(__name__)
@@ -62,5 +63,104 @@ class Neo4jConnection:
         result = tx.run(query, parameters)
         return [record.data() for record in result]
 
-# Istanza globale della connessione
+class AsyncNeo4jConnection:
+    """Gestisce la connessione asincrona al database Neo4j
+    
+    Usa il driver async di Neo4j, così le query non bloccano l'event loop
+    degli endpoint FastAPI e dei task di import.
+    """
+    
+    def __init__(self):
+        self.driver = None
+        self.uri = settings.NEO4J_URI
+        self.username = settings.NEO4J_USERNAME
+        self.password = settings.NEO4J_PASSWORD
+        self.database = getattr(settings, 'NEO4J_DATABASE', 'neo4j')
+        self._connect_lock = asyncio.Lock()
+    
+    async def connect(self):
+        """Stabilisce la connessione al database"""
+        async with self._connect_lock:
+            if self.driver:
+                return
+            try:
+                driver = AsyncGraphDatabase.driver(
+                    self.uri,
+                    auth=(self.username, self.password),
+                    max_connection_pool_size=settings.NEO4J_MAX_CONNECTION_POOL_SIZE,
+                    connection_acquisition_timeout=settings.NEO4J_CONNECTION_ACQUISITION_TIMEOUT
+                )
+                # Test connessione
+                await driver.verify_connectivity()
+                self.driver = driver
+                logger.info("Successfully connected to Neo4j (async)")
+            except Exception as e:
+                logger.error(f"Failed to connect to Neo4j: {str(e)}")
+                raise
+    
+    async def close(self):
+        """Chiude la connessione al database"""
+        if self.driver:
+            await self.driver.close()
+            self.driver = None
+            logger.info("Neo4j async connection closed")
+    
+    async def get_session(self):
+        """Ottiene una sessione asincrona del database"""
+        if not self.driver:
+            await self.connect()
+        return self.driver.session(database=self.database)
+    
+    async def execute_query(self, query: str, parameters: Optional[Dict] = None) -> List[Dict[str, Any]]:
+        """Esegue una query e ritorna i risultati"""
+        async with await self.get_session() as session:
+            result = await session.run(query, parameters or {})
+            return [record.data() async for record in result]
+    
+    async def stream_query(self,
+                           query: str,
+                           parameters: Optional[Dict] = None) -> AsyncIterator[Dict[str, Any]]:
+        """Esegue una query e produce i record uno alla volta dal cursore del driver
+        
+        Il driver scarica i record a blocchi di NEO4J_STREAM_FETCH_SIZE, quindi
+        la memoria resta costante e il primo record arriva senza attendere
+        l'intero risultato. La sessione resta aperta finché il generatore non
+        viene esaurito o chiuso.
+        """
+        if not self.driver:
+            await self.connect()
+        async with self.driver.session(database=self.database,
+                                       fetch_size=settings.NEO4J_STREAM_FETCH_SIZE) as session:
+            result = await session.run(query, parameters or {})
+            async for record in result:
+                yield record.data()
+    
+    async def stream_query_chunks(self,
+                                  query: str,
+                                  parameters: Optional[Dict] = None,
+                                  chunk_size: Optional[int] = None) -> AsyncIterator[List[Dict[str, Any]]]:
+        """Come stream_query, ma produce liste di al più chunk_size record"""
+        chunk_size = max(1, chunk_size or settings.NEO4J_STREAM_FETCH_SIZE)
+        chunk = []
+        async for record in self.stream_query(query, parameters):
+            chunk.append(record)
+            if len(chunk) >= chunk_size:
+                yield chunk
+                chunk = []
+        if chunk:
+            yield chunk
+    
+    async def execute_write_query(self, query: str, parameters: Optional[Dict] = None) -> List[Dict[str, Any]]:
+        """Esegue una query di scrittura"""
+        async with await self.get_session() as session:
+            return await session.execute_write(self._execute_query, query, parameters or {})
+    
+    @staticmethod
+    async def _execute_query(tx, query: str, parameters: Dict):
+        """Metodo statico per eseguire query in una transazione"""
+        result = await tx.run(query, parameters)
+        return [record.data() async for record in result]
+
+# Istanze globali della connessione
 neo4j_db = Neo4jConnection()
+async_neo4j_db = AsyncNeo4jConnection()
@@ -0,0 +1,119 @@
+"""Bootstrap dello schema Neo4j (vincoli e indici)
+
+Le migrazioni sono idempotenti (IF NOT EXISTS) e numerate: la versione
+applicata viene registrata su nodi :SchemaMigration, così all'avvio si
+eseguono solo quelle mancanti.
+
+Uso da riga di comando:
+    python -m app.database.schema
+"""
+from typing import Dict, List, Any
+import asyncio
+import logging
+
+from app.database.connection import AsyncNeo4jConnection, async_neo4j_db
+
+logger = logging.getLogger(__name__)
+
+# Ogni migrazione: versione crescente, descrizione e statement Cypher di schema
+MIGRATIONS: List[Dict[str, Any]] = [
+    {
+        "version": 1,
+        "description": "Vincoli di unicità sulle chiavi di MERGE",
+        "statements": [
+            "CREATE CONSTRAINT artista_spotify_id IF NOT EXISTS "
+            "FOR (a:Artista) REQUIRE a.spotify_id IS UNIQUE",
+            "CREATE CONSTRAINT album_spotify_id IF NOT EXISTS "
+            "FOR (al:Album) REQUIRE al.spotify_id IS UNIQUE",
+            "CREATE CONSTRAINT brano_spotify_id IF NOT EXISTS "
+            "FOR (t:Brano) REQUIRE t.spotify_id IS UNIQUE",
+            "CREATE CONSTRAINT utente_spotify_user_id IF NOT EXISTS "
+            "FOR (u:Utente) REQUIRE u.spotify_user_id IS UNIQUE",
+            "CREATE CONSTRAINT genere_nome IF NOT EXISTS "
+            "FOR (g:Genere) REQUIRE g.nome IS UNIQUE",
+            "CREATE CONSTRAINT schema_migration_version IF NOT EXISTS "
+            "FOR (m:SchemaMigration) REQUIRE m.version IS UNIQUE",
+        ],
+    },
+    {
+        "version": 2,
+        "description": "Indici su proprietà di relazioni e di sincronizzazione",
+        "statements": [
+            "CREATE INDEX ascolta_time_range IF NOT EXISTS "
+            "FOR ()-[r:ASCOLTA]-() ON (r.time_range)",
+            "CREATE INDEX utente_ultima_sincronizzazione IF NOT EXISTS "
+            "FOR (u:Utente) ON (u.ultima_sincronizzazione)",
+        ],
+    },
+    {
+        "version": 3,
+        "description": "Checkpoint degli import",
+        "statements": [
+            "CREATE CONSTRAINT import_checkpoint_user IF NOT EXISTS "
+            "FOR (c:ImportCheckpoint) REQUIRE c.spotify_user_id IS UNIQUE",
+        ],
+    },
+    {
+        "version": 4,
+        "description": "Playlist",
+        "statements": [
+            "CREATE CONSTRAINT playlist_spotify_id IF NOT EXISTS "
+            "FOR (p:Playlist) REQUIRE p.spotify_id IS UNIQUE",
+        ],
+    },
+    {
+        "version": 5,
+        "description": "Ascolti giornalieri",
+        "statements": [
+            "CREATE INDEX ascolto_giornaliero_giorno IF NOT EXISTS "
+            "FOR ()-[r:ASCOLTO_GIORNALIERO]-() ON (r.giorno)",
+        ],
+    },
+]
+
+
+async def get_applied_version(db: AsyncNeo4jConnection) -> int:
+    """Ritorna la versione di schema più alta già applicata (0 se nessuna)"""
+    result = await db.execute_query(
+        "MATCH (m:SchemaMigration) RETURN max(m.version) as version"
+    )
+    return (result[0]["version"] if result else None) or 0
+
+
+async def apply_migrations(db: AsyncNeo4jConnection = async_neo4j_db) -> int:
+    """Applica le migrazioni mancanti e ritorna la versione di schema corrente"""
+    current_version = await get_applied_version(db)
+
+    for migration in sorted(MIGRATIONS, key=lambda m: m["version"]):
+        if migration["version"] <= current_version:
+            continue
+
+        logger.info(f"🗂️ Applying schema migration {migration['version']}: {migration['description']}")
+        # Le istruzioni di schema girano in transazioni auto-commit separate
+        for statement in migration["statements"]:
+            await db.execute_query(statement)
+
+        await db.execute_write_query(
+            """
+            MERGE (m:SchemaMigration {version: $version})
+            SET m.descrizione = $description,
+                m.applicata_il = datetime()
+            """,
+            {"version": migration["version"], "description": migration["description"]}
+        )
+        current_version = migration["version"]
+
+    logger.info(f"🗂️ Neo4j schema at version {current_version}")
+    return current_version
+
+
+async def _main():
+    try:
+        await apply_migrations()
+    finally:
+        await async_neo4j_db.close()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(_main())
@@ -0,0 +1,166 @@
+from typing import Dict, Any, List, Optional
+import json
+import logging
+import time
+
+from app.core.cache import TTLCache
+from app.core.config import settings
+from app.core.redis import get_redis
+
+logger = logging.getLogger(__name__)
+
+
+class CatalogCache:
+    """Cache condivisa tra utenti per i dettagli di catalogo Spotify
+
+    Artisti, album e tracce sono globali: vengono salvati una volta e serviti
+    a tutti gli import. Una voce è "fresca" per CATALOG_CACHE_TTL_SECONDS;
+    dopo resta disponibile fino a CATALOG_CACHE_STALE_TTL_SECONDS per essere
+    rivalidata con If-None-Match usando l'ETag salvato.
+
+    Livelli: LRU in-process e, opzionalmente, Redis (CATALOG_CACHE_REDIS_ENABLED).
+    """
+
+    def __init__(self):
+        self.ttl_seconds = settings.CATALOG_CACHE_TTL_SECONDS
+        self.stale_ttl_seconds = max(settings.CATALOG_CACHE_STALE_TTL_SECONDS, self.ttl_seconds)
+        self._local = TTLCache(settings.CATALOG_CACHE_MAX_ENTRIES, self.stale_ttl_seconds)
+        self.redis_enabled = settings.CATALOG_CACHE_REDIS_ENABLED
+
+        # Statistiche
+        self.fresh_hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        self.revalidated = 0
+
+    @staticmethod
+    def _key(kind: str, entity_id: str) -> str:
+        return f"catalog:{kind}:{entity_id}"
+
+    def is_fresh(self, entry: Dict[str, Any]) -> bool:
+        """True se la voce è più recente del TTL"""
+        return time.time() - entry["fetched_at"] < self.ttl_seconds
+
+    async def get(self, kind: str, entity_id: str) -> Optional[Dict[str, Any]]:
+        """Ritorna la voce {data, etag, fetched_at} anche se da rivalidare"""
+        key = self._key(kind, entity_id)
+        entry = self._local.get(key)
+
+        if entry is None and self.redis_enabled:
+            entry = await self._redis_get(key)
+            if entry is not None:
+                self._local.set(key, entry)
+
+        self._count(entry)
+        return entry
+
+    async def get_many(self, kind: str, entity_ids: List[str]) -> Dict[str, Dict[str, Any]]:
+        """Come get() per più entità, con un solo MGET su Redis per le mancanti in locale"""
+        entries: Dict[str, Dict[str, Any]] = {}
+        remote: List[str] = []
+        for entity_id in entity_ids:
+            entry = self._local.get(self._key(kind, entity_id))
+            if entry is not None:
+                entries[entity_id] = entry
+            elif self.redis_enabled:
+                remote.append(entity_id)
+
+        if remote:
+            remote_entries = await self._redis_get_many([self._key(kind, entity_id) for entity_id in remote])
+            for entity_id, entry in zip(remote, remote_entries):
+                if entry is not None:
+                    self._local.set(self._key(kind, entity_id), entry)
+                    entries[entity_id] = entry
+
+        for entity_id in entity_ids:
+            self._count(entries.get(entity_id))
+        return entries
+
+    def _count(self, entry: Optional[Dict[str, Any]]):
+        if entry is None:
+            self.misses += 1
+        elif self.is_fresh(entry):
+            self.fresh_hits += 1
+        else:
+            self.stale_hits += 1
+
+    async def set(self, kind: str, entity_id: str, data: Dict[str, Any], etag: Optional[str] = None):
+        """Salva i dettagli di un'entità"""
+        entry = {"data": data, "etag": etag, "fetched_at": time.time()}
+        await self._store(self._key(kind, entity_id), entry)
+
+    async def set_many(self, kind: str, items: List[Dict[str, Any]]):
+        """Salva più entità (dizionari con "id"), in un'unica pipeline su Redis"""
+        fetched_at = time.time()
+        entries = {
+            self._key(kind, item["id"]): {"data": item, "etag": None, "fetched_at": fetched_at}
+            for item in items
+        }
+        for key, entry in entries.items():
+            self._local.set(key, entry)
+        if not entries or not self.redis_enabled:
+            return
+        redis = get_redis()
+        if redis is None:
+            return
+        try:
+            async with redis.pipeline(transaction=False) as pipe:
+                for key, entry in entries.items():
+                    pipe.set(key, json.dumps(entry), ex=int(self.stale_ttl_seconds))
+                await pipe.execute()
+        except Exception as e:
+            logger.warning(f"Catalog cache Redis write failed: {str(e)}")
+
+    async def touch(self, kind: str, entity_id: str, entry: Dict[str, Any]):
+        """Rinfresca una voce rivalidata (304 Not Modified)"""
+        self.revalidated += 1
+        entry = dict(entry, fetched_at=time.time())
+        await self._store(self._key(kind, entity_id), entry)
+
+    async def _store(self, key: str, entry: Dict[str, Any]):
+        self._local.set(key, entry)
+        if self.redis_enabled:
+            redis = get_redis()
+            if redis is None:
+                return
+            try:
+                await redis.set(key, json.dumps(entry), ex=int(self.stale_ttl_seconds))
+            except Exception as e:
+                logger.warning(f"Catalog cache Redis write failed: {str(e)}")
+
+    async def _redis_get(self, key: str) -> Optional[Dict[str, Any]]:
+        redis = get_redis()
+        if redis is None:
+            return None
+        try:
+            raw = await redis.get(key)
+        except Exception as e:
+            logger.warning(f"Catalog cache Redis read failed: {str(e)}")
+            return None
+        return json.loads(raw) if raw else None
+
+    async def _redis_get_many(self, keys: List[str]) -> List[Optional[Dict[str, Any]]]:
+        redis = get_redis()
+        if redis is None:
+            return [None] * len(keys)
+        try:
+            raws = await redis.mget(keys)
+        except Exception as e:
+            logger.warning(f"Catalog cache Redis read failed: {str(e)}")
+            return [None] * len(keys)
+        return [json.loads(raw) if raw else None for raw in raws]
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Statistiche della cache"""
+        return {
+            "entries": len(self._local),
+            "fresh_hits": self.fresh_hits,
+            "stale_hits": self.stale_hits,
+            "misses": self.misses,
+            "revalidated": self.revalidated,
+            "redis_enabled": self.redis_enabled,
+        }
+
+
+# Istanza globale della cache di catalogo
+catalog_cache = CatalogCache()
@@ -0,0 +1,100 @@
+from typing import Callable, Dict, Any
+import asyncio
+import time
+
+from app.core.config import settings
+
+
+class AsyncTokenBucket:
+    """Rate limiter token bucket condiviso tra coroutine
+
+    I token si ricaricano a `rate` al secondo fino a `capacity`. Le coroutine
+    in attesa vengono servite in ordine FIFO; pause() sospende l'intero
+    bucket (ad es. su Retry-After di un 429) per tutte le richieste in volo.
+    """
+
+    def __init__(self,
+                 rate: float,
+                 capacity: int,
+                 clock: Callable[[], float] = time.monotonic,
+                 sleep: Callable[[float], Any] = asyncio.sleep):
+        self.rate = max(rate, 0.001)
+        self.capacity = max(1, capacity)
+        self._clock = clock
+        self._sleep = sleep
+        self._tokens = float(self.capacity)
+        self._last_refill = clock()
+        self._paused_until = 0.0
+        self._lock = asyncio.Lock()
+
+        # Statistiche
+        self.acquired = 0
+        self.waited = 0
+        self.total_wait_seconds = 0.0
+        self.pauses = 0
+
+    def _refill(self, now: float):
+        elapsed = now - self._last_refill
+        if elapsed <= 0:
+            return
+        self._tokens = min(self.capacity, self._tokens + elapsed * self.rate)
+        self._last_refill = now
+
+    async def acquire(self):
+        """Attende finché un token è disponibile e il bucket non è in pausa"""
+        started = self._clock()
+        # Misurare solo l'intervallo non basta: con l'orologio reale è sempre > 0
+        slept = False
+        async with self._lock:
+            while True:
+                now = self._clock()
+                self._refill(now)
+                if now < self._paused_until:
+                    wait = self._paused_until - now
+                elif self._tokens >= 1:
+                    self._tokens -= 1
+                    break
+                else:
+                    wait = (1 - self._tokens) / self.rate
+                await self._sleep(wait)
+                slept = True
+
+        self.acquired += 1
+        if slept:
+            self.waited += 1
+            self.total_wait_seconds += self._clock() - started
+
+    def pause(self, seconds: float):
+        """Sospende il bucket per `seconds` secondi (estende una pausa già attiva)"""
+        self.pauses += 1
+        self._paused_until = max(self._paused_until, self._clock() + seconds)
+        # Dopo la pausa si riparte senza burst accumulato
+        self._tokens = 0.0
+        self._last_refill = self._paused_until
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Statistiche del limiter"""
+        return {
+            "rate_per_second": self.rate,
+            "capacity": self.capacity,
+            "acquired": self.acquired,
+            "waited": self.waited,
+            "total_wait_seconds": round(self.total_wait_seconds, 3),
+            "pauses": self.pauses,
+        }
+
+
+# Limiter condivisi per chiave (credenziali dell'app o "global")
+_rate_limiters: Dict[str, AsyncTokenBucket] = {}
+
+
+def get_rate_limiter(key: str = "global") -> AsyncTokenBucket:
+    """Ritorna il token bucket condiviso associato alla chiave"""
+    limiter = _rate_limiters.get(key)
+    if limiter is None:
+        limiter = AsyncTokenBucket(
+            rate=settings.SPOTIFY_RATE_LIMIT_PER_SECOND,
+            capacity=settings.SPOTIFY_RATE_LIMIT_BURST
+        )
+        _rate_limiters[key] = limiter
+    return limiter
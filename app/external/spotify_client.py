@@ -1,16 +1,33 @@
 import httpx
 import asyncio
-import time
-from typing import Dict, List, Optional, Any
+import random
+import re
+from typing import AsyncIterator, Awaitable, Callable, Dict, List, Optional, Any, Union
 from urllib.parse import urlencode
 from app.core.config import settings
+from app.core.singleflight import SingleFlight
+from app.external.catalog_cache import catalog_cache
+from app.external.rate_limiter import get_rate_limiter
 import logging
 
 logger = logging.getLogger(__name__)
 
+# Token di accesso: stringa fissa oppure provider async risolto a ogni richiesta
+AccessToken = Union[str, Callable[[], Awaitable[str]]]
+
+# Endpoint di catalogo (dati globali, non legati all'utente)
+CATALOG_ENDPOINT_RE = re.compile(r"^/?(artists|albums|tracks)(/|$)")
+
+class SpotifyAuthError(Exception):
+    """Token di accesso rifiutato da Spotify (401)"""
+
 class SpotifyClient:
     """Client per interagire con le API di Spotify"""
     
+    # Limiti degli endpoint multi-ID
+    MAX_ARTISTS_PER_REQUEST = 50
+    MAX_ALBUMS_PER_REQUEST = 20
+    
     def __init__(self):
         self.client_id = settings.SPOTIFY_CLIENT_ID
         self.client_secret = settings.SPOTIFY_CLIENT_SECRET
@@ -19,9 +36,53 @@ class SpotifyClient:
         self.auth_url = "https://accounts.spotify.com/api/token"
         self.authorize_url = "https://accounts.spotify.com/authorize"
         
-        # Rate limiting
-        self.last_request_time = 0
-        self.min_request_interval = 0.1  # 100ms between requests
+        # Rate limiting: token bucket condiviso per credenziali dell'app
+        self.rate_limiter = get_rate_limiter(self.client_id or "global")
+        self.max_retries = settings.SPOTIFY_MAX_RETRIES
+        self.retry_count = 0
+        
+        # Cache di catalogo condivisa tra utenti
+        self.catalog_cache = catalog_cache
+        
+        # Coalescing delle GET di catalogo identiche in volo; un token rifiutato
+        # è un errore del solo chiamante, quindi gli altri riprovano col proprio
+        self.single_flight = SingleFlight(retry_on=(SpotifyAuthError,))
+        
+        # Client HTTP condiviso (connection pooling + keep-alive)
+        self._http_client: Optional[httpx.AsyncClient] = None
+    
+    async def start(self):
+        """Apre il client HTTP condiviso con il pool di connessioni"""
+        if self._http_client is not None and not self._http_client.is_closed:
+            return
+        
+        limits = httpx.Limits(
+            max_connections=settings.SPOTIFY_HTTP_MAX_CONNECTIONS,
+            max_keepalive_connections=settings.SPOTIFY_HTTP_MAX_KEEPALIVE_CONNECTIONS,
+            keepalive_expiry=settings.SPOTIFY_HTTP_KEEPALIVE_EXPIRY
+        )
+        self._http_client = httpx.AsyncClient(
+            http2=settings.SPOTIFY_HTTP2,
+            limits=limits,
+            timeout=settings.SPOTIFY_API_TIMEOUT
+        )
+        logger.info(
+            f"Spotify HTTP client opened (http2={settings.SPOTIFY_HTTP2}, "
+            f"max_connections={settings.SPOTIFY_HTTP_MAX_CONNECTIONS})"
+        )
+    
+    async def close(self):
+        """Chiude il client HTTP condiviso"""
+        if self._http_client is not None:
+            await self._http_client.aclose()
+            self._http_client = None
+            logger.info("Spotify HTTP client closed")
+    
+    async def _get_http_client(self) -> httpx.AsyncClient:
+        """Ritorna il client HTTP condiviso, aprendolo se necessario"""
+        if self._http_client is None or self._http_client.is_closed:
+            await self.start()
+        return self._http_client
         
     def get_authorization_url(self, state: str = None) -> str:
         """Genera URL per l'autorizzazione Spotify OAuth2"""
@@ -58,19 +119,19 @@ class SpotifyClient:
             "client_secret": self.client_secret
         }
         
-        async with httpx.AsyncClient() as client:
-            response = await client.post(
-                self.auth_url,
-                data=data,
-                headers={"Content-Type": "application/x-www-form-urlencoded"},
-                timeout=settings.SPOTIFY_API_TIMEOUT
-            )
+        client = await self._get_http_client()
+        response = await client.post(
+            self.auth_url,
+            data=data,
+            headers={"Content-Type": "application/x-www-form-urlencoded"},
+            timeout=settings.SPOTIFY_API_TIMEOUT
+        )
+        
+        if response.status_code != 200:
+            logger.error(f"Token exchange failed: {response.status_code} - {response.text}")
+            raise Exception(f"Failed to exchange code for token: {response.status_code}")
             
-            if response.status_code != 200:
-                logger.error(f"Token exchange failed: {response.status_code} - {response.text}")
-                raise Exception(f"Failed to exchange code for token: {response.status_code}")
-                
-            return response.json()
+        return response.json()
     
     async def refresh_access_token(self, refresh_token: str) -> Dict[str, Any]:
         """Aggiorna l'access token usando il refresh token"""
@@ -81,71 +142,219 @@ class SpotifyClient:
             "client_secret": self.client_secret
         }
         
-        async with httpx.AsyncClient() as client:
-            response = await client.post(
-                self.auth_url,
-                data=data,
-                headers={"Content-Type": "application/x-www-form-urlencoded"},
-                timeout=settings.SPOTIFY_API_TIMEOUT
-            )
+        client = await self._get_http_client()
+        response = await client.post(
+            self.auth_url,
+            data=data,
+            headers={"Content-Type": "application/x-www-form-urlencoded"},
+            timeout=settings.SPOTIFY_API_TIMEOUT
+        )
+        
+        if response.status_code != 200:
+            logger.error(f"Token refresh failed: {response.status_code} - {response.text}")
+            raise Exception(f"Failed to refresh token: {response.status_code}")
             
-            if response.status_code != 200:
-                logger.error(f"Token refresh failed: {response.status_code} - {response.text}")
-                raise Exception(f"Failed to refresh token: {response.status_code}")
-                
-            return response.json()
+        return response.json()
+    
+    def _backoff_delay(self, attempt: int) -> float:
+        """Backoff esponenziale con full jitter"""
+        cap = min(settings.SPOTIFY_BACKOFF_MAX_SECONDS,
+                  settings.SPOTIFY_BACKOFF_BASE_SECONDS * (2 ** attempt))
+        return random.uniform(0, cap)
     
     async def _make_request(self, 
                            method: str, 
                            endpoint: str, 
-                           access_token: str,
+                           access_token: AccessToken,
                            params: Optional[Dict] = None,
                            data: Optional[Dict] = None) -> Dict[str, Any]:
-        """Esegue una richiesta HTTP alle API Spotify con rate limiting"""
+        """Esegue una richiesta HTTP alle API Spotify e ritorna il JSON"""
+        response = await self._send(method, endpoint, access_token, params=params, data=data)
+        return response.json()
+    
+    async def _send(self,
+                    method: str,
+                    endpoint: str,
+                    access_token: AccessToken,
+                    params: Optional[Dict] = None,
+                    data: Optional[Dict] = None,
+                    extra_headers: Optional[Dict] = None) -> httpx.Response:
+        """Esegue una richiesta, condividendo le GET di catalogo identiche già in volo
         
-        # Rate limiting
-        current_time = time.time()
-        time_since_last_request = current_time - self.last_request_time
-        if time_since_last_request < self.min_request_interval:
-            await asyncio.sleep(self.min_request_interval - time_since_last_request)
+        I dati di catalogo sono globali, quindi la chiave di coalescing non
+        include il token: richieste di utenti diversi condividono la stessa
+        chiamata HTTP. Se il token di chi l'ha avviata viene rifiutato (401) o
+        la sua richiesta viene cancellata, gli altri riprovano col proprio token.
+        """
+        if method.upper() == "GET" and CATALOG_ENDPOINT_RE.match(endpoint):
+            key = (
+                endpoint.lstrip("/"),
+                tuple(sorted((params or {}).items())),
+                tuple(sorted((extra_headers or {}).items()))
+            )
+            return await self.single_flight.do(
+                key,
+                lambda: self._send_with_retries(method, endpoint, access_token, params, data, extra_headers)
+            )
+        return await self._send_with_retries(method, endpoint, access_token, params, data, extra_headers)
+    
+    async def _send_with_retries(self,
+                                 method: str,
+                                 endpoint: str,
+                                 access_token: AccessToken,
+                                 params: Optional[Dict] = None,
+                                 data: Optional[Dict] = None,
+                                 extra_headers: Optional[Dict] = None) -> httpx.Response:
+        """Esegue una richiesta HTTP alle API Spotify con rate limiting e retry limitati
         
-        headers = {
-            "Authorization": f"Bearer {access_token}",
-            "Content-Type": "application/json"
-        }
+        I 429 mettono in pausa l'intero token bucket per il Retry-After; 429, 5xx
+        ed errori di trasporto vengono ritentati fino a SPOTIFY_MAX_RETRIES volte.
+        Ritorna la risposta (2xx o 304 per le richieste condizionali).
+        Un token provider viene risolto a ogni tentativo, così le operazioni
+        lunghe usano sempre il token rinnovato.
+        """
+        if method.upper() not in ("GET", "POST"):
+            raise ValueError(f"Unsupported HTTP method: {method}")
         
         url = f"{self.base_url}/{endpoint.lstrip('/')}"
+        client = await self._get_http_client()
         
-        async with httpx.AsyncClient() as client:
-            if method.upper() == "GET":
-                response = await client.get(url, headers=headers, params=params, timeout=settings.SPOTIFY_API_TIMEOUT)
-            elif method.upper() == "POST":
-                response = await client.post(url, headers=headers, json=data, timeout=settings.SPOTIFY_API_TIMEOUT)
+        for attempt in range(self.max_retries + 1):
+            last_attempt = attempt == self.max_retries
+            token = await access_token() if callable(access_token) else access_token
+            headers = {
+                "Authorization": f"Bearer {token}",
+                "Content-Type": "application/json"
+            }
+            if extra_headers:
+                headers.update(extra_headers)
+            await self.rate_limiter.acquire()
+            
+            try:
+                if method.upper() == "GET":
+                    response = await client.get(url, headers=headers, params=params, timeout=settings.SPOTIFY_API_TIMEOUT)
+                else:
+                    response = await client.post(url, headers=headers, json=data, timeout=settings.SPOTIFY_API_TIMEOUT)
+            except httpx.TransportError as e:
+                if last_attempt:
+                    raise
+                delay = self._backoff_delay(attempt)
+                logger.warning(f"Spotify transport error ({str(e)}), retrying in {delay:.2f}s")
+                self.retry_count += 1
+                await asyncio.sleep(delay)
+                continue
+            
+            if response.status_code == 401:
+                raise SpotifyAuthError("Access token expired or invalid")
+            elif response.status_code == 429:
+                if last_attempt:
+                    raise Exception("Spotify API rate limit exceeded")
+                retry_after = response.headers.get("Retry-After")
+                delay = float(retry_after) if retry_after else self._backoff_delay(attempt)
+                logger.warning(f"Rate limited, pausing all requests for {delay} seconds")
+                # La pausa vale per tutte le coroutine che condividono il bucket
+                self.rate_limiter.pause(delay)
+                self.retry_count += 1
+                continue
+            elif response.status_code >= 500:
+                if last_attempt:
+                    logger.error(f"Spotify API error: {response.status_code} - {response.text}")
+                    raise Exception(f"Spotify API error: {response.status_code}")
+                delay = self._backoff_delay(attempt)
+                logger.warning(f"Spotify API error {response.status_code}, retrying in {delay:.2f}s")
+                self.retry_count += 1
+                await asyncio.sleep(delay)
+                continue
+            elif response.status_code >= 400:
+                logger.error(f"Spotify API error: {response.status_code} - {response.text}")
+                raise Exception(f"Spotify API error: {response.status_code}")
+            
+            return response
+    
+    async def _get_catalog_item(self, kind: str, entity_id: str, access_token: AccessToken) -> Dict[str, Any]:
+        """Ottiene un'entità di catalogo passando dalla cache condivisa
+        
+        Le voci scadute con ETag vengono rivalidate con If-None-Match.
+        """
+        entry = await self.catalog_cache.get(kind, entity_id)
+        if entry is not None and self.catalog_cache.is_fresh(entry):
+            return entry["data"]
+        
+        extra_headers = None
+        if entry is not None and entry.get("etag"):
+            extra_headers = {"If-None-Match": entry["etag"]}
+        
+        response = await self._send("GET", f"/{kind}/{entity_id}", access_token, extra_headers=extra_headers)
+        if response.status_code == 304 and entry is not None:
+            await self.catalog_cache.touch(kind, entity_id, entry)
+            return entry["data"]
+        
+        data = response.json()
+        await self.catalog_cache.set(kind, entity_id, data, etag=response.headers.get("ETag"))
+        return data
+    
+    async def _get_several_catalog_items(self,
+                                         kind: str,
+                                         entity_ids: List[str],
+                                         access_token: AccessToken,
+                                         max_per_request: int) -> List[Dict[str, Any]]:
+        """Ottiene più entità di catalogo: cache condivisa, poi endpoint multi-ID per le mancanti"""
+        found = {}
+        missing = []
+        entries = await self.catalog_cache.get_many(kind, entity_ids)
+        for entity_id in entity_ids:
+            entry = entries.get(entity_id)
+            if entry is not None and self.catalog_cache.is_fresh(entry):
+                found[entity_id] = entry["data"]
             else:
-                raise ValueError(f"Unsupported HTTP method: {method}")
-        
-        self.last_request_time = time.time()
-        
-        if response.status_code == 401:
-            raise Exception("Access token expired or invalid")
-        elif response.status_code == 429:
-            # Rate limited
-            retry_after = int(response.headers.get("Retry-After", 1))
-            logger.warning(f"Rate limited, waiting {retry_after} seconds")
-            await asyncio.sleep(retry_after)
-            return await self._make_request(method, endpoint, access_token, params, data)
-        elif response.status_code >= 400:
-            logger.error(f"Spotify API error: {response.status_code} - {response.text}")
-            raise Exception(f"Spotify API error: {response.status_code}")
+                missing.append(entity_id)
         
-        return response.json()
+        for i in range(0, len(missing), max_per_request):
+            chunk = missing[i:i + max_per_request]
+            response = await self._make_request(
+                "GET", f"/{kind}", access_token, params={"ids": ",".join(chunk)}
+            )
+            # Spotify ritorna null per gli ID non validi
+            items = [item for item in response.get(kind, []) if item]
+            for item in items:
+                found[item["id"]] = item
+            await self.catalog_cache.set_many(kind, items)
+        
+        return [found[entity_id] for entity_id in entity_ids if entity_id in found]
     
-    async def get_user_profile(self, access_token: str) -> Dict[str, Any]:
+    def get_stats(self) -> Dict[str, Any]:
+        """Statistiche del client (rate limiter, retry e cache di catalogo)"""
+        return {
+            "rate_limiter": self.rate_limiter.get_stats(),
+            "retries": self.retry_count,
+            "catalog_cache": self.catalog_cache.get_stats(),
+            "coalescing": self.single_flight.get_stats()
+        }
+    
+    async def iterate_pages(self,
+                            access_token: AccessToken,
+                            endpoint: str,
+                            params: Optional[Dict] = None) -> AsyncIterator[Dict[str, Any]]:
+        """Itera le pagine di un endpoint paginato seguendo i link `next`
+        
+        Produce una pagina alla volta, così il chiamante può elaborarla e
+        scriverla prima di richiedere la successiva.
+        """
+        page = await self._make_request("GET", endpoint, access_token, params=params)
+        while True:
+            yield page
+            next_url = page.get("next")
+            if not next_url:
+                return
+            # `next` è un URL assoluto che contiene già la query string
+            page = await self._make_request("GET", next_url.replace(self.base_url, "", 1), access_token)
+    
+    async def get_user_profile(self, access_token: AccessToken) -> Dict[str, Any]:
         """Ottiene il profilo dell'utente corrente"""
         return await self._make_request("GET", "/me", access_token)
     
     async def get_user_top_artists(self, 
-                                  access_token: str, 
+                                  access_token: AccessToken, 
                                   time_range: str = "medium_term",
                                   limit: int = 50) -> Dict[str, Any]:
         """Ottiene i top artists dell'utente
@@ -161,7 +370,7 @@ class SpotifyClient:
         return await self._make_request("GET", "/me/top/artists", access_token, params=params)
     
     async def get_user_top_tracks(self, 
-                                 access_token: str,
+                                 access_token: AccessToken,
                                  time_range: str = "medium_term", 
                                  limit: int = 50) -> Dict[str, Any]:
         """Ottiene i top tracks dell'utente"""
@@ -171,8 +380,50 @@ class SpotifyClient:
         }
         return await self._make_request("GET", "/me/top/tracks", access_token, params=params)
     
+    def iterate_saved_tracks(self,
+                             access_token: AccessToken,
+                             offset: int = 0,
+                             limit: int = 50) -> AsyncIterator[Dict[str, Any]]:
+        """Itera le pagine dei brani salvati nella libreria dell'utente"""
+        return self.iterate_pages(access_token, "/me/tracks", params={"limit": limit, "offset": offset})
+    
+    def iterate_saved_albums(self,
+                             access_token: AccessToken,
+                             offset: int = 0,
+                             limit: int = 50) -> AsyncIterator[Dict[str, Any]]:
+        """Itera le pagine degli album salvati nella libreria dell'utente"""
+        return self.iterate_pages(access_token, "/me/albums", params={"limit": limit, "offset": offset})
+    
+    def iterate_recently_played(self,
+                                access_token: AccessToken,
+                                after: Optional[int] = None,
+                                limit: int = 50) -> AsyncIterator[Dict[str, Any]]:
+        """Itera le pagine dei brani ascoltati di recente
+        
+        after (timestamp Unix in millisecondi) limita ai soli ascolti successivi.
+        """
+        params = {"limit": limit}
+        if after is not None:
+            params["after"] = after
+        return self.iterate_pages(access_token, "/me/player/recently-played", params=params)
+    
+    def iterate_user_playlists(self,
+                               access_token: AccessToken,
+                               limit: int = 50) -> AsyncIterator[Dict[str, Any]]:
+        """Itera le pagine delle playlist dell'utente (proprie e seguite)"""
+        return self.iterate_pages(access_token, "/me/playlists", params={"limit": limit})
+    
+    def iterate_playlist_tracks(self,
+                                access_token: AccessToken,
+                                playlist_id: str,
+                                limit: int = 100) -> AsyncIterator[Dict[str, Any]]:
+        """Itera le pagine dei brani di una playlist"""
+        return self.iterate_pages(
+            access_token, f"/playlists/{playlist_id}/tracks", params={"limit": limit}
+        )
+    
     async def get_artist_albums(self, 
-                               access_token: str,
+                               access_token: AccessToken,
                                artist_id: str, 
                                limit: int = 50) -> Dict[str, Any]:
         """Ottiene gli album di un artista"""
@@ -184,7 +435,7 @@ class SpotifyClient:
         return await self._make_request("GET", f"/artists/{artist_id}/albums", access_token, params=params)
     
     async def get_album_tracks(self, 
-                              access_token: str,
+                              access_token: AccessToken,
                               album_id: str,
                               limit: int = 50) -> Dict[str, Any]:
         """Ottiene le tracce di un album"""
@@ -192,19 +443,41 @@ class SpotifyClient:
         return await self._make_request("GET", f"/albums/{album_id}/tracks", access_token, params=params)
     
     async def get_artist_details(self, 
-                                access_token: str,
+                                access_token: AccessToken,
                                 artist_id: str) -> Dict[str, Any]:
         """Ottiene i dettagli di un artista"""
-        return await self._make_request("GET", f"/artists/{artist_id}", access_token)
+        return await self._get_catalog_item("artists", artist_id, access_token)
     
     async def get_album_details(self, 
-                               access_token: str,
+                               access_token: AccessToken,
                                album_id: str) -> Dict[str, Any]:
         """Ottiene i dettagli di un album"""
-        return await self._make_request("GET", f"/albums/{album_id}", access_token)
+        return await self._get_catalog_item("albums", album_id, access_token)
+    
+    async def get_track_details(self,
+                                access_token: AccessToken,
+                                track_id: str) -> Dict[str, Any]:
+        """Ottiene i dettagli di una traccia"""
+        return await self._get_catalog_item("tracks", track_id, access_token)
+    
+    async def get_several_artists(self,
+                                  access_token: AccessToken,
+                                  artist_ids: List[str]) -> List[Dict[str, Any]]:
+        """Ottiene i dettagli di più artisti con l'endpoint multi-ID (max 50 per chiamata)"""
+        return await self._get_several_catalog_items(
+            "artists", artist_ids, access_token, self.MAX_ARTISTS_PER_REQUEST
+        )
+    
+    async def get_several_albums(self,
+                                 access_token: AccessToken,
+                                 album_ids: List[str]) -> List[Dict[str, Any]]:
+        """Ottiene i dettagli di più album con l'endpoint multi-ID (max 20 per chiamata)"""
+        return await self._get_several_catalog_items(
+            "albums", album_ids, access_token, self.MAX_ALBUMS_PER_REQUEST
+        )
     
     async def search(self, 
-                    access_token: str,
+                    access_token: AccessToken,
                     query: str, 
                     search_type: str = "artist,album,track",
                     limit: int = 20) -> Dict[str, Any]:
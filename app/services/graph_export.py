@@ -0,0 +1,128 @@
+"""Export in streaming del sottografo musicale di un utente
+
+Il sottografo (Utente → Brano → Album/Artista → Genere, più album salvati,
+artisti preferiti e artisti degli album, con i rispettivi generi) viene
+letto con due query in streaming, una per i nodi e una per le relazioni,
+ciascuna deduplicata lato database. Nodi e relazioni vengono serializzati (NDJSON o
+GraphML) e, se richiesto, compressi con gzip man mano che escono dal
+cursore, quindi la memoria resta costante anche per sottografi molto grandi.
+"""
+from typing import Any, AsyncIterator, Dict
+from xml.sax.saxutils import escape, quoteattr
+import json
+import zlib
+
+from app.database.connection import async_neo4j_db
+
+EXPORT_FORMATS = ("ndjson", "graphml")
+
+# Chiave stabile di un nodo: etichetta più la sua chiave di MERGE
+NODE_ID = "labels({var})[0] + ':' + coalesce({var}.spotify_id, {var}.spotify_user_id, {var}.nome)"
+
+# Percorsi dall'utente (u) agli album e agli artisti esportati: ogni
+# artista raggiunto porta con sé i suoi generi, ogni album i suoi artisti
+ALBUM_PATHS = (
+    "(u)-[:ASCOLTA|HA_SALVATO]->(:Brano)<-[:CONTIENE]-(al:Album)",
+    "(u)-[:HA_SALVATO]->(al:Album)",
+)
+ARTIST_PATHS = (
+    "(u)-[:ASCOLTA|HA_SALVATO]->(:Brano)<-[:ESEGUE]-(a:Artista)",
+    "(u)-[:PREFERISCE]->(a:Artista)",
+) + tuple(path + "<-[:PUBBLICATO]-(a:Artista)" for path in ALBUM_PATHS)
+
+
+def _union(branches) -> str:
+    """CALL {} con un ramo per (MATCH, RETURN), deduplicato da UNION"""
+    body = "\n    UNION\n".join(
+        f"    WITH u\n    MATCH {match}\n    RETURN {returns}" if match else f"    WITH u\n    RETURN {returns}"
+        for match, returns in branches
+    )
+    return "MATCH (u:Utente {spotify_user_id: $spotify_user_id})\nCALL {\n" + body + "\n}\n"
+
+
+# Ogni destinazione prodotta da EDGES_QUERY deve comparire tra i nodi
+NODES_QUERY = _union(
+    [(None, "u as n"), ("(u)-[:ASCOLTA|HA_SALVATO]->(t:Brano)", "t as n")]
+    + [(path, "al as n") for path in ALBUM_PATHS]
+    + [(path, "a as n") for path in ARTIST_PATHS]
+    + [(path + "-[:DI_GENERE]->(g:Genere)", "g as n") for path in ARTIST_PATHS]
+) + "RETURN " + NODE_ID.format(var="n") + " as id, labels(n)[0] as label, properties(n) as properties\n"
+
+EDGES_QUERY = _union(
+    [
+        ("(u)-[r:ASCOLTA|HA_SALVATO|PREFERISCE]->(n)", "r, u as source, n as target"),
+        ("(u)-[:ASCOLTA|HA_SALVATO]->(t:Brano)<-[r:CONTIENE|ESEGUE]-(n)", "r, n as source, t as target"),
+    ]
+    + [(path + "<-[r:PUBBLICATO]-(a:Artista)", "r, a as source, al as target") for path in ALBUM_PATHS]
+    + [(path + "-[r:DI_GENERE]->(g:Genere)", "r, a as source, g as target") for path in ARTIST_PATHS]
+) + (
+    "RETURN " + NODE_ID.format(var="source") + " as source,\n"
+    "       " + NODE_ID.format(var="target") + " as target,\n"
+    "       type(r) as label, properties(r) as properties\n"
+)
+
+
+async def stream_user_graph(spotify_user_id: str) -> AsyncIterator[Dict[str, Any]]:
+    """Produce prima i nodi e poi le relazioni del sottografo dell'utente"""
+    parameters = {"spotify_user_id": spotify_user_id}
+    async for record in async_neo4j_db.stream_query(NODES_QUERY, parameters):
+        yield dict(record, type="node")
+    async for record in async_neo4j_db.stream_query(EDGES_QUERY, parameters):
+        yield dict(record, type="edge")
+
+
+async def to_ndjson(elements: AsyncIterator[Dict[str, Any]]) -> AsyncIterator[str]:
+    """Una riga JSON per nodo o relazione"""
+    async for element in elements:
+        yield json.dumps(element, default=str) + "\n"
+
+
+async def to_graphml(elements: AsyncIterator[Dict[str, Any]]) -> AsyncIterator[str]:
+    """GraphML con etichetta e proprietà (JSON) come attributi di nodi e archi
+
+    Le chiavi GraphML vanno dichiarate prima del grafo: per non dover
+    conoscere in anticipo tutte le proprietà, queste sono serializzate in
+    un unico attributo JSON.
+    """
+    yield (
+        '<?xml version="1.0" encoding="UTF-8"?>\n'
+        '<graphml xmlns="http://graphml.graphdrawing.org/xmlns">\n'
+        '  <key id="label" for="all" attr.name="label" attr.type="string"/>\n'
+        '  <key id="properties" for="all" attr.name="properties" attr.type="string"/>\n'
+        '  <graph id="music_atlas" edgedefault="directed">\n'
+    )
+    async for element in elements:
+        data = (
+            f'<data key="label">{escape(element["label"])}</data>'
+            f'<data key="properties">{escape(json.dumps(element["properties"], default=str))}</data>'
+        )
+        if element["type"] == "node":
+            yield f'    <node id={quoteattr(element["id"])}>{data}</node>\n'
+        else:
+            yield (
+                f'    <edge source={quoteattr(element["source"])} '
+                f'target={quoteattr(element["target"])}>{data}</edge>\n'
+            )
+    yield '  </graph>\n</graphml>\n'
+
+
+async def encode(chunks: AsyncIterator[str], compress: bool = False) -> AsyncIterator[bytes]:
+    """Codifica in UTF-8 e, con compress, comprime in gzip in modo incrementale"""
+    # wbits=31: formato gzip (header e trailer) invece di zlib grezzo
+    compressor = zlib.compressobj(wbits=31) if compress else None
+    async for chunk in chunks:
+        data = chunk.encode()
+        if compressor is None:
+            yield data
+            continue
+        compressed = compressor.compress(data)
+        if compressed:
+            yield compressed
+    if compressor is not None:
+        yield compressor.flush()
+
+
+def export_user_graph(spotify_user_id: str, export_format: str, compress: bool = False) -> AsyncIterator[bytes]:
+    """Stream di byte dell'export nel formato richiesto ("ndjson" o "graphml")"""
+    serializer = to_graphml if export_format == "graphml" else to_ndjson
+    return encode(serializer(stream_user_graph(spotify_user_id)), compress=compress)
@@ -0,0 +1,96 @@
+from typing import Any, Awaitable, Callable, List, Optional, Union
+import asyncio
+import inspect
+import logging
+
+logger = logging.getLogger(__name__)
+
+WriteFn = Callable[..., Awaitable[Any]]
+CommitCallback = Callable[[Any], Any]
+
+
+class GraphWriter:
+    """Writer dedicato che svuota una coda limitata di scritture verso Neo4j
+
+    I produttori (fetch e idratazione) accodano scritture con submit();
+    quando la coda è piena submit() attende, applicando backpressure.
+    Un singolo task esegue le scritture in ordine FIFO, quindi l'ordine di
+    accodamento (artisti, album, brani, relazioni) viene rispettato.
+    """
+
+    def __init__(self, max_pending: int):
+        self._queue: asyncio.Queue = asyncio.Queue(maxsize=max(1, max_pending))
+        self._task: Optional[asyncio.Task] = None
+        self._error: Optional[BaseException] = None
+
+    async def __aenter__(self) -> "GraphWriter":
+        self.start()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            await self.close()
+        else:
+            self.cancel()
+
+    def start(self):
+        """Avvia il task writer"""
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def submit(self,
+                     write_fn: WriteFn,
+                     *args: Any,
+                     on_commit: Optional[Union[CommitCallback, List[CommitCallback]]] = None):
+        """Accoda una scrittura; le callback on_commit (anche async) ricevono il risultato dopo il commit"""
+        self._raise_if_failed()
+        await self._queue.put((write_fn, args, on_commit))
+
+    async def close(self):
+        """Attende lo svuotamento della coda e propaga l'eventuale errore"""
+        if self._task is not None:
+            await self._queue.put(None)
+            await self._task
+            self._task = None
+        self._raise_if_failed()
+
+    def cancel(self):
+        """Interrompe il writer senza attendere le scritture pendenti"""
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    @property
+    def failed(self) -> bool:
+        """True se una scrittura è fallita (le successive vengono scartate)"""
+        return self._error is not None
+
+    def _raise_if_failed(self):
+        if self._error is not None:
+            raise self._error
+
+    async def _run(self):
+        while True:
+            item = await self._queue.get()
+            try:
+                if item is None:
+                    return
+                # Dopo un errore la coda viene solo svuotata, per non bloccare i produttori
+                if self._error is not None:
+                    continue
+
+                write_fn, args, on_commit = item
+                try:
+                    result = await write_fn(*args)
+                    callbacks = on_commit if isinstance(on_commit, (list, tuple)) else [on_commit]
+                    for callback in callbacks:
+                        if callback is None:
+                            continue
+                        committed = callback(result)
+                        if inspect.isawaitable(committed):
+                            await committed
+                except Exception as e:
+                    logger.error(f"Graph write failed in {getattr(write_fn, '__name__', write_fn)}: {str(e)}")
+                    self._error = e
+            finally:
+                self._queue.task_done()
@@ -0,0 +1,172 @@
+"""Checkpoint degli import per riprendere dopo un errore
+
+Un import è diviso in stadi con una chiave stabile (per time range, per
+batch di idratazione, per pagina). Uno stadio viene segnato completato solo
+dopo il commit delle sue scritture; alla ripresa gli stadi completati non
+vengono né riscaricati né riscritti. Il checkpoint è cancellato quando
+l'import termina con successo e ignorato dopo IMPORT_CHECKPOINT_TTL_SECONDS.
+"""
+from typing import Iterable, Set
+import hashlib
+import logging
+
+from app.core.config import settings
+from app.core.redis import get_redis
+from app.database.connection import async_neo4j_db
+
+logger = logging.getLogger(__name__)
+
+
+def batch_stage(prefix: str, entity_ids: Iterable[str]) -> str:
+    """Chiave di stadio stabile per un batch, derivata dagli ID che contiene"""
+    digest = hashlib.sha1(",".join(sorted(entity_ids)).encode()).hexdigest()[:16]
+    return f"{prefix}:{digest}"
+
+
+class GraphCheckpointStore:
+    """Checkpoint salvati su un nodo :ImportCheckpoint nel grafo"""
+
+    def __init__(self, db=async_neo4j_db):
+        self.db = db
+
+    async def load(self, spotify_user_id: str) -> Set[str]:
+        result = await self.db.execute_query(
+            """
+            MATCH (c:ImportCheckpoint {spotify_user_id: $spotify_user_id})
+            WHERE c.aggiornato_il > datetime() - duration({seconds: $ttl})
+            RETURN c.stadi_completati as stages
+            """,
+            {"spotify_user_id": spotify_user_id, "ttl": settings.IMPORT_CHECKPOINT_TTL_SECONDS}
+        )
+        return set(result[0]["stages"] or []) if result else set()
+
+    async def add(self, spotify_user_id: str, stage: str):
+        await self.db.execute_write_query(
+            """
+            MERGE (c:ImportCheckpoint {spotify_user_id: $spotify_user_id})
+            SET c.stadi_completati = CASE
+                    WHEN $stage IN coalesce(c.stadi_completati, []) THEN c.stadi_completati
+                    ELSE coalesce(c.stadi_completati, []) + $stage
+                END,
+                c.aggiornato_il = datetime()
+            """,
+            {"spotify_user_id": spotify_user_id, "stage": stage}
+        )
+
+    async def clear(self, spotify_user_id: str):
+        await self.db.execute_write_query(
+            "MATCH (c:ImportCheckpoint {spotify_user_id: $spotify_user_id}) DELETE c",
+            {"spotify_user_id": spotify_user_id}
+        )
+
+
+class RedisCheckpointStore:
+    """Checkpoint salvati in un set Redis con scadenza"""
+
+    @staticmethod
+    def _key(spotify_user_id: str) -> str:
+        return f"import:checkpoint:{spotify_user_id}"
+
+    def _redis(self):
+        redis = get_redis()
+        if redis is None:
+            raise RuntimeError("Redis is required for the redis checkpoint backend")
+        return redis
+
+    async def load(self, spotify_user_id: str) -> Set[str]:
+        return set(await self._redis().smembers(self._key(spotify_user_id)))
+
+    async def add(self, spotify_user_id: str, stage: str):
+        redis = self._redis()
+        key = self._key(spotify_user_id)
+        await redis.sadd(key, stage)
+        await redis.expire(key, settings.IMPORT_CHECKPOINT_TTL_SECONDS)
+
+    async def clear(self, spotify_user_id: str):
+        await self._redis().delete(self._key(spotify_user_id))
+
+
+class NullCheckpointStore:
+    """Store che non salva nulla, per sincronizzazioni senza ripresa"""
+
+    async def load(self, spotify_user_id: str) -> Set[str]:
+        return set()
+
+    async def add(self, spotify_user_id: str, stage: str):
+        pass
+
+    async def clear(self, spotify_user_id: str):
+        pass
+
+
+def get_checkpoint_store():
+    """Store di checkpoint configurato (IMPORT_CHECKPOINT_BACKEND)"""
+    if settings.IMPORT_CHECKPOINT_BACKEND == "redis":
+        return RedisCheckpointStore()
+    return GraphCheckpointStore()
+
+
+class ImportCheckpoint:
+    """Stadi completati dell'import di un utente"""
+
+    def __init__(self, store, spotify_user_id: str, completed: Set[str]):
+        self.store = store
+        self.spotify_user_id = spotify_user_id
+        self.completed = completed
+        self.resumed_stages = len(completed)
+        self.skipped = 0
+
+    @classmethod
+    async def load(cls, spotify_user_id: str, store=None) -> "ImportCheckpoint":
+        """Carica il checkpoint dell'utente; uno scaduto viene scartato"""
+        store = store or get_checkpoint_store()
+        completed = await store.load(spotify_user_id)
+        if completed:
+            logger.info(f"⏯️ Resuming import for {spotify_user_id}: {len(completed)} stages already committed")
+        else:
+            # Rimuove eventuali checkpoint scaduti prima di ripartire
+            await store.clear(spotify_user_id)
+        return cls(store, spotify_user_id, completed)
+
+    @classmethod
+    def disabled(cls, spotify_user_id: str) -> "ImportCheckpoint":
+        """Checkpoint vuoto che non persiste gli stadi"""
+        return cls(NullCheckpointStore(), spotify_user_id, set())
+
+    def is_done(self, stage: str) -> bool:
+        """True se lo stadio è già stato completato in un'esecuzione precedente"""
+        if stage in self.completed:
+            self.skipped += 1
+            return True
+        return False
+
+    def resume_offset(self, prefix: str, page_size: int) -> int:
+        """Offset da cui riprendere una paginazione con stadi "<prefix>:<offset>"
+
+        Le pagine vengono scritte in ordine, quindi quelle completate sono un
+        prefisso e si riparte dalla pagina successiva all'ultima.
+        """
+        offsets = [
+            int(stage.rsplit(":", 1)[1]) for stage in self.completed
+            if stage.startswith(f"{prefix}:") and stage.rsplit(":", 1)[1].isdigit()
+        ]
+        if not offsets:
+            return 0
+        self.skipped += len(offsets)
+        return max(offsets) + page_size
+
+    async def mark_done(self, stage: str):
+        """Segna lo stadio come completato (da chiamare dopo il commit)"""
+        self.completed.add(stage)
+        await self.store.add(self.spotify_user_id, stage)
+
+    def committer(self, stage: str):
+        """Callback on_commit per GraphWriter che segna lo stadio"""
+        async def on_commit(_result):
+            await self.mark_done(stage)
+        return on_commit
+
+    async def clear(self):
+        """Cancella il checkpoint a import concluso"""
+        self.completed.clear()
+        await self.store.clear(self.spotify_user_id)
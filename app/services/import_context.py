@@ -0,0 +1,105 @@
+from typing import Dict, Any, Optional, Set
+
+
+ENTITY_KINDS = ("artists", "albums", "tracks", "genres")
+
+
+class ImportContext:
+    """Identity map con scope di un singolo import
+
+    Tiene traccia di artisti, album, tracce e generi già visti durante
+    l'import, in modo che ogni entità venga recuperata da Spotify e scritta
+    su Neo4j al massimo una volta per esecuzione.
+    """
+
+    def __init__(self):
+        self.artists: Dict[str, Dict[str, Any]] = {}
+        self.albums: Dict[str, Dict[str, Any]] = {}
+        self.tracks: Dict[str, Dict[str, Any]] = {}
+        self.genres: Set[str] = set()
+
+        # Artisti non riscaricati perché già freschi nel grafo
+        self.fresh_in_graph = 0
+
+        self._written: Dict[str, Set[str]] = {kind: set() for kind in ENTITY_KINDS}
+        self._totals: Dict[str, int] = {kind: 0 for kind in ENTITY_KINDS}
+
+    @staticmethod
+    def _is_full_artist(artist_data: Dict) -> bool:
+        """Un artista semplificato (da traccia/album) non ha generi né followers"""
+        return "genres" in artist_data and "followers" in artist_data
+
+    def add_artist(self, artist_data: Dict) -> bool:
+        """Registra un artista, ritorna True se non era ancora noto in forma completa"""
+        self._totals["artists"] += 1
+        artist_id = artist_data["id"]
+        known = self.artists.get(artist_id)
+        if known is not None and (self._is_full_artist(known) or not self._is_full_artist(artist_data)):
+            return False
+
+        self.artists[artist_id] = artist_data
+        for genre in artist_data.get("genres", []):
+            self.add_genre(genre)
+        return self._is_full_artist(artist_data)
+
+    def add_album(self, album_data: Dict) -> bool:
+        """Registra un album, ritorna True se è la prima occorrenza"""
+        self._totals["albums"] += 1
+        album_id = album_data["id"]
+        known = self.albums.get(album_id)
+        # I dettagli completi (con label/tracce) sostituiscono l'album semplificato
+        if known is not None and ("label" in known or "label" not in album_data):
+            return False
+
+        self.albums[album_id] = album_data
+        return known is None
+
+    def add_track(self, track_data: Dict) -> bool:
+        """Registra una traccia, ritorna True se è la prima occorrenza"""
+        self._totals["tracks"] += 1
+        if track_data["id"] in self.tracks:
+            return False
+        self.tracks[track_data["id"]] = track_data
+        return True
+
+    def add_genre(self, genre: str) -> bool:
+        """Registra un genere, ritorna True se è la prima occorrenza"""
+        self._totals["genres"] += 1
+        if genre in self.genres:
+            return False
+        self.genres.add(genre)
+        return True
+
+    def get_artist(self, artist_id: str) -> Optional[Dict[str, Any]]:
+        """Ritorna l'artista completo se già noto"""
+        artist = self.artists.get(artist_id)
+        return artist if artist is not None and self._is_full_artist(artist) else None
+
+    def missing_artist_ids(self, artist_ids) -> list:
+        """Filtra gli ID artista di cui non si hanno ancora i dettagli completi"""
+        return [artist_id for artist_id in dict.fromkeys(artist_ids) if self.get_artist(artist_id) is None]
+
+    def mark_written(self, kind: str, entity_id: str) -> bool:
+        """Segna un'entità come scritta, ritorna False se era già stata scritta"""
+        written = self._written[kind]
+        if entity_id in written:
+            return False
+        written.add(entity_id)
+        return True
+
+    def stats(self) -> Dict[str, Dict[str, int]]:
+        """Statistiche per tipo di entità: occorrenze totali, uniche e scritte"""
+        unique = {
+            "artists": len(self.artists),
+            "albums": len(self.albums),
+            "tracks": len(self.tracks),
+            "genres": len(self.genres),
+        }
+        return {
+            kind: {
+                "total": self._totals[kind],
+                "unique": unique[kind],
+                "written": len(self._written[kind]),
+            }
+            for kind in ENTITY_KINDS
+        }
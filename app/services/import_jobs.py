@@ -0,0 +1,254 @@
+"""Job di import: deduplica per utente, admission control e progresso
+
+Due backend:
+- "inprocess": task asyncio nello stesso processo, con store in memoria
+  (adatto a sviluppo e test);
+- "celery": task Celery su Redis (acks_late, quindi un riavvio del worker
+  non perde il job) con stato e lock condivisi su Redis.
+
+In entrambi i casi un solo import per utente è attivo alla volta: le
+richieste duplicate ricevono il job già in corso. Con il backend celery nel
+broker passano solo job_id e utente: il worker legge i token dallo store di
+autenticazione, che deve quindi essere condiviso (AUTH_STORE_BACKEND=redis).
+"""
+from typing import Dict, Any, Optional, Tuple
+from datetime import datetime
+import asyncio
+import json
+import logging
+import uuid
+
+from app.auth.token_manager import token_manager
+from app.core.cache import TTLCache
+from app.core.config import settings
+from app.core.redis import get_redis
+from app.external.spotify_client import AccessToken
+
+logger = logging.getLogger(__name__)
+
+ACTIVE_STATUSES = ("queued", "running")
+
+
+def _now() -> str:
+    return datetime.utcnow().isoformat()
+
+
+def new_job(spotify_user_id: str, options: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    """Crea il record di un nuovo job di import"""
+    return {
+        "job_id": uuid.uuid4().hex,
+        "spotify_user_id": spotify_user_id,
+        "options": options or {},
+        "status": "queued",
+        "stage": None,
+        "stages": {},
+        "results": None,
+        "error": None,
+        "created_at": _now(),
+        "updated_at": _now(),
+    }
+
+
+class MemoryImportJobStore:
+    """Store in-process dello stato dei job (un solo processo)"""
+
+    def __init__(self):
+        self._jobs = TTLCache(10000, settings.IMPORT_JOB_TTL_SECONDS)
+        self._active: Dict[str, str] = {}
+
+    async def claim(self, job: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """Registra il job come attivo; se l'utente ne ha già uno ritorna quello"""
+        user_id = job["spotify_user_id"]
+        active_id = self._active.get(user_id)
+        if active_id is not None:
+            existing = await self.get(user_id)
+            if existing is not None and existing["job_id"] == active_id:
+                return existing
+        self._active[user_id] = job["job_id"]
+        await self.save(job)
+        return None
+
+    async def release(self, job: Dict[str, Any]):
+        """Libera lo slot attivo dell'utente"""
+        if self._active.get(job["spotify_user_id"]) == job["job_id"]:
+            del self._active[job["spotify_user_id"]]
+
+    async def save(self, job: Dict[str, Any]):
+        self._jobs.set(job["spotify_user_id"], job)
+
+    async def get(self, spotify_user_id: str) -> Optional[Dict[str, Any]]:
+        return self._jobs.get(spotify_user_id)
+
+
+class RedisImportJobStore:
+    """Store su Redis dello stato dei job, condiviso tra processi e worker"""
+
+    def __init__(self):
+        self.job_ttl = settings.IMPORT_JOB_TTL_SECONDS
+        self.lock_ttl = settings.IMPORT_JOB_LOCK_TTL_SECONDS
+
+    @staticmethod
+    def _job_key(spotify_user_id: str) -> str:
+        return f"import:job:{spotify_user_id}"
+
+    @staticmethod
+    def _active_key(spotify_user_id: str) -> str:
+        return f"import:active:{spotify_user_id}"
+
+    def _redis(self):
+        redis = get_redis()
+        if redis is None:
+            raise RuntimeError("Redis is required for the celery import job backend")
+        return redis
+
+    async def claim(self, job: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """Registra il job come attivo (SET NX); se l'utente ne ha già uno ritorna quello"""
+        redis = self._redis()
+        user_id = job["spotify_user_id"]
+        claimed = await redis.set(self._active_key(user_id), job["job_id"], nx=True, ex=self.lock_ttl)
+        if not claimed:
+            existing = await self.get(user_id)
+            if existing is not None and existing["status"] in ACTIVE_STATUSES:
+                return existing
+            # Lock orfano (job terminato senza rilascio): lo si riprende
+            await redis.set(self._active_key(user_id), job["job_id"], ex=self.lock_ttl)
+        await self.save(job)
+        return None
+
+    async def release(self, job: Dict[str, Any]):
+        redis = self._redis()
+        key = self._active_key(job["spotify_user_id"])
+        if await redis.get(key) == job["job_id"]:
+            await redis.delete(key)
+
+    async def save(self, job: Dict[str, Any]):
+        await self._redis().set(self._job_key(job["spotify_user_id"]), json.dumps(job, default=str), ex=self.job_ttl)
+
+    async def get(self, spotify_user_id: str) -> Optional[Dict[str, Any]]:
+        raw = await self._redis().get(self._job_key(spotify_user_id))
+        return json.loads(raw) if raw else None
+
+
+class ImportJobManager:
+    """Accoda, deduplica ed esegue gli import con concorrenza globale limitata"""
+
+    def __init__(self, backend: str = None):
+        self.backend = backend or settings.IMPORT_JOB_BACKEND
+        if self.backend == "celery" and settings.AUTH_STORE_BACKEND != "redis":
+            raise RuntimeError(
+                "IMPORT_JOB_BACKEND=celery requires AUTH_STORE_BACKEND=redis: "
+                "workers read the user's Spotify tokens from the shared auth store"
+            )
+        self.store = RedisImportJobStore() if self.backend == "celery" else MemoryImportJobStore()
+        self._slots: Optional[asyncio.Semaphore] = None
+        self._tasks: Dict[str, asyncio.Task] = {}
+
+    def _get_slots(self) -> asyncio.Semaphore:
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(max(1, settings.IMPORT_MAX_CONCURRENT_JOBS))
+        return self._slots
+
+    async def submit(self,
+                     spotify_user_id: str,
+                     access_token: str,
+                     **options: Any) -> Tuple[Dict[str, Any], bool]:
+        """Avvia un import; ritorna (job, creato) con creato=False se ne era già attivo uno
+
+        Le opzioni (ad es. include_library, include_playlists, include_recent) vengono passate a import_user_data.
+        """
+        job = new_job(spotify_user_id, options)
+        existing = await self.store.claim(job)
+        if existing is not None:
+            logger.info(f"🔁 Import already {existing['status']} for {spotify_user_id}, coalescing")
+            return existing, False
+
+        if self.backend == "celery":
+            from app.worker import import_user_data_task
+            # Il token non passa dal broker: potrebbe essere scaduto alla riconsegna
+            import_user_data_task.delay(job["job_id"], spotify_user_id)
+        else:
+            task = asyncio.create_task(self._run_in_process(job, access_token))
+            self._tasks[job["job_id"]] = task
+            task.add_done_callback(lambda _: self._tasks.pop(job["job_id"], None))
+
+        return job, True
+
+    async def run_now(self,
+                      spotify_user_id: str,
+                      access_token: AccessToken,
+                      **options: Any) -> Optional[Dict[str, Any]]:
+        """Esegue un import nel task corrente attendendone la fine
+
+        L'import occupa uno degli slot di admission control, come quelli
+        avviati con submit() nel backend inprocess; con il backend celery gli
+        slot limitano gli import del worker di re-sync. Ritorna None se
+        per l'utente è già attivo un altro import.
+        """
+        job = new_job(spotify_user_id, options)
+        if await self.store.claim(job) is not None:
+            return None
+        return await self._run_in_process(job, access_token)
+
+    async def _run_in_process(self, job: Dict[str, Any], access_token: AccessToken) -> Dict[str, Any]:
+        # Admission control: al massimo IMPORT_MAX_CONCURRENT_JOBS import in parallelo
+        async with self._get_slots():
+            return await self.run_job(job, access_token)
+
+    async def run_job(self, job: Dict[str, Any], access_token: Optional[AccessToken] = None) -> Dict[str, Any]:
+        """Esegue l'import aggiornando stato e progresso per stadio
+
+        L'import riceve un token provider che rinnova il token durante
+        l'esecuzione; un access_token stringa resta il fallback se il
+        processo non ha i token dell'utente, un provider viene usato così com'è.
+        Un job interrotto (ad es. cancellato allo shutdown) viene salvato come
+        "cancelled" prima di propagare l'interruzione.
+        """
+        from app.services.spotify_service import spotify_ingestion_service
+
+        async def progress(stage: str, info: Optional[Dict[str, Any]] = None):
+            job["stage"] = stage
+            job["stages"][stage] = dict(info or {}, updated_at=_now())
+            job["updated_at"] = _now()
+            await self.store.save(job)
+
+        job["status"] = "running"
+        job["started_at"] = _now()
+        await self.store.save(job)
+        try:
+            job["results"] = await spotify_ingestion_service.import_user_data(
+                job["spotify_user_id"],
+                access_token if callable(access_token)
+                else token_manager.provider_for(job["spotify_user_id"], access_token),
+                progress=progress,
+                **job.get("options", {})
+            )
+            job["status"] = "completed"
+        except Exception as e:
+            job["status"] = "failed"
+            job["error"] = str(e)
+            logger.error(f"❌ Import job {job['job_id']} failed for {job['spotify_user_id']}: {str(e)}")
+        except BaseException:
+            # Altrimenti il job resterebbe "running" fino alla scadenza del record
+            job["status"] = "cancelled"
+            job["error"] = "Import interrupted"
+            logger.warning(f"⏹️ Import job {job['job_id']} cancelled for {job['spotify_user_id']}")
+            raise
+        finally:
+            job["finished_at"] = _now()
+            job["updated_at"] = _now()
+            await self.store.save(job)
+            await self.store.release(job)
+        return job
+
+    async def get_status(self, spotify_user_id: str) -> Optional[Dict[str, Any]]:
+        """Ritorna l'ultimo job dell'utente con il suo progresso"""
+        return await self.store.get(spotify_user_id)
+
+    async def get_job(self, spotify_user_id: str, job_id: str) -> Optional[Dict[str, Any]]:
+        """Ritorna il job solo se è ancora l'ultimo dell'utente"""
+        job = await self.store.get(spotify_user_id)
+        return job if job is not None and job["job_id"] == job_id else None
+
+
+# Istanza globale del gestore dei job
+import_job_manager = ImportJobManager()
@@ -0,0 +1,231 @@
+"""Re-sync periodico di tutti gli utenti del grafo
+
+A ogni ciclo lo scheduler seleziona i nodi :Utente la cui sincronizzazione
+è più vecchia dell'intervallo target (più breve per gli utenti attivi, cioè
+con un accesso recente) e li sincronizza in ordine di ritardo relativo.
+Le sincronizzazioni girano con concorrenza limitata e si fermano quando il
+budget di richieste Spotify del ciclo è esaurito; il resto passa al ciclo
+successivo. Il budget conta solo le richieste delle sync del ciclo, non il
+traffico API degli altri utenti. Clock, sleep, db, token, funzione di sync
+e lock di leader sono iniettabili.
+
+Con più processi (IMPORT_JOB_BACKEND=celery o WEB_CONCURRENCY > 1) ogni
+ciclo prende prima un lock di leader su Redis, così in ogni intervallo un
+solo processo esegue il ciclo e il budget resta globale. Con celery lo
+scheduler non gira nel processo API: i cicli sono task di celery beat
+eseguiti dal worker dedicato della coda "resync" (vedi app.worker).
+"""
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+import asyncio
+import logging
+import socket
+import time
+
+from app.auth.token_manager import token_manager, TokenNotFoundError, TokenRefreshError
+from app.core.config import settings
+from app.core.redis import get_redis
+from app.database.connection import async_neo4j_db
+from app.external.spotify_client import AccessToken
+
+logger = logging.getLogger(__name__)
+
+TokenProvider = Callable[[str], Awaitable[Optional[str]]]
+SyncFn = Callable[[str, AccessToken], Awaitable[Optional[Dict[str, Any]]]]
+LeaderLock = Callable[[], Awaitable[bool]]
+
+LEADER_LOCK_KEY = "resync:leader"
+
+
+async def _default_token_provider(spotify_user_id: str) -> Optional[str]:
+    """Token Spotify valido dell'utente, None se non disponibile"""
+    try:
+        return await token_manager.get_access_token(spotify_user_id)
+    except (TokenNotFoundError, TokenRefreshError):
+        return None
+
+
+async def _default_sync(spotify_user_id: str, access_token: AccessToken) -> Optional[Dict[str, Any]]:
+    """Import incrementale tramite il gestore dei job (deduplicato per utente e
+    negli stessi slot di IMPORT_MAX_CONCURRENT_JOBS degli import degli utenti)"""
+    from app.services.import_jobs import import_job_manager
+
+    return await import_job_manager.run_now(
+        spotify_user_id, access_token, include_playlists=True, include_recent=True
+    )
+
+
+async def _default_leader_lock() -> bool:
+    """True se questo processo esegue il ciclo corrente
+
+    Con un solo processo non serve coordinamento. Altrimenti il lock (SET NX)
+    scade poco prima del ciclo successivo e non viene rilasciato a fine
+    ciclo: gli altri processi saltano l'intervallo. Senza Redis il ciclo
+    viene saltato, perché ogni processo ne eseguirebbe uno con il proprio budget.
+    """
+    if settings.IMPORT_JOB_BACKEND != "celery" and settings.WEB_CONCURRENCY <= 1:
+        return True
+    redis = get_redis()
+    if redis is None:
+        logger.warning("Resync cycle skipped: Redis is required to elect a leader across processes")
+        return False
+    # Margine per il ritardo di sleep e beat tra un ciclo e il successivo
+    ttl = max(1, int(settings.RESYNC_CYCLE_SECONDS * 0.9))
+    try:
+        return bool(await redis.set(LEADER_LOCK_KEY, socket.gethostname(), nx=True, ex=ttl))
+    except Exception as e:
+        logger.warning(f"Resync cycle skipped: leader lock failed: {str(e)}")
+        return False
+
+
+class ResyncScheduler:
+    """Scheduler dei re-sync in background, per ritardo di sincronizzazione"""
+
+    def __init__(self,
+                 db=async_neo4j_db,
+                 sync_fn: Optional[SyncFn] = None,
+                 token_provider: Optional[TokenProvider] = None,
+                 clock: Callable[[], float] = time.time,
+                 sleep: Callable[[float], Any] = asyncio.sleep,
+                 leader_lock: Optional[LeaderLock] = None):
+        self.db = db
+        self.sync_fn = sync_fn or _default_sync
+        self.token_provider = token_provider or _default_token_provider
+        self.leader_lock = leader_lock or _default_leader_lock
+        self._clock = clock
+        self._sleep = sleep
+        self._task: Optional[asyncio.Task] = None
+
+        # Statistiche
+        self.cycles = 0
+        self.cycles_skipped = 0
+        self.last_cycle: Optional[Dict[str, Any]] = None
+
+    async def find_due_users(self) -> List[Dict[str, Any]]:
+        """Utenti da sincronizzare, dal più in ritardo rispetto al proprio intervallo"""
+        return await self.db.execute_query(
+            """
+            MATCH (u:Utente)
+            WITH u,
+                 CASE WHEN u.ultimo_accesso IS NOT NULL
+                           AND u.ultimo_accesso.epochSeconds >= $now - $active_window
+                      THEN $active_interval ELSE $inactive_interval END as intervallo
+            WITH u, intervallo,
+                 CASE WHEN u.ultima_sincronizzazione IS NULL THEN null
+                      ELSE $now - u.ultima_sincronizzazione.epochSeconds END as ritardo
+            WHERE ritardo IS NULL OR ritardo >= intervallo
+            RETURN u.spotify_user_id as spotify_user_id, ritardo, intervallo
+            ORDER BY coalesce(toFloat(ritardo) / intervallo, 1e9) DESC
+            LIMIT $limit
+            """,
+            {
+                "now": int(self._clock()),
+                "active_window": settings.RESYNC_ACTIVE_WINDOW_SECONDS,
+                "active_interval": settings.RESYNC_ACTIVE_INTERVAL_SECONDS,
+                "inactive_interval": settings.RESYNC_INACTIVE_INTERVAL_SECONDS,
+                "limit": settings.RESYNC_BATCH_SIZE,
+            }
+        )
+
+    async def run_cycle(self) -> Dict[str, Any]:
+        """Esegue un ciclo di re-sync entro budget e limite di concorrenza
+
+        Un nuovo utente parte solo quando si libera uno slot e il budget non
+        è esaurito; lo sforamento massimo è quindi limitato alle sync in volo.
+        Ogni sync riceve un token provider che conta le richieste: il client
+        lo risolve a ogni tentativo HTTP, quindi il conteggio corrisponde alle
+        richieste inviate a Spotify per conto del ciclo. Se un altro processo
+        ha il lock di leader il ciclo viene saltato.
+        """
+        if not await self.leader_lock():
+            self.cycles_skipped += 1
+            return {"leader": False}
+
+        users = await self.find_due_users()
+        budget = settings.RESYNC_REQUEST_BUDGET_PER_CYCLE
+        slots = asyncio.Semaphore(max(1, settings.RESYNC_MAX_CONCURRENCY))
+        stats = {
+            "leader": True,
+            "due": len(users),
+            "synced": 0,
+            "failed": 0,
+            "skipped": 0,
+            "budget_exhausted": False,
+            "requests_used": 0,
+        }
+
+        async def sync_user(spotify_user_id: str):
+            try:
+                access_token = await self.token_provider(spotify_user_id)
+                if access_token is None:
+                    stats["skipped"] += 1
+                    return
+
+                async def counted_token() -> str:
+                    stats["requests_used"] += 1
+                    return await self.token_provider(spotify_user_id) or access_token
+
+                job = await self.sync_fn(spotify_user_id, counted_token)
+                # None: import già in corso per l'utente
+                if job is None:
+                    stats["skipped"] += 1
+                elif job.get("status") == "failed":
+                    stats["failed"] += 1
+                else:
+                    stats["synced"] += 1
+            except Exception as e:
+                stats["failed"] += 1
+                logger.error(f"Resync failed for {spotify_user_id}: {str(e)}")
+            finally:
+                slots.release()
+
+        tasks = []
+        for user in users:
+            await slots.acquire()
+            if stats["requests_used"] >= budget:
+                slots.release()
+                stats["budget_exhausted"] = True
+                break
+            tasks.append(asyncio.create_task(sync_user(user["spotify_user_id"])))
+        await asyncio.gather(*tasks)
+
+        self.cycles += 1
+        self.last_cycle = stats
+        logger.info(f"🔁 Resync cycle completed: {stats}")
+        return stats
+
+    def start(self):
+        """Avvia il loop periodico"""
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Ferma il loop e attende la cancellazione"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self):
+        while True:
+            try:
+                await self.run_cycle()
+            except Exception as e:
+                # Un ciclo fallito (ad es. Neo4j non raggiungibile) non ferma lo scheduler
+                logger.error(f"Resync cycle failed: {str(e)}")
+            await self._sleep(settings.RESYNC_CYCLE_SECONDS)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Statistiche dello scheduler"""
+        return {
+            "running": self._task is not None,
+            "cycles": self.cycles,
+            "cycles_skipped": self.cycles_skipped,
+            "last_cycle": self.last_cycle,
+        }
+
+
+# Istanza globale dello scheduler
+resync_scheduler = ResyncScheduler()
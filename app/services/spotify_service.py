@@ -1,23 +1,82 @@
-from typing import Dict, List, Any, Optional
-from datetime import datetime
+from typing import Dict, List, Any, Optional, Callable, Awaitable
+from datetime import datetime, timezone
+import asyncio
+import hashlib
+import json
 import logging
 
-from app.database.connection import neo4j_db
-from app.external.spotify_client import spotify_client
+from app.core.config import settings
+from app.core.response_cache import response_cache
+from app.core.singleflight import SingleFlight
+from app.database.connection import async_neo4j_db
+from app.external.spotify_client import AccessToken, spotify_client
 from app.models.music import Artist, Album, Track
+from app.services.graph_writer import GraphWriter
+from app.services.import_checkpoint import ImportCheckpoint, batch_stage
+from app.services.import_context import ImportContext
 
 logger = logging.getLogger(__name__)
 
+TIME_RANGES = ["short_term", "medium_term", "long_term"]
+LIBRARY_PAGE_SIZE = 50  # Massimo consentito da /me/tracks e /me/albums
+# Contatori aggiornati di continuo da Spotify, esclusi dall'hash del contenuto
+VOLATILE_FIELDS = ("followers", "popolarita")
+
+# Callback di progresso: (stadio, info) -> awaitable
+ProgressCallback = Callable[[str, Dict[str, Any]], Awaitable[None]]
+
+async def _gather_or_cancel(*aws: Awaitable[Any]) -> List[Any]:
+    """Come asyncio.gather, ma al primo errore cancella e attende gli altri task
+    
+    Senza cancellazione i task fratelli continuerebbero a chiamare Spotify e
+    resterebbero bloccati su writer.submit() dopo la chiusura del writer.
+    """
+    tasks = [asyncio.ensure_future(aw) for aw in aws]
+    try:
+        return await asyncio.gather(*tasks)
+    except BaseException:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        raise
+
 class SpotifyIngestionService:
     """Servizio per l'ingestion dei dati Spotify nel knowledge graph"""
     
     def __init__(self):
-        self.db = neo4j_db
+        self.db = async_neo4j_db
+        # Polling concorrenti degli ascolti recenti dello stesso utente
+        self._recent_single_flight = SingleFlight()
     
-    async def import_user_data(self, spotify_user_id: str, access_token: str) -> Dict[str, Any]:
-        """Importa i dati dell'utente da Spotify nel knowledge graph"""
+    async def import_user_data(self,
+                               spotify_user_id: str,
+                               access_token: AccessToken,
+                               progress: Optional[ProgressCallback] = None,
+                               include_library: bool = False,
+                               include_playlists: bool = False,
+                               include_recent: bool = False) -> Dict[str, Any]:
+        """Importa i dati dell'utente da Spotify nel knowledge graph
+        
+        L'import è una pipeline a stadi: i sei fetch dei top items girano in
+        parallelo, l'idratazione del catalogo procede a concorrenza limitata
+        (IMPORT_CONCURRENCY) e un writer dedicato svuota su Neo4j una coda
+        limitata di scritture batch. Se passato, progress viene chiamato
+        all'inizio di ogni stadio. Con include_library viene importata anche
+        la libreria salvata (brani e album), pagina per pagina; con
+        include_playlists le playlist modificate dall'ultima sincronizzazione;
+        con include_recent gli ascolti recenti successivi all'ultimo cursore.
+        
+        access_token può essere un token provider: viene risolto a ogni
+        richiesta, così gli import lunghi usano sempre un token valido.
+        """
+        async def report(stage: str, **info):
+            if progress is not None:
+                await progress(stage, info)
+        
         try:
             logger.info(f"🔄 Starting import_user_data for {spotify_user_id}")
+            context = ImportContext()
+            limiter = asyncio.Semaphore(max(1, settings.IMPORT_CONCURRENCY))
             results = {
                 "user_created": False,
                 "artists_imported": 0,
@@ -27,58 +86,159 @@ class SpotifyIngestionService:
             }
             
             # 1. Crea o aggiorna nodo Utente
+            await report("profile")
             logger.info(f"👤 Getting user profile for {spotify_user_id}")
             user_profile = await spotify_client.get_user_profile(access_token)
             logger.info(f"👤 Creating/updating user node for {spotify_user_id}")
-            results["user_created"] = self._create_or_update_user(spotify_user_id, user_profile)
+            results["user_created"] = await self._create_or_update_user(spotify_user_id, user_profile)
             logger.info(f"👤 User created/updated: {results['user_created']}")
             
-            # 2. Importa top artists (short, medium, long term)
-            logger.info(f"🎵 Starting artists import for {spotify_user_id}")
-            for time_range in ["short_term", "medium_term", "long_term"]:
-                logger.info(f"🎵 Getting top artists for {time_range}")
-                top_artists = await spotify_client.get_user_top_artists(
-                    access_token, time_range=time_range, limit=50
-                )
-                artist_count = len(top_artists.get("items", []))
-                logger.info(f"🎵 Found {artist_count} artists for {time_range}")
-                for artist_data in top_artists.get("items", []):
-                    self._create_or_update_artist(artist_data)
-                    results["artists_imported"] += 1
-            logger.info(f"🎵 Total artists imported: {results['artists_imported']}")
+            # 2. Scarica in parallelo top artists e top tracks (short, medium, long term)
+            await report("top_items")
+            logger.info(f"🎵 Fetching top artists and tracks for {spotify_user_id}")
+            top_artists_by_range, tracks_by_range = await self._fetch_top_items(access_token, limiter)
+            
+            for time_range, items in top_artists_by_range.items():
+                logger.info(f"🎵 Found {len(items)} artists for {time_range}")
+                for artist_data in items:
+                    context.add_artist(artist_data)
+            
+            for time_range, items in tracks_by_range.items():
+                logger.info(f"🎵 Found {len(items)} tracks for {time_range}")
+                for track_data in items:
+                    self._register_track(context, track_data)
+            
+            def count(key: str):
+                def on_commit(written: int):
+                    results[key] += written
+                return on_commit
+            
+            # Scritture evitate perché il contenuto non è cambiato (delta sync)
+            results["writes_skipped"] = {"artists": 0, "albums": 0, "tracks": 0}
+            
+            def count_skipped(kind: str):
+                def on_commit(stats: Dict[str, int]):
+                    results["writes_skipped"][kind] += stats["skipped"]
+                return on_commit
+            
+            # Stadi già completati da un'esecuzione precedente interrotta
+            checkpoint = await ImportCheckpoint.load(spotify_user_id)
             
-            # 3. Importa top tracks (short, medium, long term)
-            logger.info(f"🎵 Starting tracks import for {spotify_user_id}")
-            for time_range in ["short_term", "medium_term", "long_term"]:
-                logger.info(f"🎵 Getting top tracks for {time_range}")
-                top_tracks = await spotify_client.get_user_top_tracks(
-                    access_token, time_range=time_range, limit=50
+            await report(
+                "hydration",
+                artists=len(context.artists),
+                albums=len(context.albums),
+                tracks=len(context.tracks),
+                resumed_stages=checkpoint.resumed_stages
+            )
+            async with GraphWriter(settings.IMPORT_WRITE_QUEUE_SIZE) as writer:
+                # 3. Scrivi subito gli artisti già completi (top artists), per time range
+                for time_range, items in top_artists_by_range.items():
+                    stage = f"top_artists:{time_range}"
+                    if checkpoint.is_done(stage):
+                        continue
+                    await self._submit_artists(
+                        context, writer, [a["id"] for a in items],
+                        on_commit=count_skipped("artists")
+                    )
+                    # Classifica degli artisti per range, già pronta per le letture top-N
+                    top_artists = [
+                        {"artist_id": artist_data["id"], "rank": rank}
+                        for rank, artist_data in enumerate(items, start=1)
+                    ]
+                    await writer.submit(
+                        self._create_user_top_artists_batch, spotify_user_id, time_range, top_artists,
+                        on_commit=checkpoint.committer(stage)
+                    )
+                
+                # 4. Idrata gli artisti mancanti; ogni batch viene accodato al
+                #    writer appena arriva
+                await self._hydrate_catalog(
+                    context, access_token, limiter, writer, checkpoint,
+                    on_artists_commit=count_skipped("artists")
                 )
-                track_count = len(top_tracks.get("items", []))
-                logger.info(f"🎵 Found {track_count} tracks for {time_range}")
                 
-                for track_data in top_tracks.get("items", []):
-                    # Importa track, album e artisti
-                    track_result = await self._import_track_with_relations(track_data, access_token)
-                    results["tracks_imported"] += track_result["tracks"]
-                    results["albums_imported"] += track_result["albums"]
-                    results["artists_imported"] += track_result["artists"]
+                # Album dai dati dei brani, dopo gli artisti (l'album si collega con MATCH).
+                # Lo stadio dipende dagli album: se i top brani cambiano tra un
+                # tentativo e la ripresa, gli album nuovi vengono scritti comunque
+                albums_stage = batch_stage("albums", context.albums.keys())
+                if not checkpoint.is_done(albums_stage):
+                    albums_to_write = [
+                        album_data for album_id, album_data in context.albums.items()
+                        if context.mark_written("albums", album_id)
+                    ]
+                    await writer.submit(
+                        self._create_or_update_albums_batch, albums_to_write,
+                        on_commit=[count_skipped("albums"), checkpoint.committer(albums_stage)]
+                    )
+                
+                # 5. Brani e relazioni ASCOLTA {time_range, rank} per time range
+                await report("writing")
+                for time_range, items in tracks_by_range.items():
+                    stage = f"tracks:{time_range}"
+                    if checkpoint.is_done(stage):
+                        continue
                     
-                    # Crea relazione ASCOLTA
-                    self._create_user_listens_relationship(
-                        spotify_user_id, 
-                        track_data["id"],
-                        time_range
+                    tracks_to_write = [
+                        track_data for track_data in items
+                        if context.mark_written("tracks", track_data["id"])
+                    ]
+                    await writer.submit(
+                        self._create_or_update_tracks_batch, tracks_to_write,
+                        on_commit=count_skipped("tracks")
                     )
-                    results["relationships_created"] += 1
                     
+                    listens = [
+                        {"track_id": track_data["id"], "rank": rank}
+                        for rank, track_data in enumerate(items, start=1)
+                    ]
+                    await writer.submit(
+                        self._create_user_listens_batch, spotify_user_id, time_range, listens,
+                        on_commit=[count("relationships_created"), checkpoint.committer(stage)]
+                    )
+                
+                # 6. Libreria salvata, in streaming pagina per pagina
+                if include_library:
+                    await report("library")
+                    results["library"] = await self._import_saved_library(
+                        spotify_user_id, access_token, limiter, writer, checkpoint, report, context
+                    )
+                
+                # 7. Playlist (solo quelle con snapshot_id cambiato)
+                if include_playlists:
+                    await report("playlists")
+                    results["playlists"] = await self._import_playlists(
+                        spotify_user_id, access_token, limiter, writer, checkpoint, report, context
+                    )
+                
+                # 8. Ascolti recenti, incrementali rispetto al cursore salvato
+                if include_recent:
+                    await report("recently_played")
+                    results["recently_played"] = await self._import_recently_played(
+                        spotify_user_id, access_token, limiter, writer, checkpoint, context
+                    )
+            
+            entity_stats = context.stats()
+            results["artists_imported"] = entity_stats["artists"]["written"]
+            results["albums_imported"] = entity_stats["albums"]["written"]
+            results["tracks_imported"] = entity_stats["tracks"]["written"]
+            results["entities"] = entity_stats
+            results["resumed_stages"] = checkpoint.resumed_stages
+            results["stages_skipped"] = checkpoint.skipped
+            results["artists_fresh_in_graph"] = context.fresh_in_graph
+                    
+            logger.info(f"🎵 Total artists imported: {results['artists_imported']}")
             logger.info(f"🎵 Total tracks imported: {results['tracks_imported']}")
             logger.info(f"🎵 Total albums imported: {results['albums_imported']}")
             logger.info(f"🎵 Total relationships created: {results['relationships_created']}")
+            logger.info(f"🎵 Unchanged entities skipped: {results['writes_skipped']}")
             
-            # 4. Aggiorna timestamp ultima sincronizzazione
+            # 9. Aggiorna timestamp ultima sincronizzazione
+            await report("finalizing")
             logger.info(f"⏰ Updating last sync timestamp for {spotify_user_id}")
-            self._update_user_last_sync(spotify_user_id)
+            await self._update_user_last_sync(spotify_user_id)
+            results["graph_statistics"] = await self.update_user_stats(spotify_user_id)
+            await checkpoint.clear()
             
             logger.info(f"Import completed for user {spotify_user_id}: {results}")
             return results
@@ -86,8 +246,64 @@ class SpotifyIngestionService:
         except Exception as e:
             logger.error(f"Error importing user data for {spotify_user_id}: {str(e)}")
             raise
+        finally:
+            # Anche un import fallito può aver già committato parte delle scritture
+            await response_cache.invalidate_user(spotify_user_id)
     
-    def _create_or_update_user(self, spotify_user_id: str, user_profile: Dict) -> bool:
+    async def _fetch_top_items(self, access_token: AccessToken, limiter: asyncio.Semaphore):
+        """Scarica in parallelo top artists e top tracks per i tre time range"""
+        async def fetch(fetch_fn, time_range: str) -> List[Dict]:
+            async with limiter:
+                response = await fetch_fn(access_token, time_range=time_range, limit=50)
+            return response.get("items", [])
+        
+        responses = await _gather_or_cancel(
+            *(fetch(spotify_client.get_user_top_artists, tr) for tr in TIME_RANGES),
+            *(fetch(spotify_client.get_user_top_tracks, tr) for tr in TIME_RANGES)
+        )
+        top_artists_by_range = dict(zip(TIME_RANGES, responses[:len(TIME_RANGES)]))
+        tracks_by_range = dict(zip(TIME_RANGES, responses[len(TIME_RANGES):]))
+        return top_artists_by_range, tracks_by_range
+    
+    async def _submit_artists(self,
+                              context: ImportContext,
+                              writer: GraphWriter,
+                              artist_ids: List[str],
+                              on_commit=None,
+                              touch_unchanged: bool = False):
+        """Accoda al writer gli artisti completi non ancora scritti
+        
+        Con touch_unchanged gli artisti riscaricati ma invariati vengono
+        segnati come verificati, così tornano freschi per l'idratazione.
+        """
+        artists_to_write = []
+        for artist_id in artist_ids:
+            artist_data = context.get_artist(artist_id)
+            if artist_data is not None and context.mark_written("artists", artist_id):
+                artists_to_write.append(artist_data)
+                for genre in artist_data.get("genres", []):
+                    context.mark_written("genres", genre)
+        
+        # Con on_commit si accoda anche un batch vuoto, così lo stadio viene
+        # segnato solo dopo il commit delle scritture accodate prima
+        if artists_to_write or on_commit is not None:
+            await writer.submit(
+                self._create_or_update_artists_batch, artists_to_write, touch_unchanged,
+                on_commit=on_commit
+            )
+    
+    @staticmethod
+    def _register_track(context: ImportContext, track_data: Dict):
+        """Registra nel contesto una traccia con il suo album e i suoi artisti"""
+        context.add_track(track_data)
+        album_data = track_data.get("album") or {}
+        if album_data.get("id"):
+            context.add_album(album_data)
+        for artist_data in track_data.get("artists", []) + album_data.get("artists", []):
+            if artist_data.get("id"):
+                context.add_artist(artist_data)
+    
+    async def _create_or_update_user(self, spotify_user_id: str, user_profile: Dict) -> bool:
         """Crea o aggiorna un nodo Utente"""
         query = """
         MERGE (u:Utente {spotify_user_id: $spotify_user_id})
@@ -110,94 +326,457 @@ class SpotifyIngestionService:
             "immagini": [img["url"] for img in user_profile.get("images", [])]
         }
         
-        result = self.db.execute_write_query(query, parameters)
+        result = await self.db.execute_write_query(query, parameters)
         return result[0]["created"] if result else False
     
-    def _create_or_update_artist(self, artist_data: Dict) -> Dict[str, Any]:
-        """Crea o aggiorna un nodo Artista"""
-        query = """
-        MERGE (a:Artista {spotify_id: $spotify_id})
-        SET a.nome = $nome,
-            a.popolarita = $popolarita,
-            a.followers = $followers,
-            a.immagini = $immagini,
-            a.external_urls = $external_urls,
-            a.aggiornato_il = datetime()
-        WITH a
+    async def _hydrate_catalog(self,
+                               context: ImportContext,
+                               access_token: AccessToken,
+                               limiter: asyncio.Semaphore,
+                               writer: GraphWriter,
+                               checkpoint: ImportCheckpoint,
+                               on_artists_commit=None,
+                               known_artist_ids: Optional[set] = None):
+        """Recupera in batch i dettagli completi degli artisti non ancora noti
         
-        // Gestisci generi
-        UNWIND $generi as genere_nome
-        MERGE (g:Genere {nome: genere_nome})
-        MERGE (a)-[:DI_GENERE]->(g)
+        I batch multi-ID girano in parallelo entro il limite di concorrenza e
+        ogni batch viene accodato al writer appena risolto. I batch già
+        completati in un'esecuzione precedente vengono saltati. Gli album non
+        vengono idratati: l'album semplificato nel payload dei brani contiene
+        già tutti i campi scritti sul nodo Album.
         
-        RETURN a.spotify_id as artist_id, count(g) as genres_linked
+        known_artist_ids esclude gli artisti già idratati in un altro contesto
+        (ad es. pagine precedenti della libreria).
         """
+        artist_ids = [
+            artist_id for artist_id in context.missing_artist_ids(list(context.artists))
+            if not known_artist_ids or artist_id not in known_artist_ids
+        ]
         
-        parameters = {
-            "spotify_id": artist_data["id"],
-            "nome": artist_data["name"],
-            "popolarita": artist_data.get("popularity"),
-            "followers": artist_data.get("followers", {}).get("total", 0),
-            "immagini": [img["url"] for img in artist_data.get("images", [])],
-            "external_urls": artist_data.get("external_urls", {}),
-            "generi": artist_data.get("genres", [])
-        }
+        # Il grafo fa da cache: gli artisti aggiornati di recente non si riscaricano
+        fresh_ids = await self._find_fresh_artist_ids(artist_ids)
+        artist_ids = [artist_id for artist_id in artist_ids if artist_id not in fresh_ids]
+        context.fresh_in_graph = len(fresh_ids)
+        
+        logger.info(f"💧 Hydrating {len(artist_ids)} artists ({len(fresh_ids)} fresh in graph)")
         
-        result = self.db.execute_write_query(query, parameters)
-        return result[0] if result else {}
+        async def hydrate_artists(chunk: List[str]):
+            stage = batch_stage("artists", chunk)
+            if checkpoint.is_done(stage):
+                return
+            async with limiter:
+                artists = await spotify_client.get_several_artists(access_token, chunk)
+            for artist_data in artists:
+                context.add_artist(artist_data)
+            await self._submit_artists(
+                context, writer, [a["id"] for a in artists],
+                on_commit=[on_artists_commit, checkpoint.committer(stage)],
+                touch_unchanged=True
+            )
+        
+        artist_batch = spotify_client.MAX_ARTISTS_PER_REQUEST
+        await _gather_or_cancel(*(
+            hydrate_artists(artist_ids[i:i + artist_batch])
+            for i in range(0, len(artist_ids), artist_batch)
+        ))
     
-    async def _import_track_with_relations(self, track_data: Dict, access_token: str) -> Dict[str, int]:
-        """Importa una traccia con tutte le sue relazioni (album, artisti)"""
-        results = {"tracks": 0, "albums": 0, "artists": 0}
+    async def _find_fresh_artist_ids(self, artist_ids: List[str]) -> set:
+        """Ritorna, con una sola query, gli artisti già nel grafo e più recenti del TTL
         
-        try:
-            # 1. Importa artisti della traccia
-            for artist_data in track_data.get("artists", []):
-                # Ottieni dettagli completi dell'artista
-                full_artist = await spotify_client.get_artist_details(access_token, artist_data["id"])
-                self._create_or_update_artist(full_artist)
-                results["artists"] += 1
+        Vale la verifica più recente tra aggiornamento (contenuto cambiato) e
+        rivalidazione (verificato_il, contenuto invariato).
+        """
+        if not artist_ids or settings.HYDRATION_FRESHNESS_TTL_SECONDS <= 0:
+            return set()
+        
+        query = """
+        MATCH (a:Artista) WHERE a.spotify_id IN $ids
+          AND coalesce(a.verificato_il, a.aggiornato_il) > datetime() - duration({seconds: $ttl})
+        RETURN a.spotify_id as id
+        """
+        result = await self.db.execute_query(query, {
+            "ids": artist_ids,
+            "ttl": settings.HYDRATION_FRESHNESS_TTL_SECONDS
+        })
+        return {record["id"] for record in result}
+    
+    @staticmethod
+    def _unwritten(context: ImportContext, kind: str, items) -> List[Dict]:
+        """Righe non ancora scritte nell'import, segnate come scritte"""
+        return [item for item in items if context.mark_written(kind, item["id"])]
+    
+    async def _import_saved_library(self,
+                                    spotify_user_id: str,
+                                    access_token: AccessToken,
+                                    limiter: asyncio.Semaphore,
+                                    writer: GraphWriter,
+                                    checkpoint: ImportCheckpoint,
+                                    report,
+                                    context: ImportContext) -> Dict[str, int]:
+        """Importa brani e album salvati pagina per pagina
+        
+        Ogni pagina viene idratata e accodata al writer prima di scaricare la
+        successiva: la coda limitata del writer fa da backpressure e la memoria
+        resta costante anche per librerie molto grandi. Ogni pagina è uno
+        stadio di checkpoint ("saved_tracks:<offset>", "saved_albums:<offset>").
+        Artisti, album e brani già scritti dall'import (context) non vengono
+        né riscaricati né riscritti.
+        """
+        stats = {"saved_tracks": 0, "saved_albums": 0, "pages": 0}
+        # Solo gli ID: evitano di riscaricare artisti già visti nei top item o in pagine precedenti
+        known_artist_ids = set(context.artists)
+        
+        def count(key: str):
+            def on_commit(written: int):
+                stats[key] += written
+            return on_commit
+        
+        start = checkpoint.resume_offset("saved_tracks", LIBRARY_PAGE_SIZE)
+        async for page in spotify_client.iterate_saved_tracks(access_token, offset=start, limit=LIBRARY_PAGE_SIZE):
+            stage = f"saved_tracks:{page.get('offset', 0)}"
+            # I file locali non hanno un ID Spotify
+            items = [item for item in page.get("items", []) if (item.get("track") or {}).get("id")]
             
-            # 2. Importa album se presente
-            album_data = track_data.get("album")
-            if album_data:
-                album_result = await self._import_album_with_relations(album_data, access_token)
-                results["albums"] += album_result["albums"]
-                results["artists"] += album_result["artists"]
+            page_context = ImportContext()
+            for item in items:
+                self._register_track(page_context, item["track"])
+            await self._hydrate_catalog(
+                page_context, access_token, limiter, writer, checkpoint,
+                known_artist_ids=known_artist_ids
+            )
+            known_artist_ids.update(page_context.artists)
             
-            # 3. Importa traccia
-            self._create_or_update_track(track_data)
-            results["tracks"] += 1
+            await writer.submit(
+                self._create_or_update_albums_batch, self._unwritten(context, "albums", page_context.albums.values())
+            )
+            await writer.submit(
+                self._create_or_update_tracks_batch, self._unwritten(context, "tracks", page_context.tracks.values())
+            )
+            await writer.submit(
+                self._create_user_saved_tracks_batch,
+                spotify_user_id,
+                [{"track_id": item["track"]["id"], "aggiunto_il": item.get("added_at")} for item in items],
+                on_commit=[count("saved_tracks"), checkpoint.committer(stage)]
+            )
+            stats["pages"] += 1
+            await report("library", kind="tracks", offset=page.get("offset"), total=page.get("total"))
+        
+        start = checkpoint.resume_offset("saved_albums", LIBRARY_PAGE_SIZE)
+        async for page in spotify_client.iterate_saved_albums(access_token, offset=start, limit=LIBRARY_PAGE_SIZE):
+            stage = f"saved_albums:{page.get('offset', 0)}"
+            items = [item for item in page.get("items", []) if (item.get("album") or {}).get("id")]
             
-            return results
+            page_context = ImportContext()
+            for item in items:
+                page_context.add_album(item["album"])
+                for artist_data in item["album"].get("artists", []):
+                    page_context.add_artist(artist_data)
+            await self._hydrate_catalog(
+                page_context, access_token, limiter, writer, checkpoint,
+                known_artist_ids=known_artist_ids
+            )
+            known_artist_ids.update(page_context.artists)
             
-        except Exception as e:
-            logger.error(f"Error importing track {track_data.get('id', 'unknown')}: {str(e)}")
-            return results
+            await writer.submit(
+                self._create_or_update_albums_batch, self._unwritten(context, "albums", page_context.albums.values())
+            )
+            await writer.submit(
+                self._create_user_saved_albums_batch,
+                spotify_user_id,
+                [{"album_id": item["album"]["id"], "aggiunto_il": item.get("added_at")} for item in items],
+                on_commit=[count("saved_albums"), checkpoint.committer(stage)]
+            )
+            stats["pages"] += 1
+            await report("library", kind="albums", offset=page.get("offset"), total=page.get("total"))
+        
+        return stats
     
-    async def _import_album_with_relations(self, album_data: Dict, access_token: str) -> Dict[str, int]:
-        """Importa un album con le sue relazioni"""
-        results = {"albums": 0, "artists": 0}
+    async def _import_playlists(self,
+                                spotify_user_id: str,
+                                access_token: AccessToken,
+                                limiter: asyncio.Semaphore,
+                                writer: GraphWriter,
+                                checkpoint: ImportCheckpoint,
+                                report,
+                                context: ImportContext) -> Dict[str, int]:
+        """Importa le playlist dell'utente saltando quelle invariate
         
-        try:
-            # Importa artisti dell'album
-            for artist_data in album_data.get("artists", []):
-                full_artist = await spotify_client.get_artist_details(access_token, artist_data["id"])
-                self._create_or_update_artist(full_artist)
-                results["artists"] += 1
+        Per ogni pagina dell'elenco confronta in blocco lo snapshot_id con
+        quello salvato: le playlist invariate costano zero chiamate aggiuntive.
+        Per quelle cambiate i brani vengono riscritti pagina per pagina e lo
+        snapshot_id viene salvato per ultimo, così un sync interrotto viene
+        ripetuto al giro successivo. Una playlist che non si riesce a
+        scaricare (ad es. 403/404 su playlist non disponibili) viene contata
+        in "failed" e ritentata al sync successivo senza interrompere l'import.
+        Come per la libreria, le entità già scritte dall'import vengono saltate.
+        """
+        stats = {"playlists": 0, "unchanged": 0, "synced": 0, "failed": 0, "items": 0}
+        followed_ids = []
+        known_artist_ids = set(context.artists)
+        
+        def count_items(written: int):
+            stats["items"] += written
+        
+        async for page in spotify_client.iterate_user_playlists(access_token):
+            playlists = [p for p in page.get("items", []) if p and p.get("id")]
+            stats["playlists"] += len(playlists)
+            followed_ids.extend(p["id"] for p in playlists)
             
-            # Importa album
-            self._create_or_update_album(album_data)
-            results["albums"] += 1
+            stored = await self.db.execute_query(
+                """
+                MATCH (p:Playlist) WHERE p.spotify_id IN $ids
+                RETURN p.spotify_id as id, p.snapshot_id as snapshot_id
+                """,
+                {"ids": [p["id"] for p in playlists]}
+            )
+            stored_snapshots = {record["id"]: record["snapshot_id"] for record in stored}
             
-            return results
+            await writer.submit(
+                self._create_or_update_playlists_batch, spotify_user_id,
+                [self._playlist_row(p) for p in playlists]
+            )
             
-        except Exception as e:
-            logger.error(f"Error importing album {album_data.get('id', 'unknown')}: {str(e)}")
-            return results
+            for playlist in playlists:
+                if stored_snapshots.get(playlist["id"]) == playlist.get("snapshot_id"):
+                    stats["unchanged"] += 1
+                    continue
+                try:
+                    await self._sync_playlist_items(
+                        playlist, access_token, limiter, writer, checkpoint, context, known_artist_ids, count_items
+                    )
+                except Exception as e:
+                    # Un errore del writer interrompe l'import, quello di una singola playlist no
+                    if writer.failed:
+                        raise
+                    stats["failed"] += 1
+                    logger.warning(f"Skipping playlist {playlist['id']} for {spotify_user_id}: {str(e)}")
+                    continue
+                stats["synced"] += 1
+            
+            await report("playlists", **stats)
+        
+        # Rimuove le playlist non più seguite
+        await writer.submit(self._remove_unfollowed_playlists, spotify_user_id, followed_ids)
+        
+        logger.info(f"📜 Playlists for {spotify_user_id}: {stats}")
+        return stats
+    
+    async def _sync_playlist_items(self,
+                                   playlist: Dict,
+                                   access_token: AccessToken,
+                                   limiter: asyncio.Semaphore,
+                                   writer: GraphWriter,
+                                   checkpoint: ImportCheckpoint,
+                                   context: ImportContext,
+                                   known_artist_ids: set,
+                                   on_items_commit):
+        """Riscrive i brani di una playlist cambiata, pagina per pagina"""
+        playlist_id = playlist["id"]
+        await writer.submit(self._clear_playlist_items, playlist_id)
+        
+        position = 0
+        async for page in spotify_client.iterate_playlist_tracks(access_token, playlist_id):
+            rows = []
+            page_context = ImportContext()
+            for item in page.get("items", []):
+                track_data = item.get("track") or {}
+                # Episodi podcast e file locali non sono brani del catalogo
+                if track_data.get("type") == "track" and track_data.get("id"):
+                    self._register_track(page_context, track_data)
+                    rows.append({
+                        "track_id": track_data["id"],
+                        "posizione": position,
+                        "aggiunto_il": item.get("added_at")
+                    })
+                position += 1
+            
+            await self._hydrate_catalog(
+                page_context, access_token, limiter, writer, checkpoint,
+                known_artist_ids=known_artist_ids
+            )
+            known_artist_ids.update(page_context.artists)
+            
+            await writer.submit(
+                self._create_or_update_albums_batch, self._unwritten(context, "albums", page_context.albums.values())
+            )
+            await writer.submit(
+                self._create_or_update_tracks_batch, self._unwritten(context, "tracks", page_context.tracks.values())
+            )
+            await writer.submit(self._create_playlist_items_batch, playlist_id, rows, on_commit=on_items_commit)
+        
+        await writer.submit(self._set_playlist_snapshot, playlist_id, playlist.get("snapshot_id"))
+    
+    async def sync_recently_played(self, spotify_user_id: str, access_token: AccessToken) -> Dict[str, int]:
+        """Importa solo gli ascolti recenti, per un polling frequente ed economico
+        
+        Le chiamate concorrenti per lo stesso utente condividono un'unica
+        sincronizzazione, così lo stesso cursore non viene letto due volte.
+        """
+        return await self._recent_single_flight.do(
+            spotify_user_id, lambda: self._sync_recently_played(spotify_user_id, access_token)
+        )
+    
+    async def _sync_recently_played(self, spotify_user_id: str, access_token: AccessToken) -> Dict[str, int]:
+        limiter = asyncio.Semaphore(max(1, settings.IMPORT_CONCURRENCY))
+        async with GraphWriter(settings.IMPORT_WRITE_QUEUE_SIZE) as writer:
+            stats = await self._import_recently_played(
+                spotify_user_id, access_token, limiter, writer, ImportCheckpoint.disabled(spotify_user_id)
+            )
+        if stats["buckets"]:
+            await response_cache.invalidate_user(spotify_user_id)
+        return stats
+    
+    async def _import_recently_played(self,
+                                      spotify_user_id: str,
+                                      access_token: AccessToken,
+                                      limiter: asyncio.Semaphore,
+                                      writer: GraphWriter,
+                                      checkpoint: ImportCheckpoint,
+                                      context: Optional[ImportContext] = None) -> Dict[str, int]:
+        """Importa gli ascolti successivi al cursore salvato sull'utente
+        
+        Gli ascolti vengono aggregati per (brano, giorno) in relazioni
+        ASCOLTO_GIORNALIERO con un contatore, così il grafo cresce al più di
+        una relazione per brano al giorno. Il cursore viene aggiornato nella
+        stessa transazione dei contatori e solo se è ancora quello letto
+        all'inizio, quindi nessun ascolto è contato due volte. Dentro un import
+        completo (context) le entità già scritte vengono saltate.
+        """
+        context = context or ImportContext()
+        cursor = await self._get_recently_played_cursor(spotify_user_id)
+        stats = {"plays": 0, "buckets": 0}
+        
+        page_context = ImportContext()
+        buckets: Dict[tuple, Dict[str, Any]] = {}
+        new_cursor = cursor
+        async for page in spotify_client.iterate_recently_played(access_token, after=cursor):
+            for item in page.get("items", []):
+                track_data = item.get("track") or {}
+                if not track_data.get("id") or not item.get("played_at"):
+                    continue
+                played_at = datetime.fromisoformat(item["played_at"].replace("Z", "+00:00"))
+                played_ms = int(played_at.timestamp() * 1000)
+                if cursor is not None and played_ms <= cursor:
+                    continue
+                
+                self._register_track(page_context, track_data)
+                bucket = buckets.setdefault(
+                    (track_data["id"], played_at.astimezone(timezone.utc).date().isoformat()),
+                    {"conteggio": 0, "ultimo_ascolto": item["played_at"]}
+                )
+                bucket["conteggio"] += 1
+                if item["played_at"] > bucket["ultimo_ascolto"]:
+                    bucket["ultimo_ascolto"] = item["played_at"]
+                new_cursor = max(new_cursor or 0, played_ms)
+                stats["plays"] += 1
+        
+        if not buckets:
+            return stats
+        
+        await self._hydrate_catalog(
+            page_context, access_token, limiter, writer, checkpoint,
+            known_artist_ids=set(context.artists)
+        )
+        await writer.submit(
+            self._create_or_update_albums_batch, self._unwritten(context, "albums", page_context.albums.values())
+        )
+        await writer.submit(
+            self._create_or_update_tracks_batch, self._unwritten(context, "tracks", page_context.tracks.values())
+        )
+        
+        rows = [
+            {"track_id": track_id, "giorno": giorno, **bucket}
+            for (track_id, giorno), bucket in buckets.items()
+        ]
+        
+        def count_buckets(written: int):
+            stats["buckets"] += written
+        
+        await writer.submit(
+            self._create_user_daily_listens_batch, spotify_user_id, rows, cursor, new_cursor,
+            on_commit=count_buckets
+        )
+        return stats
+    
+    def _chunks(self, rows: List[Dict]):
+        """Divide le righe in blocchi della dimensione di batch configurata"""
+        batch_size = max(1, settings.NEO4J_WRITE_BATCH_SIZE)
+        for i in range(0, len(rows), batch_size):
+            yield rows[i:i + batch_size]
+    
+    @staticmethod
+    def _content_hash(row: Dict[str, Any]) -> str:
+        """Impronta compatta del contenuto di una riga (proprietà e collegamenti)
+        
+        Esclude i contatori volatili, che vengono quindi aggiornati solo
+        quando cambia anche il resto del contenuto.
+        """
+        content = {k: v for k, v in row.items() if k not in VOLATILE_FIELDS}
+        payload = json.dumps(content, sort_keys=True, separators=(",", ":"), default=str)
+        return hashlib.sha1(payload.encode()).hexdigest()[:16]
+    
+    async def _write_changed_rows(self,
+                                  label: str,
+                                  query: str,
+                                  rows: List[Dict],
+                                  touch_unchanged: bool = False) -> Dict[str, int]:
+        """Scrive solo le righe il cui contenuto è cambiato rispetto al grafo
+        
+        Per ogni blocco legge in un'unica query gli hash salvati sui nodi e
+        scarta le righe con hash identico, evitando SET e aggiornato_il inutili.
+        Le query salvano l'hash solo se tutti i collegamenti (risolti con
+        MATCH) sono stati creati: una riga con un collegamento mancante viene
+        riscritta al prossimo import. Con touch_unchanged le righe invariate
+        aggiornano solo verificato_il.
+        """
+        stats = {"written": 0, "skipped": 0}
+        for row in rows:
+            row["hash_contenuto"] = self._content_hash(row)
+        
+        for chunk in self._chunks(rows):
+            stored = await self.db.execute_query(
+                f"""
+                MATCH (n:{label}) WHERE n.spotify_id IN $ids
+                RETURN n.spotify_id as id, n.hash_contenuto as hash
+                """,
+                {"ids": [row["spotify_id"] for row in chunk]}
+            )
+            stored_hashes = {record["id"]: record["hash"] for record in stored}
+            changed = [row for row in chunk if stored_hashes.get(row["spotify_id"]) != row["hash_contenuto"]]
+            stats["skipped"] += len(chunk) - len(changed)
+            
+            if touch_unchanged and len(changed) < len(chunk):
+                changed_ids = {row["spotify_id"] for row in changed}
+                await self.db.execute_write_query(
+                    f"""
+                    UNWIND $ids as id
+                    MATCH (n:{label} {{spotify_id: id}})
+                    SET n.verificato_il = datetime()
+                    """,
+                    {"ids": [row["spotify_id"] for row in chunk if row["spotify_id"] not in changed_ids]}
+                )
+            
+            if changed:
+                result = await self.db.execute_write_query(query, {"rows": changed})
+                stats["written"] += result[0]["written"] if result else 0
+        return stats
     
-    def _create_or_update_album(self, album_data: Dict) -> Dict[str, Any]:
-        """Crea o aggiorna un nodo Album"""
+    @staticmethod
+    def _artist_row(artist_data: Dict) -> Dict[str, Any]:
+        """Converte un artista Spotify nella riga scritta su Neo4j"""
+        return {
+            "spotify_id": artist_data["id"],
+            "nome": artist_data["name"],
+            "popolarita": artist_data.get("popularity"),
+            "followers": artist_data.get("followers", {}).get("total", 0),
+            "immagini": [img["url"] for img in artist_data.get("images", [])],
+            "external_urls": artist_data.get("external_urls", {}),
+            "generi": artist_data.get("genres", [])
+        }
+    
+    @staticmethod
+    def _album_row(album_data: Dict) -> Dict[str, Any]:
+        """Converte un album Spotify nella riga scritta su Neo4j"""
         # Estrai anno dalla data di release
         release_date = album_data.get("release_date", "")
         anno_pubblicazione = None
@@ -207,26 +786,7 @@ class SpotifyIngestionService:
             except (ValueError, IndexError):
                 pass
         
-        query = """
-        MERGE (al:Album {spotify_id: $spotify_id})
-        SET al.titolo = $titolo,
-            al.anno_pubblicazione = $anno_pubblicazione,
-            al.tipo_album = $tipo_album,
-            al.total_tracks = $total_tracks,
-            al.immagini = $immagini,
-            al.external_urls = $external_urls,
-            al.aggiornato_il = datetime()
-        WITH al
-        
-        // Collega artisti all'album
-        UNWIND $artist_ids as artist_id
-        MATCH (a:Artista {spotify_id: artist_id})
-        MERGE (a)-[:PUBBLICATO]->(al)
-        
-        RETURN al.spotify_id as album_id, count(a) as artists_linked
-        """
-        
-        parameters = {
+        return {
             "spotify_id": album_data["id"],
             "titolo": album_data["name"],
             "anno_pubblicazione": anno_pubblicazione,
@@ -236,80 +796,424 @@ class SpotifyIngestionService:
             "external_urls": album_data.get("external_urls", {}),
             "artist_ids": [artist["id"] for artist in album_data.get("artists", [])]
         }
+    
+    @staticmethod
+    def _track_row(track_data: Dict) -> Dict[str, Any]:
+        """Converte una traccia Spotify nella riga scritta su Neo4j"""
+        return {
+            "spotify_id": track_data["id"],
+            "titolo": track_data["name"],
+            "durata_ms": track_data.get("duration_ms"),
+            "numero_traccia": track_data.get("track_number"),
+            "esplicito": track_data.get("explicit", False),
+            "popolarita": track_data.get("popularity"),
+            "preview_url": track_data.get("preview_url"),
+            "external_urls": track_data.get("external_urls", {}),
+            "album_id": (track_data.get("album") or {}).get("id"),
+            "artist_ids": [artist["id"] for artist in track_data.get("artists", [])]
+        }
+    
+    async def _create_or_update_artists_batch(self,
+                                              artists: List[Dict],
+                                              touch_unchanged: bool = False) -> Dict[str, int]:
+        """Crea o aggiorna nodi Artista con una query UNWIND per batch"""
+        query = """
+        UNWIND $rows as row
+        MERGE (a:Artista {spotify_id: row.spotify_id})
+        SET a.nome = row.nome,
+            a.popolarita = row.popolarita,
+            a.followers = row.followers,
+            a.immagini = row.immagini,
+            a.external_urls = row.external_urls,
+            a.hash_contenuto = row.hash_contenuto,
+            a.aggiornato_il = datetime(),
+            a.verificato_il = datetime()
+        
+        // Gestisci generi
+        FOREACH (genere_nome IN row.generi |
+            MERGE (g:Genere {nome: genere_nome})
+            MERGE (a)-[:DI_GENERE]->(g)
+        )
         
-        result = self.db.execute_write_query(query, parameters)
-        return result[0] if result else {}
+        RETURN count(a) as written
+        """
+        
+        rows = [self._artist_row(a) for a in artists]
+        return await self._write_changed_rows("Artista", query, rows, touch_unchanged=touch_unchanged)
     
-    def _create_or_update_track(self, track_data: Dict) -> Dict[str, Any]:
-        """Crea o aggiorna un nodo Brano"""
+    async def _create_or_update_albums_batch(self, albums: List[Dict]) -> Dict[str, int]:
+        """Crea o aggiorna nodi Album con una query UNWIND per batch"""
         query = """
-        MERGE (t:Brano {spotify_id: $spotify_id})
-        SET t.titolo = $titolo,
-            t.durata_ms = $durata_ms,
-            t.numero_traccia = $numero_traccia,
-            t.esplicito = $esplicito,
-            t.popolarita = $popolarita,
-            t.preview_url = $preview_url,
-            t.external_urls = $external_urls,
+        UNWIND $rows as row
+        MERGE (al:Album {spotify_id: row.spotify_id})
+        SET al.titolo = row.titolo,
+            al.anno_pubblicazione = row.anno_pubblicazione,
+            al.tipo_album = row.tipo_album,
+            al.total_tracks = row.total_tracks,
+            al.immagini = row.immagini,
+            al.external_urls = row.external_urls,
+            al.aggiornato_il = datetime()
+        
+        // Collega artisti all'album
+        WITH al, row
+        CALL {
+            WITH al, row
+            UNWIND row.artist_ids as artist_id
+            MATCH (a:Artista {spotify_id: artist_id})
+            MERGE (a)-[:PUBBLICATO]->(al)
+            RETURN count(a) as artists_linked
+        }
+        
+        // Hash solo con tutti gli artisti collegati, altrimenti si riscrive
+        SET al.hash_contenuto = CASE WHEN artists_linked = size(row.artist_ids)
+                                     THEN row.hash_contenuto END
+        
+        RETURN count(al) as written
+        """
+        
+        rows = [self._album_row(a) for a in albums]
+        return await self._write_changed_rows("Album", query, rows)
+    
+    async def _create_or_update_tracks_batch(self, tracks: List[Dict]) -> Dict[str, int]:
+        """Crea o aggiorna nodi Brano con una query UNWIND per batch"""
+        query = """
+        UNWIND $rows as row
+        MERGE (t:Brano {spotify_id: row.spotify_id})
+        SET t.titolo = row.titolo,
+            t.durata_ms = row.durata_ms,
+            t.numero_traccia = row.numero_traccia,
+            t.esplicito = row.esplicito,
+            t.popolarita = row.popolarita,
+            t.preview_url = row.preview_url,
+            t.external_urls = row.external_urls,
             t.aggiornato_il = datetime()
-        WITH t
         
         // Collega al album se presente
-        WITH t, $album_id as album_id
+        WITH t, row
         CALL {
-            WITH t, album_id
-            WITH t, album_id WHERE album_id IS NOT NULL
-            MATCH (al:Album {spotify_id: album_id})
-            MERGE (al)-[:CONTIENE {numero_traccia: $numero_traccia}]->(t)
-            RETURN 1 as album_linked
+            WITH t, row
+            WITH t, row WHERE row.album_id IS NOT NULL
+            MATCH (al:Album {spotify_id: row.album_id})
+            MERGE (al)-[:CONTIENE {numero_traccia: row.numero_traccia}]->(t)
+            RETURN count(al) as album_linked
         }
         
         // Collega artisti
-        WITH t
-        UNWIND $artist_ids as artist_id
-        MATCH (a:Artista {spotify_id: artist_id})
-        MERGE (a)-[:ESEGUE]->(t)
+        CALL {
+            WITH t, row
+            UNWIND row.artist_ids as artist_id
+            MATCH (a:Artista {spotify_id: artist_id})
+            MERGE (a)-[:ESEGUE]->(t)
+            RETURN count(a) as artists_linked
+        }
         
-        RETURN t.spotify_id as track_id, count(a) as artists_linked
-        """
+        // Hash solo con album e artisti collegati, altrimenti si riscrive
+        SET t.hash_contenuto = CASE WHEN (row.album_id IS NULL OR album_linked > 0)
+                                          AND artists_linked = size(row.artist_ids)
+                                     THEN row.hash_contenuto END
         
-        parameters = {
-            "spotify_id": track_data["id"],
-            "titolo": track_data["name"],
-            "durata_ms": track_data.get("duration_ms"),
-            "numero_traccia": track_data.get("track_number"),
-            "esplicito": track_data.get("explicit", False),
-            "popolarita": track_data.get("popularity"),
-            "preview_url": track_data.get("preview_url"),
-            "external_urls": track_data.get("external_urls", {}),
-            "album_id": track_data.get("album", {}).get("id"),
-            "artist_ids": [artist["id"] for artist in track_data.get("artists", [])]
-        }
+        RETURN count(t) as written
+        """
         
-        result = self.db.execute_write_query(query, parameters)
-        return result[0] if result else {}
+        rows = [self._track_row(t) for t in tracks]
+        return await self._write_changed_rows("Brano", query, rows)
     
-    def _create_user_listens_relationship(self, spotify_user_id: str, track_id: str, time_range: str):
-        """Crea relazione ASCOLTA tra utente e brano"""
+    async def _create_user_listens_batch(self,
+                                         spotify_user_id: str,
+                                         time_range: str,
+                                         listens: List[Dict]) -> int:
+        """Crea relazioni ASCOLTA {time_range, rank} tra utente e brani di un time range
+        
+        Ogni riga contiene track_id e rank (posizione 1-based nella classifica
+        Spotify). C'è una relazione per time range, quindi i range non si
+        sovrascrivono; le relazioni del range non più in classifica vengono
+        rimosse.
+        """
         query = """
         MATCH (u:Utente {spotify_user_id: $spotify_user_id})
-        MATCH (t:Brano {spotify_id: $track_id})
-        MERGE (u)-[r:ASCOLTA]->(t)
-        SET r.time_range = $time_range,
+        UNWIND $rows as row
+        MATCH (t:Brano {spotify_id: row.track_id})
+        MERGE (u)-[r:ASCOLTA {time_range: $time_range}]->(t)
+        SET r.rank = row.rank,
             r.ultimo_ascolto = datetime(),
             r.conteggio = coalesce(r.conteggio, 0) + 1
-        RETURN r.conteggio as count
+        RETURN count(r) as written
         """
         
-        parameters = {
+        written = 0
+        for chunk in self._chunks(listens):
+            result = await self.db.execute_write_query(query, {
+                "spotify_user_id": spotify_user_id,
+                "time_range": time_range,
+                "rows": chunk
+            })
+            written += result[0]["written"] if result else 0
+        
+        await self._remove_stale_ranks(
+            spotify_user_id, "ASCOLTA", "Brano", time_range, [row["track_id"] for row in listens]
+        )
+        return written
+    
+    async def _create_user_top_artists_batch(self,
+                                             spotify_user_id: str,
+                                             time_range: str,
+                                             top_artists: List[Dict]) -> int:
+        """Crea relazioni PREFERISCE {time_range, rank} tra utente e top artists di un time range
+        
+        Ogni riga contiene artist_id e rank; le relazioni del range non più in
+        classifica vengono rimosse.
+        """
+        query = """
+        MATCH (u:Utente {spotify_user_id: $spotify_user_id})
+        UNWIND $rows as row
+        MATCH (a:Artista {spotify_id: row.artist_id})
+        MERGE (u)-[r:PREFERISCE {time_range: $time_range}]->(a)
+        SET r.rank = row.rank,
+            r.aggiornato_il = datetime()
+        RETURN count(r) as written
+        """
+        
+        written = 0
+        for chunk in self._chunks(top_artists):
+            result = await self.db.execute_write_query(query, {
+                "spotify_user_id": spotify_user_id,
+                "time_range": time_range,
+                "rows": chunk
+            })
+            written += result[0]["written"] if result else 0
+        
+        await self._remove_stale_ranks(
+            spotify_user_id, "PREFERISCE", "Artista", time_range, [row["artist_id"] for row in top_artists]
+        )
+        return written
+    
+    async def _remove_stale_ranks(self,
+                                  spotify_user_id: str,
+                                  relationship: str,
+                                  label: str,
+                                  time_range: str,
+                                  current_ids: List[str]):
+        """Rimuove le relazioni di classifica del range verso entità non più presenti
+        
+        Rimuove anche le relazioni legacy senza rank (modello precedente).
+        """
+        query = f"""
+        MATCH (u:Utente {{spotify_user_id: $spotify_user_id}})-[r:{relationship} {{time_range: $time_range}}]->(n:{label})
+        WHERE r.rank IS NULL OR NOT n.spotify_id IN $current_ids
+        DELETE r
+        """
+        await self.db.execute_write_query(query, {
+            "spotify_user_id": spotify_user_id,
+            "time_range": time_range,
+            "current_ids": current_ids
+        })
+    
+    async def _create_user_saved_tracks_batch(self, spotify_user_id: str, saved: List[Dict]) -> int:
+        """Crea relazioni HA_SALVATO tra utente e brani della libreria
+        
+        Ogni riga contiene track_id e aggiunto_il (ISO 8601).
+        """
+        query = """
+        MATCH (u:Utente {spotify_user_id: $spotify_user_id})
+        UNWIND $rows as row
+        MATCH (t:Brano {spotify_id: row.track_id})
+        MERGE (u)-[r:HA_SALVATO]->(t)
+        SET r.aggiunto_il = datetime(row.aggiunto_il)
+        RETURN count(r) as written
+        """
+        
+        written = 0
+        for chunk in self._chunks(saved):
+            result = await self.db.execute_write_query(query, {
+                "spotify_user_id": spotify_user_id,
+                "rows": chunk
+            })
+            written += result[0]["written"] if result else 0
+        return written
+    
+    async def _create_user_saved_albums_batch(self, spotify_user_id: str, saved: List[Dict]) -> int:
+        """Crea relazioni HA_SALVATO tra utente e album della libreria
+        
+        Ogni riga contiene album_id e aggiunto_il (ISO 8601).
+        """
+        query = """
+        MATCH (u:Utente {spotify_user_id: $spotify_user_id})
+        UNWIND $rows as row
+        MATCH (al:Album {spotify_id: row.album_id})
+        MERGE (u)-[r:HA_SALVATO]->(al)
+        SET r.aggiunto_il = datetime(row.aggiunto_il)
+        RETURN count(r) as written
+        """
+        
+        written = 0
+        for chunk in self._chunks(saved):
+            result = await self.db.execute_write_query(query, {
+                "spotify_user_id": spotify_user_id,
+                "rows": chunk
+            })
+            written += result[0]["written"] if result else 0
+        return written
+    
+    @staticmethod
+    def _playlist_row(playlist_data: Dict) -> Dict[str, Any]:
+        """Converte una playlist Spotify nella riga scritta su Neo4j (senza snapshot_id)"""
+        return {
+            "spotify_id": playlist_data["id"],
+            "nome": playlist_data.get("name"),
+            "descrizione": playlist_data.get("description"),
+            "pubblica": playlist_data.get("public"),
+            "collaborativa": playlist_data.get("collaborative", False),
+            "proprietario_id": (playlist_data.get("owner") or {}).get("id"),
+            "total_tracks": (playlist_data.get("tracks") or {}).get("total"),
+            "immagini": [img["url"] for img in (playlist_data.get("images") or [])]
+        }
+    
+    async def _create_or_update_playlists_batch(self, spotify_user_id: str, playlists: List[Dict]) -> int:
+        """Crea o aggiorna nodi Playlist e le relazioni SEGUE_PLAYLIST dell'utente"""
+        query = """
+        MATCH (u:Utente {spotify_user_id: $spotify_user_id})
+        UNWIND $rows as row
+        MERGE (p:Playlist {spotify_id: row.spotify_id})
+        SET p.nome = row.nome,
+            p.descrizione = row.descrizione,
+            p.pubblica = row.pubblica,
+            p.collaborativa = row.collaborativa,
+            p.proprietario_id = row.proprietario_id,
+            p.total_tracks = row.total_tracks,
+            p.immagini = row.immagini
+        MERGE (u)-[:SEGUE_PLAYLIST]->(p)
+        RETURN count(p) as written
+        """
+        
+        written = 0
+        for chunk in self._chunks(playlists):
+            result = await self.db.execute_write_query(query, {
+                "spotify_user_id": spotify_user_id,
+                "rows": chunk
+            })
+            written += result[0]["written"] if result else 0
+        return written
+    
+    async def _clear_playlist_items(self, playlist_id: str):
+        """Rimuove le relazioni INCLUDE di una playlist prima di riscriverle"""
+        query = """
+        MATCH (p:Playlist {spotify_id: $playlist_id})-[r:INCLUDE]->()
+        DELETE r
+        """
+        await self.db.execute_write_query(query, {"playlist_id": playlist_id})
+    
+    async def _create_playlist_items_batch(self, playlist_id: str, items: List[Dict]) -> int:
+        """Crea relazioni INCLUDE tra playlist e brani
+        
+        Ogni riga contiene track_id, posizione e aggiunto_il (ISO 8601).
+        """
+        query = """
+        MATCH (p:Playlist {spotify_id: $playlist_id})
+        UNWIND $rows as row
+        MATCH (t:Brano {spotify_id: row.track_id})
+        MERGE (p)-[r:INCLUDE {posizione: row.posizione}]->(t)
+        SET r.aggiunto_il = datetime(row.aggiunto_il)
+        RETURN count(r) as written
+        """
+        
+        written = 0
+        for chunk in self._chunks(items):
+            result = await self.db.execute_write_query(query, {
+                "playlist_id": playlist_id,
+                "rows": chunk
+            })
+            written += result[0]["written"] if result else 0
+        return written
+    
+    async def _set_playlist_snapshot(self, playlist_id: str, snapshot_id: Optional[str]):
+        """Salva lo snapshot_id dopo che tutti i brani della playlist sono stati scritti"""
+        query = """
+        MATCH (p:Playlist {spotify_id: $playlist_id})
+        SET p.snapshot_id = $snapshot_id,
+            p.aggiornato_il = datetime()
+        """
+        await self.db.execute_write_query(query, {"playlist_id": playlist_id, "snapshot_id": snapshot_id})
+    
+    async def _remove_unfollowed_playlists(self, spotify_user_id: str, followed_ids: List[str]):
+        """Rimuove le relazioni SEGUE_PLAYLIST verso playlist non più seguite"""
+        query = """
+        MATCH (u:Utente {spotify_user_id: $spotify_user_id})-[r:SEGUE_PLAYLIST]->(p:Playlist)
+        WHERE NOT p.spotify_id IN $followed_ids
+        DELETE r
+        """
+        await self.db.execute_write_query(query, {
             "spotify_user_id": spotify_user_id,
-            "track_id": track_id,
-            "time_range": time_range
+            "followed_ids": followed_ids
+        })
+    
+    async def record_user_access(self, spotify_user_id: str):
+        """Registra l'ultimo accesso dell'utente (usato per priorità di re-sync)"""
+        query = """
+        MERGE (u:Utente {spotify_user_id: $spotify_user_id})
+        SET u.ultimo_accesso = datetime()
+        """
+        await self.db.execute_write_query(query, {"spotify_user_id": spotify_user_id})
+    
+    async def _get_recently_played_cursor(self, spotify_user_id: str) -> Optional[int]:
+        """Ritorna il cursore (ms Unix) dell'ultimo ascolto recente importato"""
+        result = await self.db.execute_query(
+            """
+            MATCH (u:Utente {spotify_user_id: $spotify_user_id})
+            RETURN u.cursore_ascolti_recenti as cursor
+            """,
+            {"spotify_user_id": spotify_user_id}
+        )
+        return result[0]["cursor"] if result else None
+    
+    async def _create_user_daily_listens_batch(self,
+                                               spotify_user_id: str,
+                                               rows: List[Dict],
+                                               old_cursor: Optional[int],
+                                               cursor: int) -> int:
+        """Incrementa le relazioni ASCOLTO_GIORNALIERO e avanza il cursore
+        
+        Ogni riga contiene track_id, giorno (ISO 8601), conteggio e ultimo_ascolto.
+        Le righe sono al massimo una per brano al giorno sugli ultimi 50 ascolti,
+        quindi stanno in una sola transazione insieme al cursore. Il cursore è
+        un compare-and-set su old_cursor: se un'altra sincronizzazione lo ha
+        già avanzato, il batch viene scartato e ritorna 0.
+        """
+        query = """
+        MATCH (u:Utente {spotify_user_id: $spotify_user_id})
+        // Lock in scrittura sull'utente prima di rileggere il cursore
+        SET u._lock = true
+        REMOVE u._lock
+        WITH u
+        WHERE coalesce(u.cursore_ascolti_recenti, -1) = coalesce($old_cursor, -1)
+        CALL {
+            WITH u
+            UNWIND $rows as row
+            MATCH (t:Brano {spotify_id: row.track_id})
+            MERGE (u)-[r:ASCOLTO_GIORNALIERO {giorno: date(row.giorno)}]->(t)
+            SET r.conteggio = coalesce(r.conteggio, 0) + row.conteggio,
+                r.ultimo_ascolto = CASE
+                    WHEN r.ultimo_ascolto IS NULL OR r.ultimo_ascolto < datetime(row.ultimo_ascolto)
+                    THEN datetime(row.ultimo_ascolto)
+                    ELSE r.ultimo_ascolto
+                END
+            RETURN count(r) as written
         }
+        SET u.cursore_ascolti_recenti = $cursor
+        RETURN written
+        """
         
-        self.db.execute_write_query(query, parameters)
+        result = await self.db.execute_write_query(query, {
+            "spotify_user_id": spotify_user_id,
+            "rows": rows,
+            "old_cursor": old_cursor,
+            "cursor": cursor
+        })
+        if not result:
+            logger.info(f"⏭️ Recently played cursor moved for {spotify_user_id}, batch discarded")
+            return 0
+        return result[0]["written"]
     
-    def _update_user_last_sync(self, spotify_user_id: str):
+    async def _update_user_last_sync(self, spotify_user_id: str):
         """Aggiorna il timestamp dell'ultima sincronizzazione"""
         query = """
         MATCH (u:Utente {spotify_user_id: $spotify_user_id})
@@ -318,7 +1222,43 @@ class SpotifyIngestionService:
         """
         
         parameters = {"spotify_user_id": spotify_user_id}
-        self.db.execute_write_query(query, parameters)
+        await self.db.execute_write_query(query, parameters)
+
+    async def update_user_stats(self, spotify_user_id: str) -> Dict[str, Any]:
+        """Materializza sul nodo Utente i conteggi del suo grafo
+        
+        Ogni COUNT {} è una subquery indipendente: niente prodotto cartesiano
+        tra brani, album e artisti. Viene eseguita a fine import, così
+        /import-status legge solo proprietà del nodo.
+        """
+        query = """
+        MATCH (u:Utente {spotify_user_id: $spotify_user_id})
+        SET u.conteggio_brani = COUNT { MATCH (u)-[:ASCOLTA]->(t:Brano) RETURN DISTINCT t },
+            u.conteggio_album = COUNT {
+                MATCH (u)-[:ASCOLTA]->(:Brano)<-[:CONTIENE]-(al:Album) RETURN DISTINCT al
+            },
+            u.conteggio_artisti = COUNT {
+                MATCH (u)-[:ASCOLTA]->(:Brano)<-[:ESEGUE]-(a:Artista) RETURN DISTINCT a
+            },
+            u.conteggio_generi = COUNT {
+                MATCH (u)-[:ASCOLTA]->(:Brano)<-[:ESEGUE]-(:Artista)-[:DI_GENERE]->(g:Genere)
+                RETURN DISTINCT g
+            },
+            u.ascolti_short_term = COUNT { MATCH (u)-[:ASCOLTA {time_range: "short_term"}]->() },
+            u.ascolti_medium_term = COUNT { MATCH (u)-[:ASCOLTA {time_range: "medium_term"}]->() },
+            u.ascolti_long_term = COUNT { MATCH (u)-[:ASCOLTA {time_range: "long_term"}]->() },
+            u.statistiche_aggiornate_il = datetime()
+        RETURN u.conteggio_brani as tracks,
+               u.conteggio_album as albums,
+               u.conteggio_artisti as artists,
+               u.conteggio_generi as genres,
+               {short_term: u.ascolti_short_term,
+                medium_term: u.ascolti_medium_term,
+                long_term: u.ascolti_long_term} as listens_by_time_range
+        """
+        
+        result = await self.db.execute_write_query(query, {"spotify_user_id": spotify_user_id})
+        return dict(result[0]) if result else {}
 
 # Istanza globale del servizio
 spotify_ingestion_service = SpotifyIngestionService()
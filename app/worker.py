@@ -0,0 +1,115 @@
+"""Worker Celery per gli import in background
+
+Avvio:
+    celery -A app.worker worker -Q imports --loglevel=INFO
+
+Con RESYNC_SCHEDULER_ENABLED i cicli di re-sync sono task periodici di
+celery beat, eseguiti da un worker dedicato con un solo processo, così gli
+import dello scheduler non girano nel processo API né negli slot della coda imports:
+    celery -A app.worker beat --loglevel=INFO
+    celery -A app.worker worker -Q resync --concurrency=1 --loglevel=INFO
+
+La concorrenza del worker (IMPORT_MAX_CONCURRENT_JOBS) è il limite globale
+di import pesanti eseguiti in parallelo.
+
+Ogni processo del worker (pool prefork) esegue tutti i suoi task sullo
+stesso event loop: rate limiter, connessione Neo4j, client HTTP e Redis
+sono singleton di modulo con primitive asyncio legate al loop, quindi un
+nuovo loop per task li renderebbe inutilizzabili dal secondo import in poi.
+"""
+from typing import Optional
+import asyncio
+import logging
+
+from celery import Celery
+from celery.signals import worker_process_shutdown
+
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+celery_app = Celery(
+    "music_atlas",
+    broker=settings.CELERY_BROKER_URL,
+    backend=settings.CELERY_RESULT_BACKEND
+)
+celery_app.conf.update(
+    task_acks_late=True,  # Il job torna in coda se il worker muore
+    task_reject_on_worker_lost=True,
+    worker_prefetch_multiplier=1,
+    worker_concurrency=settings.IMPORT_MAX_CONCURRENT_JOBS,
+    task_routes={
+        "music_atlas.import_user_data": {"queue": "imports"},
+        "music_atlas.resync_cycle": {"queue": "resync"},
+    },
+)
+if settings.RESYNC_SCHEDULER_ENABLED:
+    celery_app.conf.beat_schedule = {
+        "resync-cycle": {
+            "task": "music_atlas.resync_cycle",
+            "schedule": float(settings.RESYNC_CYCLE_SECONDS),
+            # Un ciclo non eseguito in tempo è superato dal successivo
+            "options": {"expires": settings.RESYNC_CYCLE_SECONDS},
+        },
+    }
+
+
+# Event loop del processo worker, creato al primo task (dopo il fork)
+_loop: Optional[asyncio.AbstractEventLoop] = None
+
+
+def _get_loop() -> asyncio.AbstractEventLoop:
+    """Ritorna l'event loop persistente del processo, creandolo se necessario"""
+    global _loop
+    if _loop is None or _loop.is_closed():
+        _loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(_loop)
+    return _loop
+
+
+async def _run_import_job(job_id: str, spotify_user_id: str):
+    from app.services.import_jobs import import_job_manager
+
+    job = await import_job_manager.get_job(spotify_user_id, job_id)
+    if job is None:
+        logger.warning(f"Import job {job_id} for {spotify_user_id} superseded or expired, skipping")
+        return
+    # I token dell'utente vengono letti (e rinnovati) dallo store condiviso
+    await import_job_manager.run_job(job)
+
+
+async def _close_clients():
+    from app.core.redis import close_redis
+    from app.database.connection import async_neo4j_db
+    from app.external.spotify_client import spotify_client
+
+    await spotify_client.close()
+    await async_neo4j_db.close()
+    await close_redis()
+
+
+@worker_process_shutdown.connect
+def close_worker_loop(**kwargs):
+    """Chiude i client async e l'event loop quando il processo worker termina"""
+    global _loop
+    if _loop is None or _loop.is_closed():
+        return
+    try:
+        _loop.run_until_complete(_close_clients())
+    finally:
+        _loop.close()
+        _loop = None
+
+
+@celery_app.task(name="music_atlas.import_user_data")
+def import_user_data_task(job_id: str, spotify_user_id: str):
+    """Task Celery che esegue un job di import sull'event loop del processo"""
+    _get_loop().run_until_complete(_run_import_job(job_id, spotify_user_id))
+
+
+@celery_app.task(name="music_atlas.resync_cycle")
+def resync_cycle_task():
+    """Task periodico (celery beat) che esegue un ciclo di re-sync"""
+    from app.services.resync_scheduler import resync_scheduler
+
+    _get_loop().run_until_complete(resync_scheduler.run_cycle())
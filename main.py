@@ -2,6 +2,13 @@ from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from app.core.config import settings
 from app.api.v1.router import api_router
+from app.external.spotify_client import spotify_client
+from app.database.connection import async_neo4j_db
+from app.database.schema import apply_migrations
+from app.core.redis import close_redis
+from app.auth.token_manager import token_manager
+from app.core.response_cache import response_cache
+from app.services.resync_scheduler import resync_scheduler
 import logging
 
 # Setup logging
@@ -20,11 +27,31 @@ app = FastAPI(
 @app.on_event("startup")
 async def startup_event():
     """Startup senza Neo4j per ora"""
+    await spotify_client.start()
+    token_manager.start()
+    if settings.NEO4J_APPLY_MIGRATIONS_ON_STARTUP:
+        try:
+            await apply_migrations()
+        except Exception as e:
+            # Il backend resta utilizzabile anche senza Neo4j raggiungibile
+            logger.error(f"Failed to apply Neo4j schema migrations: {str(e)}")
+    if settings.RESYNC_SCHEDULER_ENABLED:
+        if settings.IMPORT_JOB_BACKEND == "celery":
+            # I cicli sono task di celery beat sul worker della coda resync
+            logger.info("🔁 Resync scheduler delegated to celery beat")
+        else:
+            resync_scheduler.start()
+            logger.info("🔁 Resync scheduler started")
     logger.info("🚀 Music Atlas API started - Backend only mode")
 
 @app.on_event("shutdown")
 async def shutdown_event():
     """Shutdown event"""
+    await resync_scheduler.stop()
+    await token_manager.stop()
+    await spotify_client.close()
+    await async_neo4j_db.close()
+    await close_redis()
     logger.info("👋 Music Atlas API shutdown")
 
 # Configure CORS minimo
@@ -57,7 +84,15 @@ async def root():
 @app.get("/health")
 async def health_check():
     """Health check endpoint"""
-    return {"status": "healthy", "service": "music-atlas-api", "mode": "backend-only"}
+    return {
+        "status": "healthy",
+        "service": "music-atlas-api",
+        "mode": "backend-only",
+        "spotify": spotify_client.get_stats(),
+        "resync": resync_scheduler.get_stats(),
+        "tokens": token_manager.get_stats(),
+        "response_cache": response_cache.get_stats()
+    }
 
 if __name__ == "__main__":
     import uvicorn
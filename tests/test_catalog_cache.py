@@ -0,0 +1,70 @@
+import pytest
+
+from app.external import catalog_cache as catalog_cache_module
+from app.external.catalog_cache import CatalogCache
+
+
+class FakePipeline:
+    def __init__(self, redis):
+        self.redis = redis
+        self.commands = []
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+    def set(self, key, value, ex=None):
+        self.commands.append((key, value))
+
+    async def execute(self):
+        self.redis.pipelines += 1
+        self.redis.data.update(self.commands)
+
+
+class FakeRedis:
+    """Redis minimo che conta i round trip"""
+
+    def __init__(self):
+        self.data = {}
+        self.mgets = 0
+        self.pipelines = 0
+
+    async def mget(self, keys):
+        self.mgets += 1
+        return [self.data.get(key) for key in keys]
+
+    def pipeline(self, transaction=True):
+        return FakePipeline(self)
+
+
+@pytest.fixture
+def redis_cache(monkeypatch):
+    redis = FakeRedis()
+    monkeypatch.setattr(catalog_cache_module, "get_redis", lambda: redis)
+    cache = CatalogCache()
+    cache.redis_enabled = True
+    return cache, redis
+
+
+@pytest.mark.asyncio
+async def test_set_many_and_get_many_use_one_round_trip(redis_cache):
+    cache, redis = redis_cache
+
+    await cache.set_many("artists", [{"id": "a"}, {"id": "b"}])
+    assert redis.pipelines == 1
+
+    # Un altro processo: locale vuoto, le voci arrivano da un solo MGET
+    other = CatalogCache()
+    other.redis_enabled = True
+    entries = await other.get_many("artists", ["a", "b", "c"])
+
+    assert redis.mgets == 1
+    assert {entity_id: entry["data"] for entity_id, entry in entries.items()} == {"a": {"id": "a"}, "b": {"id": "b"}}
+    assert other.get_stats()["fresh_hits"] == 2
+    assert other.get_stats()["misses"] == 1
+
+    # Ora le voci sono anche in locale: nessun altro round trip
+    await other.get_many("artists", ["a", "b"])
+    assert redis.mgets == 1
@@ -0,0 +1,72 @@
+import pytest
+
+from app.services.spotify_service import SpotifyIngestionService
+
+
+class FakeDB:
+    """Grafo minimo: hash salvati per spotify_id e scritture registrate"""
+
+    def __init__(self, stored_hashes=None):
+        self.stored_hashes = dict(stored_hashes or {})
+        self.writes = []
+
+    async def execute_query(self, query, params):
+        return [
+            {"id": spotify_id, "hash": self.stored_hashes[spotify_id]}
+            for spotify_id in params["ids"] if spotify_id in self.stored_hashes
+        ]
+
+    async def execute_write_query(self, query, params):
+        rows = params.get("rows", [])
+        self.writes.append(rows)
+        return [{"written": len(rows)}]
+
+
+def _service(db):
+    service = SpotifyIngestionService()
+    service.db = db
+    return service
+
+
+def _track(track_id, album_id="album", popularity=50):
+    return {
+        "id": track_id,
+        "name": "Brano",
+        "duration_ms": 1000,
+        "popularity": popularity,
+        "album": {"id": album_id},
+        "artists": [{"id": "artist"}],
+    }
+
+
+def test_volatile_counters_do_not_change_the_hash():
+    row = SpotifyIngestionService._track_row(_track("t1", popularity=50))
+    bumped = SpotifyIngestionService._track_row(_track("t1", popularity=51))
+    assert SpotifyIngestionService._content_hash(row) == SpotifyIngestionService._content_hash(bumped)
+
+
+def test_link_targets_change_the_hash():
+    row = SpotifyIngestionService._track_row(_track("t1", album_id="a1"))
+    moved = SpotifyIngestionService._track_row(_track("t1", album_id="a2"))
+    assert SpotifyIngestionService._content_hash(row) != SpotifyIngestionService._content_hash(moved)
+
+
+@pytest.mark.asyncio
+async def test_unchanged_rows_are_skipped():
+    unchanged_hash = SpotifyIngestionService._content_hash(SpotifyIngestionService._track_row(_track("t1")))
+    db = FakeDB({"t1": unchanged_hash, "t2": "stale"})
+
+    stats = await _service(db)._create_or_update_tracks_batch([_track("t1"), _track("t2"), _track("t3")])
+
+    assert stats == {"written": 2, "skipped": 1}
+    assert [row["spotify_id"] for row in db.writes[0]] == ["t2", "t3"]
+
+
+@pytest.mark.asyncio
+async def test_row_without_stored_hash_is_rewritten():
+    # Un hash assente (collegamento mancante al giro precedente) forza la riscrittura
+    db = FakeDB({"t1": None})
+
+    stats = await _service(db)._create_or_update_tracks_batch([_track("t1")])
+
+    assert stats == {"written": 1, "skipped": 0}
@@ -0,0 +1,54 @@
+import gzip
+import json
+import xml.etree.ElementTree as ET
+
+import pytest
+
+from app.services.graph_export import encode, to_graphml, to_ndjson
+
+ELEMENTS = [
+    {"type": "node", "id": "Utente:u1", "label": "Utente", "properties": {"nome": "Ada & <Bob>"}},
+    {"type": "node", "id": "Artista:a1", "label": "Artista", "properties": {"nome": "Artista \"1\""}},
+    {"type": "edge", "source": "Utente:u1", "target": "Artista:a1", "label": "PREFERISCE",
+     "properties": {"time_range": "short_term", "rank": 1}},
+]
+
+
+async def _elements():
+    for element in ELEMENTS:
+        yield element
+
+
+async def _collect(chunks):
+    return [chunk async for chunk in chunks]
+
+
+@pytest.mark.asyncio
+async def test_ndjson_has_one_json_object_per_line():
+    lines = "".join(await _collect(to_ndjson(_elements()))).splitlines()
+    assert [json.loads(line) for line in lines] == ELEMENTS
+
+
+@pytest.mark.asyncio
+async def test_graphml_is_well_formed_and_escaped():
+    document = "".join(await _collect(to_graphml(_elements())))
+    ns = {"g": "http://graphml.graphdrawing.org/xmlns"}
+    graph = ET.fromstring(document).find("g:graph", ns)
+
+    nodes = graph.findall("g:node", ns)
+    assert [node.get("id") for node in nodes] == ["Utente:u1", "Artista:a1"]
+    properties = json.loads(nodes[0].find("g:data[@key='properties']", ns).text)
+    assert properties == {"nome": "Ada & <Bob>"}
+
+    edge = graph.find("g:edge", ns)
+    assert (edge.get("source"), edge.get("target")) == ("Utente:u1", "Artista:a1")
+    assert edge.find("g:data[@key='label']", ns).text == "PREFERISCE"
+
+
+@pytest.mark.asyncio
+async def test_encode_streams_a_valid_gzip_file():
+    plain = b"".join(await _collect(encode(to_ndjson(_elements()))))
+    compressed = b"".join(await _collect(encode(to_ndjson(_elements()), compress=True)))
+
+    assert compressed[:2] == b"\x1f\x8b"
+    assert gzip.decompress(compressed) == plain
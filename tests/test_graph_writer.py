@@ -0,0 +1,71 @@
+import asyncio
+
+import pytest
+
+from app.services.graph_writer import GraphWriter
+
+
+@pytest.mark.asyncio
+async def test_writes_run_in_order_and_call_on_commit():
+    written = []
+    committed = []
+
+    async def write(value):
+        written.append(value)
+        return value * 10
+
+    async def async_commit(result):
+        committed.append(("async", result))
+
+    async with GraphWriter(max_pending=2) as writer:
+        for value in range(5):
+            await writer.submit(write, value, on_commit=lambda result: committed.append(("sync", result)))
+        await writer.submit(write, 5, on_commit=[None, async_commit])
+
+    assert written == [0, 1, 2, 3, 4, 5]
+    assert committed == [("sync", 0), ("sync", 10), ("sync", 20), ("sync", 30), ("sync", 40), ("async", 50)]
+
+
+@pytest.mark.asyncio
+async def test_failed_write_stops_later_writes_and_is_raised():
+    written = []
+
+    async def write(value):
+        if value == 1:
+            raise RuntimeError("neo4j down")
+        written.append(value)
+
+    writer = GraphWriter(max_pending=10)
+    writer.start()
+    for value in range(3):
+        await writer.submit(write, value)
+
+    with pytest.raises(RuntimeError, match="neo4j down"):
+        await writer.close()
+    assert writer.failed
+    assert written == [0]
+
+
+@pytest.mark.asyncio
+async def test_submit_applies_backpressure_when_queue_is_full():
+    release = asyncio.Event()
+
+    async def blocked_write():
+        await release.wait()
+
+    async def write():
+        pass
+
+    writer = GraphWriter(max_pending=1)
+    writer.start()
+    await writer.submit(blocked_write)
+    await asyncio.sleep(0)
+    await writer.submit(write)
+
+    pending = asyncio.create_task(writer.submit(write))
+    await asyncio.sleep(0)
+    assert not pending.done()
+
+    release.set()
+    await pending
+    await writer.close()
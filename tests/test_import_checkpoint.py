@@ -0,0 +1,57 @@
+import pytest
+
+from app.services.import_checkpoint import ImportCheckpoint, batch_stage
+
+
+class MemoryCheckpointStore:
+    def __init__(self, stages=None):
+        self.stages = {"user": set(stages or [])}
+
+    async def load(self, spotify_user_id):
+        return set(self.stages.get(spotify_user_id, set()))
+
+    async def add(self, spotify_user_id, stage):
+        self.stages.setdefault(spotify_user_id, set()).add(stage)
+
+    async def clear(self, spotify_user_id):
+        self.stages.pop(spotify_user_id, None)
+
+
+def test_batch_stage_does_not_depend_on_id_order():
+    assert batch_stage("artists", ["b", "a"]) == batch_stage("artists", ["a", "b"])
+    assert batch_stage("artists", ["a"]) != batch_stage("artists", ["b"])
+
+
+@pytest.mark.asyncio
+async def test_committer_marks_stage_done_for_the_next_run():
+    store = MemoryCheckpointStore()
+    checkpoint = await ImportCheckpoint.load("user", store=store)
+    assert not checkpoint.is_done("tracks:short_term")
+
+    await checkpoint.committer("tracks:short_term")({"written": 3})
+
+    resumed = await ImportCheckpoint.load("user", store=store)
+    assert resumed.resumed_stages == 1
+    assert resumed.is_done("tracks:short_term")
+    assert resumed.skipped == 1
+
+
+@pytest.mark.asyncio
+async def test_resume_offset_starts_after_the_last_committed_page():
+    store = MemoryCheckpointStore(["saved_tracks:0", "saved_tracks:50", "saved_tracks:100", "saved_albums:0"])
+    checkpoint = await ImportCheckpoint.load("user", store=store)
+
+    assert checkpoint.resume_offset("saved_tracks", 50) == 150
+    assert checkpoint.resume_offset("saved_albums", 50) == 50
+    assert checkpoint.resume_offset("playlists", 50) == 0
+
+
+@pytest.mark.asyncio
+async def test_clear_removes_the_checkpoint():
+    store = MemoryCheckpointStore(["albums"])
+    checkpoint = await ImportCheckpoint.load("user", store=store)
+
+    await checkpoint.clear()
+
+    assert store.stages == {}
+    assert not (await ImportCheckpoint.load("user", store=store)).completed
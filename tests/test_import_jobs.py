@@ -0,0 +1,69 @@
+import asyncio
+
+import pytest
+
+from app.services.import_jobs import ImportJobManager
+from app.services.spotify_service import spotify_ingestion_service
+
+
+def _manager():
+    return ImportJobManager(backend="inprocess")
+
+
+@pytest.mark.asyncio
+async def test_duplicate_submit_returns_the_active_job(monkeypatch):
+    release = asyncio.Event()
+    calls = []
+
+    async def fake_import(spotify_user_id, access_token, progress=None, **options):
+        calls.append(spotify_user_id)
+        await release.wait()
+        return {"ok": True}
+
+    monkeypatch.setattr(spotify_ingestion_service, "import_user_data", fake_import)
+    manager = _manager()
+
+    job, created = await manager.submit("user", "token")
+    await asyncio.sleep(0)
+    again, created_again = await manager.submit("user", "token")
+
+    assert created and not created_again
+    assert again["job_id"] == job["job_id"]
+    assert await manager.run_now("user", "token") is None
+
+    release.set()
+    await manager._tasks[job["job_id"]]
+    assert calls == ["user"]
+    assert (await manager.get_status("user"))["status"] == "completed"
+
+    # Terminato il job, l'utente può avviarne un altro
+    after, created_after = await manager.submit("user", "token")
+    assert created_after
+    await manager._tasks[after["job_id"]]
+
+
+@pytest.mark.asyncio
+async def test_cancelled_import_is_not_left_running(monkeypatch):
+    started = asyncio.Event()
+
+    async def fake_import(spotify_user_id, access_token, progress=None, **options):
+        started.set()
+        await asyncio.Event().wait()
+
+    monkeypatch.setattr(spotify_ingestion_service, "import_user_data", fake_import)
+    manager = _manager()
+
+    job, _ = await manager.submit("user", "token")
+    await started.wait()
+    manager._tasks[job["job_id"]].cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await manager._tasks[job["job_id"]]
+
+    status = await manager.get_status("user")
+    assert status["status"] == "cancelled"
+    assert status["finished_at"] is not None
+
+    # Lo slot dell'utente è stato liberato
+    retry, created = await manager.submit("user", "token")
+    assert created
+    manager._tasks[retry["job_id"]].cancel()
@@ -0,0 +1,85 @@
+import asyncio
+
+import pytest
+
+from app.external.rate_limiter import AsyncTokenBucket
+
+
+class FakeClock:
+    """Clock manuale: sleep() avanza il tempo invece di attendere"""
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+    async def sleep(self, seconds):
+        self.now += seconds
+        await asyncio.sleep(0)
+
+
+def make_bucket(rate=2.0, capacity=3):
+    clock = FakeClock()
+    return AsyncTokenBucket(rate=rate, capacity=capacity, clock=clock, sleep=clock.sleep), clock
+
+
+@pytest.mark.asyncio
+async def test_burst_up_to_capacity_does_not_wait():
+    bucket, clock = make_bucket()
+
+    for _ in range(3):
+        await bucket.acquire()
+
+    assert clock.now == 0.0
+    assert bucket.get_stats()["acquired"] == 3
+    assert bucket.get_stats()["waited"] == 0
+
+
+@pytest.mark.asyncio
+async def test_burst_with_the_real_clock_is_not_counted_as_waiting():
+    bucket = AsyncTokenBucket(rate=2.0, capacity=3)
+
+    for _ in range(3):
+        await bucket.acquire()
+
+    assert bucket.get_stats()["waited"] == 0
+    assert bucket.get_stats()["total_wait_seconds"] == 0
+
+
+@pytest.mark.asyncio
+async def test_acquire_waits_for_refill_when_empty():
+    bucket, clock = make_bucket()
+    for _ in range(3):
+        await bucket.acquire()
+
+    await bucket.acquire()
+
+    assert clock.now == pytest.approx(0.5)
+    assert bucket.get_stats()["waited"] == 1
+
+
+@pytest.mark.asyncio
+async def test_pause_blocks_until_it_ends_without_burst():
+    bucket, clock = make_bucket()
+
+    bucket.pause(10)
+    await bucket.acquire()
+
+    # Fine pausa a 10s, poi un token si ricarica in 1/rate secondi
+    assert clock.now == pytest.approx(10.5)
+    assert bucket.get_stats()["pauses"] == 1
+
+
+@pytest.mark.asyncio
+async def test_waiters_are_served_in_fifo_order():
+    bucket, _ = make_bucket(capacity=1)
+    served = []
+
+    async def acquire(name):
+        await bucket.acquire()
+        served.append(name)
+
+    await asyncio.gather(*(acquire(name) for name in ["a", "b", "c"]))
+
+    assert served == ["a", "b", "c"]
@@ -0,0 +1,61 @@
+import asyncio
+
+import pytest
+
+from app.core.config import settings
+from app.core.response_cache import ResponseCache
+
+
+@pytest.mark.asyncio
+async def test_invalidate_user_makes_cached_responses_unreachable():
+    cache = ResponseCache()
+    computed = []
+
+    async def compute():
+        computed.append(1)
+        return {"items": len(computed)}
+
+    first = await cache.get_or_compute("user", "top-artists", {"limit": 10}, compute)
+    again = await cache.get_or_compute("user", "top-artists", {"limit": 10}, compute)
+    assert first == again == {"items": 1}
+
+    await cache.invalidate_user("user")
+    fresh = await cache.get_or_compute("user", "top-artists", {"limit": 10}, compute)
+    assert fresh == {"items": 2}
+
+    # Le risposte degli altri utenti restano valide
+    await cache.get_or_compute("other", "top-artists", {"limit": 10}, compute)
+    await cache.invalidate_user("user")
+    await cache.get_or_compute("other", "top-artists", {"limit": 10}, compute)
+    assert len(computed) == 3
+    assert cache.get_stats()["hits"] == 2
+
+
+@pytest.mark.asyncio
+async def test_concurrent_misses_share_one_computation():
+    cache = ResponseCache()
+    release = asyncio.Event()
+    computed = []
+
+    async def compute():
+        computed.append(1)
+        await release.wait()
+        return "value"
+
+    pending = [
+        asyncio.ensure_future(cache.get_or_compute("user", "import-status", {}, compute))
+        for _ in range(3)
+    ]
+    await asyncio.sleep(0)
+    release.set()
+    assert await asyncio.gather(*pending) == ["value"] * 3
+    assert len(computed) == 1
+
+
+@pytest.mark.parametrize("backend, workers", [("celery", 1), ("inprocess", 4)])
+def test_shared_deployments_require_the_redis_version_key(monkeypatch, backend, workers):
+    monkeypatch.setattr(settings, "IMPORT_JOB_BACKEND", backend)
+    monkeypatch.setattr(settings, "WEB_CONCURRENCY", workers)
+    monkeypatch.setattr(settings, "RESPONSE_CACHE_REDIS_ENABLED", False)
+    with pytest.raises(RuntimeError):
+        ResponseCache()
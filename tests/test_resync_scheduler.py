@@ -0,0 +1,141 @@
+import asyncio
+
+import pytest
+
+from app.core.config import settings
+from app.services.resync_scheduler import ResyncScheduler
+
+
+class FakeDB:
+    """Ritorna gli utenti già ordinati come farebbe la query di find_due_users"""
+
+    def __init__(self, user_ids):
+        self.user_ids = user_ids
+        self.parameters = None
+
+    async def execute_query(self, query, parameters=None):
+        self.parameters = parameters
+        return [{"spotify_user_id": user_id, "ritardo": None, "intervallo": 1} for user_id in self.user_ids]
+
+
+class StubSync:
+    """Sync finta: risolve il token requests_per_sync volte, come farebbe il client"""
+
+    def __init__(self, requests_per_sync=1, status="completed"):
+        self.requests_per_sync = requests_per_sync
+        self.status = status
+        self.started = []
+        self.running = 0
+        self.max_running = 0
+
+    async def __call__(self, spotify_user_id, access_token):
+        self.started.append(spotify_user_id)
+        self.running += 1
+        self.max_running = max(self.max_running, self.running)
+        for _ in range(self.requests_per_sync):
+            assert await access_token() == f"token-{spotify_user_id}"
+            await asyncio.sleep(0)
+        self.running -= 1
+        return {"status": self.status}
+
+
+async def token_for(spotify_user_id):
+    return f"token-{spotify_user_id}"
+
+
+def make_scheduler(user_ids, sync, token_provider=token_for, now=1_700_000_000.0):
+    db = FakeDB(user_ids)
+    scheduler = ResyncScheduler(db=db, sync_fn=sync, token_provider=token_provider, clock=lambda: now)
+    return scheduler, db
+
+
+@pytest.fixture
+def resync_settings(monkeypatch):
+    monkeypatch.setattr(settings, "RESYNC_MAX_CONCURRENCY", 2)
+    monkeypatch.setattr(settings, "RESYNC_REQUEST_BUDGET_PER_CYCLE", 1000)
+    return settings
+
+
+@pytest.mark.asyncio
+async def test_run_cycle_syncs_users_in_staleness_order(resync_settings):
+    sync = StubSync()
+    scheduler, db = make_scheduler(["u1", "u2", "u3"], sync, now=1234.9)
+
+    stats = await scheduler.run_cycle()
+
+    assert sync.started == ["u1", "u2", "u3"]
+    assert db.parameters["now"] == 1234
+    assert stats["due"] == 3
+    assert stats["synced"] == 3
+    assert stats["requests_used"] == 3
+    assert not stats["budget_exhausted"]
+    assert scheduler.get_stats()["cycles"] == 1
+
+
+@pytest.mark.asyncio
+async def test_run_cycle_stops_starting_syncs_when_budget_is_exhausted(resync_settings, monkeypatch):
+    monkeypatch.setattr(settings, "RESYNC_MAX_CONCURRENCY", 1)
+    monkeypatch.setattr(settings, "RESYNC_REQUEST_BUDGET_PER_CYCLE", 25)
+    sync = StubSync(requests_per_sync=10)
+    scheduler, _ = make_scheduler(["u1", "u2", "u3", "u4", "u5"], sync)
+
+    stats = await scheduler.run_cycle()
+
+    # Dopo tre sync (30 richieste) il budget è superato: u4 e u5 passano al ciclo successivo
+    assert sync.started == ["u1", "u2", "u3"]
+    assert stats["synced"] == 3
+    assert stats["requests_used"] == 30
+    assert stats["budget_exhausted"]
+
+
+@pytest.mark.asyncio
+async def test_run_cycle_respects_concurrency_cap(resync_settings):
+    sync = StubSync(requests_per_sync=5)
+    scheduler, _ = make_scheduler([f"u{i}" for i in range(6)], sync)
+
+    stats = await scheduler.run_cycle()
+
+    assert sync.max_running == 2
+    assert stats["synced"] == 6
+
+
+@pytest.mark.asyncio
+async def test_run_cycle_counts_skipped_and_failed_syncs(resync_settings):
+    async def token_provider(spotify_user_id):
+        return None if spotify_user_id == "no-token" else f"token-{spotify_user_id}"
+
+    async def sync(spotify_user_id, access_token):
+        if spotify_user_id == "busy":
+            return None
+        if spotify_user_id == "boom":
+            raise RuntimeError("Spotify API error: 500")
+        return {"status": "failed"}
+
+    scheduler, _ = make_scheduler(["no-token", "busy", "boom", "failed"], sync, token_provider=token_provider)
+
+    stats = await scheduler.run_cycle()
+
+    assert stats["skipped"] == 2
+    assert stats["failed"] == 2
+    assert stats["synced"] == 0
+
+
+@pytest.mark.asyncio
+async def test_run_cycle_is_skipped_without_the_leader_lock(resync_settings):
+    sync = StubSync()
+    held = []
+
+    async def leader_lock():
+        # Solo il primo processo che chiede il lock nel ciclo lo ottiene
+        held.append(True)
+        return len(held) == 1
+
+    leader, _ = make_scheduler(["a", "b"], sync)
+    follower, follower_db = make_scheduler(["a", "b"], sync)
+    leader.leader_lock = follower.leader_lock = leader_lock
+
+    assert (await leader.run_cycle())["synced"] == 2
+    assert await follower.run_cycle() == {"leader": False}
+    assert follower_db.parameters is None
+    assert sync.started == ["a", "b"]
+    assert follower.get_stats()["cycles_skipped"] == 1
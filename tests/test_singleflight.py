@@ -0,0 +1,134 @@
+import asyncio
+
+import pytest
+
+from app.core.singleflight import SingleFlight
+
+
+@pytest.mark.asyncio
+async def test_concurrent_calls_share_one_execution():
+    single_flight = SingleFlight()
+    calls = 0
+    release = asyncio.Event()
+
+    async def fetch():
+        nonlocal calls
+        calls += 1
+        await release.wait()
+        return "result"
+
+    tasks = [asyncio.create_task(single_flight.do("key", fetch)) for _ in range(5)]
+    await asyncio.sleep(0)
+    assert single_flight.in_flight("key")
+    release.set()
+
+    assert await asyncio.gather(*tasks) == ["result"] * 5
+    assert calls == 1
+    assert single_flight.get_stats() == {"calls": 1, "saved": 4, "retried": 0, "in_flight": 0}
+
+
+@pytest.mark.asyncio
+async def test_concurrent_calls_share_the_exception():
+    single_flight = SingleFlight()
+    release = asyncio.Event()
+
+    async def fail():
+        await release.wait()
+        raise ValueError("boom")
+
+    tasks = [asyncio.create_task(single_flight.do("key", fail)) for _ in range(3)]
+    await asyncio.sleep(0)
+    release.set()
+
+    results = await asyncio.gather(*tasks, return_exceptions=True)
+    assert all(isinstance(result, ValueError) for result in results)
+    assert not single_flight.in_flight("key")
+
+
+@pytest.mark.asyncio
+async def test_sequential_calls_and_different_keys_are_not_coalesced():
+    single_flight = SingleFlight()
+    calls = []
+
+    async def fetch(key):
+        calls.append(key)
+        return key
+
+    assert await single_flight.do("a", lambda: fetch("a")) == "a"
+    assert await single_flight.do("a", lambda: fetch("a")) == "a"
+    assert await single_flight.do("b", lambda: fetch("b")) == "b"
+    assert calls == ["a", "a", "b"]
+
+
+@pytest.mark.asyncio
+async def test_cancelled_leader_does_not_cancel_waiters():
+    single_flight = SingleFlight()
+    calls = 0
+    release = asyncio.Event()
+
+    async def fetch():
+        nonlocal calls
+        calls += 1
+        await release.wait()
+        return "result"
+
+    leader = asyncio.create_task(single_flight.do("key", fetch))
+    await asyncio.sleep(0)
+    waiter = asyncio.create_task(single_flight.do("key", fetch))
+    await asyncio.sleep(0)
+
+    leader.cancel()
+    await asyncio.sleep(0)
+    release.set()
+
+    assert await waiter == "result"
+    assert leader.cancelled()
+    assert calls == 1
+
+
+@pytest.mark.asyncio
+async def test_call_is_cancelled_when_nobody_waits_anymore():
+    single_flight = SingleFlight()
+    cancelled = asyncio.Event()
+
+    async def fetch():
+        try:
+            await asyncio.Event().wait()
+        except asyncio.CancelledError:
+            cancelled.set()
+            raise
+
+    caller = asyncio.create_task(single_flight.do("key", fetch))
+    await asyncio.sleep(0)
+    caller.cancel()
+
+    await asyncio.wait_for(cancelled.wait(), timeout=1)
+    await asyncio.sleep(0)
+    assert not single_flight.in_flight("key")
+
+
+class TokenRejected(Exception):
+    pass
+
+
+@pytest.mark.asyncio
+async def test_waiters_retry_with_their_own_fn_on_caller_specific_errors():
+    single_flight = SingleFlight(retry_on=(TokenRejected,))
+    release = asyncio.Event()
+
+    async def fetch(token):
+        await release.wait()
+        if token == "expired":
+            raise TokenRejected(token)
+        return token
+
+    leader = asyncio.create_task(single_flight.do("key", lambda: fetch("expired")))
+    await asyncio.sleep(0)
+    waiter = asyncio.create_task(single_flight.do("key", lambda: fetch("valid")))
+    await asyncio.sleep(0)
+    release.set()
+
+    with pytest.raises(TokenRejected):
+        await leader
+    assert await waiter == "valid"
+    assert single_flight.get_stats()["retried"] == 1
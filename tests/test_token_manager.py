@@ -0,0 +1,90 @@
+import asyncio
+
+import pytest
+
+from app.auth.token_manager import SpotifyTokenManager, TokenRefreshError
+from app.auth.token_store import MemoryTokenStore
+from app.core.config import settings
+
+
+class FakeClient:
+    """Endpoint di refresh finto: conta le chiamate e può fallire"""
+
+    def __init__(self, fail=False):
+        self.calls = 0
+        self.fail = fail
+        self.release = asyncio.Event()
+        self.release.set()
+
+    async def refresh_access_token(self, refresh_token):
+        self.calls += 1
+        await self.release.wait()
+        if self.fail:
+            raise RuntimeError("invalid_grant")
+        return {"access_token": f"access-{self.calls}", "expires_in": 3600}
+
+
+class Clock:
+    def __init__(self, now=1000.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+async def make_manager(expires_in, client=None, clock=None):
+    clock = clock or Clock()
+    client = client or FakeClient()
+    manager = SpotifyTokenManager(store=MemoryTokenStore(), client=client, clock=clock)
+    await manager.save_tokens("user", {"access_token": "old", "refresh_token": "r", "expires_in": expires_in})
+    return manager, client, clock
+
+
+@pytest.mark.asyncio
+async def test_concurrent_requests_with_expired_token_share_one_refresh():
+    manager, client, clock = await make_manager(expires_in=60)
+    clock.now += 120
+    client.release.clear()
+
+    pending = [asyncio.ensure_future(manager.get_access_token("user")) for _ in range(5)]
+    await asyncio.sleep(0)
+    client.release.set()
+
+    assert await asyncio.gather(*pending) == ["access-1"] * 5
+    assert client.calls == 1
+    assert manager.get_stats()["coalescing"]["saved"] == 4
+
+
+@pytest.mark.asyncio
+async def test_token_close_to_expiry_is_returned_and_refreshed_in_background():
+    manager, client, clock = await make_manager(expires_in=settings.SPOTIFY_TOKEN_REFRESH_MARGIN_SECONDS + 3600)
+    clock.now += 3600 + 1
+
+    assert await manager.get_access_token("user") == "old"
+    await asyncio.gather(*manager._background)
+
+    assert client.calls == 1
+    assert await manager.get_access_token("user") == "access-1"
+
+
+@pytest.mark.asyncio
+async def test_token_already_renewed_elsewhere_is_not_refreshed_again():
+    manager, client, _ = await make_manager(expires_in=3600 + settings.SPOTIFY_TOKEN_REFRESH_MARGIN_SECONDS)
+
+    user_data = await manager.refresh("user")
+
+    assert user_data["access_token"] == "old"
+    assert client.calls == 0
+
+
+@pytest.mark.asyncio
+async def test_failed_refresh_is_reported_to_every_waiter():
+    manager, client, clock = await make_manager(expires_in=60, client=FakeClient(fail=True))
+    clock.now += 120
+
+    results = await asyncio.gather(
+        manager.get_access_token("user"), manager.get_access_token("user"), return_exceptions=True
+    )
+
+    assert all(isinstance(result, TokenRefreshError) for result in results)
+    assert client.calls == 1